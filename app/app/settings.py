@@ -45,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the metrics include the time spent in all the other middleware
+    'core.metrics.MetricsMiddleware',
+    # Lets safe requests read from a replica, see core.db.routers
+    'core.db.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +90,72 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # Seconds to keep a connection open for the next request of the same thread,
+        # 0 closes it at the end of every request (Django's default)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+    }
+}
+
+# Pooled connections: every request takes a connection from a per process pool,
+# instead of opening a new one (see core.db.backends.postgresql_pool)
+if os.environ.get('DB_POOL') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'core.db.backends.postgresql_pool',
+        # The connection has to go back to the pool at the end of the request
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'HEALTH_CHECK': os.environ.get('DB_POOL_HEALTH_CHECK', '1') == '1',
+            'TIMEOUT': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    })
+
+# Read replicas: DB_REPLICA_HOSTS is a comma separated list of hosts that replicate
+# the primary. GET requests read from a random replica, writes go to the primary,
+# and a client that wrote reads from the primary for DATABASE_PIN_SECONDS after.
+# (The pins are kept in DATABASE_PIN_CACHE_ALIAS, it has to be shared by all
+# processes, like the list cache)
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    alias = 'replica_%d' % number
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=host.strip(),
+        NAME=os.environ.get('DB_REPLICA_NAME') or DATABASES['default']['NAME'],
+        # The tests use the primary's test database for the replicas too
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+# Shards: DB_SHARD_HOSTS is a comma separated list of hosts with more databases for
+# the recipes, tags and ingredients. Every user is on one shard (User.shard, the
+# default database is a shard too), move_user_shard moves a user to another one.
+# Every shard hands out ids from its own DATABASE_SHARD_ID_RANGE (on Postgres)
+DATABASE_SHARDS = ['default']
+for number, host in enumerate(filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(',')), 1):
+    alias = 'shard_%d' % number
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip())
+    DATABASE_SHARDS.append(alias)
+DATABASE_SHARD_ID_RANGE = 100000000
+DATABASE_SHARD_RETRY_AFTER = 5
+
+DATABASE_ROUTERS = ['core.db.routers.ShardRouter', 'core.db.routers.ReplicaRouter']
+DATABASE_PIN_SECONDS = int(os.environ.get('DB_PIN_SECONDS', 5))
+DATABASE_PIN_CACHE_ALIAS = 'default'
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# The local memory cache is per process, set CACHE_BACKEND and CACHE_LOCATION
+# to use a cache shared by all processes (like memcached)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
@@ -130,3 +200,65 @@ STATIC_URL = '/static/'
 
 # Set custom User model as Django's User model
 AUTH_USER_MODEL = 'core.User'
+
+# In memory cache of the token -> user lookups done by CachedTokenAuthentication
+# The TTL (in seconds) bounds how long other worker processes may use a stale entry
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60))
+
+# Per user cache of the tag and ingredient list responses
+RECIPE_LIST_CACHE_ENABLED = os.environ.get('RECIPE_LIST_CACHE_ENABLED', '1') == '1'
+RECIPE_LIST_CACHE_TTL = int(os.environ.get('RECIPE_LIST_CACHE_TTL', 300))
+RECIPE_LIST_CACHE_ALIAS = 'default'
+
+# The bounded pool that hashes and verifies passwords (see core.hashing)
+# When all workers are busy and the queue is full, logins and signups get a 503
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASHING_QUEUE = int(os.environ.get('PASSWORD_HASHING_QUEUE', 16))
+PASSWORD_HASHING_RETRY_AFTER = 1
+
+# Per view request metrics, served at /metrics (see core.metrics)
+# With several worker processes, set METRICS_DIR to a directory shared by all of
+# them, every process writes its metrics there at most every METRICS_FLUSH_INTERVAL
+# seconds and /metrics adds them up.
+# The directory has to be local to the machine: the files of processes that are
+# gone (by their pid) are added to an archive file, so the totals never go down.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Who may read /metrics: clients from these addresses or networks (comma separated),
+# and clients sending "Authorization: Bearer <METRICS_TOKEN>" when it's set
+METRICS_ALLOWED_IPS = [
+    ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+    if ip.strip()
+]
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# The database backed job queue (see core.jobs), run the jobs with run_worker
+# The number of jobs of each queue a single run_worker process runs at the same time
+JOB_QUEUES = {
+    'default': int(os.environ.get('JOB_CONCURRENCY', 2)),
+    'deletions': 1,
+    # Making thumbnails is CPU bound, run more worker processes to make more at once
+    'images': int(os.environ.get('JOB_IMAGE_CONCURRENCY', 1)),
+}
+# Seconds between looking for new jobs when the queues are empty
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# A running job that isn't finished after this many seconds is taken to be from a
+# crashed worker and runs again, so jobs should be safe to run more than once
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 3600))
+# Failed jobs are retried after this many seconds, doubling up to the max
+JOB_RETRY_DELAY = 10
+JOB_RETRY_MAX_DELAY = 3600
+
+# Uploaded files, like the recipe images (see recipe.images)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', '/vol/web/media')
+
+# The largest recipe image accepted in bytes, and the sizes (the longest side in
+# pixels) of the thumbnails made of every image
+RECIPE_IMAGE_MAX_SIZE = int(os.environ.get('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024))
+RECIPE_THUMBNAIL_SIZES = (128, 512, 1024)
+
+# Recipe imports up to this many bytes run in the request, larger ones are stored
+# and imported by a job, so a big import doesn't hold up a web worker
+RECIPE_IMPORT_SYNC_MAX_SIZE = int(os.environ.get('RECIPE_IMPORT_SYNC_MAX_SIZE', 1024 * 1024))
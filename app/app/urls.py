@@ -1,8 +1,15 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics
+from recipe.images import serve_image
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
-    path('api/recipe/', include('recipe.urls'))
+    path('api/recipe/', include('recipe.urls')),
+    path('metrics', metrics, name='metrics'),
+    # The recipe images, with cache headers for their content hashed names
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_image, name='media'),
 ]
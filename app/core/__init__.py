@@ -0,0 +1,2 @@
+# So Django uses our CoreConfig (and runs its ready) when we add 'core' to INSTALLED_APPS
+default_app_config = 'core.apps.CoreConfig'
@@ -3,6 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 # Used for translations (just like wordpress)
 from django.utils.translation import gettext as _
 from core import models
+from core.deletion import schedule_user_deletion
 
 
 # Inherite from Django's default UserAdmin
@@ -29,8 +30,55 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    # Deleting users only deactivates them, a background job removes their
+    # data in batches later (see core.deletion)
+    def get_deleted_objects(self, objs, request):
+        """List only the users on the confirmation page, without collecting their data"""
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.opts.verbose_name)
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, \
+            perms_needed, []
+
+    def delete_model(self, request, obj):
+        """Schedule the deletion of a single user"""
+        schedule_user_deletion(obj)
+
+    def delete_queryset(self, request, queryset):
+        """Schedule the deletion of the selected users"""
+        for obj in queryset:
+            schedule_user_deletion(obj)
+
+
+class UserDeletionAdmin(admin.ModelAdmin):
+    """Shows the progress of the scheduled user deletions"""
+    ordering = ['-requested']
+    list_display = ['email', 'requested', 'step', 'deleted', 'total', 'finished']
+    readonly_fields = ['user', 'email', 'requested', 'step', 'deleted', 'total', 'finished']
+
+    # Only the deletion jobs create and change them
+    def has_add_permission(self, request):
+        return False
+
+
+class JobAdmin(admin.ModelAdmin):
+    """Shows the jobs of the job queue and how they did"""
+    ordering = ['-created']
+    list_display = ['task', 'queue', 'status', 'attempts', 'created', 'finished']
+    list_filter = ['queue', 'status']
+    readonly_fields = [
+        'queue', 'task', 'arguments', 'status', 'attempts', 'max_attempts', 'run_at',
+        'worker', 'locked_until', 'created', 'started', 'finished', 'result', 'error',
+    ]
+
+    # The jobs are queued by the code (see core.jobs)
+    def has_add_permission(self, request):
+        return False
+
 
 admin.site.register(models.Ingredient)
 admin.site.register(models.Tag)
 admin.site.register(models.Recipe)
 admin.site.register(models.User, UserAdmin)
+admin.site.register(models.UserDeletion, UserDeletionAdmin)
+admin.site.register(models.Job, JobAdmin)
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    # Called once Django has loaded all the apps and models
+    def ready(self):
+        # Importing the modules connects their signal receivers
+        from core import authentication, signals  # noqa: F401
+
+        # Registers the @task functions of the tasks modules of all the apps, so
+        # both the web processes and the workers know them by name
+        from core.jobs import autodiscover
+        autodiscover()
@@ -0,0 +1,170 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.base import ModelState
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.db.routers import reading_from_replica
+
+
+class TokenCache:
+    """Thread safe LRU cache of token key -> token (with the user), with a TTL
+
+    IMPORTANT: The cache lives in the memory of a single process, so the
+    invalidation signals only reach the process that made the change.
+    The TTL is what bounds how stale the other worker processes can be.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (token, expires), ordered from least to most recently used
+        self._entries = OrderedDict()
+        # user id -> set of keys, so we can invalidate all tokens of a user
+        self._user_keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached token for the key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, token):
+        """Cache the token, evicting the least recently used when full"""
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (token, time.monotonic() + self.ttl)
+            self._user_keys.setdefault(token.user_id, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        """Remove a single token from the cache"""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        """Remove all the tokens of the user from the cache"""
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        """Remove everything from the cache and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return the hit and miss counters and the current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    # Needs to be called with the lock held
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        user_id = entry[0].user_id
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+# The one cache shared by all threads of this process
+token_cache = TokenCache(
+    maxsize=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches the token and user lookup in memory"""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+
+        if token is None:
+            # Same checks as the TokenAuthentication we extend
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                # The lookup may have gone to a replica that doesn't have a new token yet
+                if not reading_from_replica():
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                try:
+                    token = model.objects.using(DEFAULT_DB_ALIAS).select_related('user').get(
+                        key=key
+                    )
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+            token_cache.set(key, token)
+
+        # Every request gets its own copy of the user, since views may change it
+        return (_clone(token.user), token)
+
+
+def _clone(instance):
+    """Return a shallow copy of a model instance that shares no state"""
+    clone = copy.copy(instance)
+    clone._state = ModelState()
+    clone._state.db = instance._state.db
+    clone._state.adding = instance._state.adding
+    return clone
+
+
+# Deleting a token also covers regenerating it, since that deletes the old one
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Remove a deleted token from the cache"""
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=Token)
+def invalidate_saved_token(sender, instance, **kwargs):
+    """Remove a changed token from the cache"""
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """Remove all the tokens of a changed, deactivated or deleted user"""
+    token_cache.invalidate_user(instance.pk)
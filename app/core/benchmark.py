@@ -0,0 +1,208 @@
+import http.client
+import json
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from django.contrib.auth import get_user_model
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from core.authentication import token_cache
+from core.metrics import QueryTimer
+from core.seed import DatasetGenerator
+from recipe.cache import get_list_cache
+
+
+# The datasets to benchmark on, passed on to core.seed.DatasetGenerator
+SCALES = {
+    'small': {'users': 10, 'recipes_per_user': 10},
+    'medium': {'users': 100, 'recipes_per_user': 100},
+    'large': {'users': 1000, 'recipes_per_user': 500},
+}
+
+# name -> (method, url name), every endpoint is requested as the same user
+ENDPOINTS = (
+    ('recipes', 'GET', 'recipe:recipe-list'),
+    ('tags', 'GET', 'recipe:tag-list'),
+    ('ingredients', 'GET', 'recipe:ingredient-list'),
+    ('token', 'POST', 'user:token'),
+    ('me', 'GET', 'user:me'),
+)
+
+PASSWORD = 'benchmark'
+
+
+def percentile(timings, p):
+    """Return the p-th percentile of the sorted timings"""
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+class ClientDriver:
+    """Send the requests in process with Django's test client, counting the queries"""
+
+    name = 'client'
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, url, body, headers):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = self.client.generic(
+                method, url, body, content_type='application/json',
+                **{'HTTP_' + key.upper(): value for key, value in headers.items()}
+            )
+        return response.status_code, timer.count
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that doesn't log every request to stderr"""
+
+    def log_message(self, *args):
+        pass
+
+
+class WSGIDriver:
+    """Send the requests over HTTP to a real WSGI server (wsgiref) on a thread
+
+    The queries run on the server thread, so they aren't counted here.
+    """
+
+    name = 'wsgi'
+
+    def __init__(self):
+        self.server = make_server(
+            '127.0.0.1', 0, get_wsgi_application(), handler_class=QuietRequestHandler
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def request(self, method, url, body, headers):
+        # wsgiref speaks HTTP/1.0, so every request has its own connection
+        http_connection = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            # The test environment allows the 'testserver' host, like for the test client
+            http_connection.request(method, url, body, dict(
+                headers, **{'Content-Type': 'application/json', 'Host': 'testserver'}
+            ))
+            response = http_connection.getresponse()
+            response.read()
+            return response.status, None
+        finally:
+            http_connection.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {'client': ClientDriver, 'wsgi': WSGIDriver}
+
+
+class ApiBenchmark:
+    """Seed a dataset and measure the API endpoints on it
+
+    The results are a dict of '<scale>.<driver>.<endpoint>' -> measurements,
+    with throughput (rps), latency percentiles in ms and queries per request.
+    """
+
+    def __init__(self, drivers=('client', 'wsgi'), requests=100, warmup=5, seed=0):
+        self.drivers = drivers
+        self.requests = requests
+        self.warmup = warmup
+        self.seed = seed
+        self.results = {}
+
+    def run_scale(self, scale, sizes):
+        """Seed the dataset of the scale and benchmark all endpoints on all drivers"""
+        # Nothing cached for the previous scale may be used for this one
+        get_list_cache().clear()
+        token_cache.clear()
+        DatasetGenerator(seed=self.seed, prefix=scale, password=PASSWORD, **sizes).run()
+
+        # Benchmark as the user with the most recipes, to show how the endpoints scale
+        user = get_user_model().objects.annotate(
+            recipes=Count('recipe')
+        ).order_by('-recipes', 'id').first()
+        token, _ = Token.objects.get_or_create(user=user)
+
+        for driver_name in self.drivers:
+            driver = DRIVERS[driver_name]()
+            try:
+                for name, method, url_name in ENDPOINTS:
+                    if method == 'POST':
+                        body = json.dumps({'email': user.email, 'password': PASSWORD})
+                        headers = {}
+                    else:
+                        body = ''
+                        headers = {'Authorization': 'Token ' + token.key}
+
+                    key = '{}.{}.{}'.format(scale, driver_name, name)
+                    self.results[key] = self.measure(
+                        driver, method, reverse(url_name), body, headers
+                    )
+            finally:
+                driver.close()
+
+        return self.results
+
+    def measure(self, driver, method, url, body, headers):
+        """Send the request warmup + requests times and return the measurements"""
+        for _ in range(self.warmup):
+            driver.request(method, url, body, headers)
+
+        timings = []
+        queries = None
+        start = time.perf_counter()
+        for _ in range(self.requests):
+            request_start = time.perf_counter()
+            status_code, queries = driver.request(method, url, body, headers)
+            timings.append(time.perf_counter() - request_start)
+            if status_code >= 400:
+                raise RuntimeError('{} {} returned {}'.format(method, url, status_code))
+        elapsed = time.perf_counter() - start
+
+        timings.sort()
+        return {
+            'rps': round(self.requests / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'queries': queries,
+        }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of regressions of the results compared to the baseline
+
+    The query count is deterministic, so any increase is a regression. The timings
+    depend on the machine, so they only regress when more than 'tolerance' worse.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+
+        if None not in (result['queries'], expected.get('queries')) \
+                and result['queries'] > expected['queries']:
+            regressions.append('{}: {} queries, baseline {}'.format(
+                key, result['queries'], expected['queries']
+            ))
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {:.3f} ms, baseline {:.3f} ms'.format(
+                key, result['p95_ms'], expected['p95_ms']
+            ))
+        if result['rps'] < expected['rps'] / (1 + tolerance):
+            regressions.append('{}: {:.1f} requests/s, baseline {:.1f}'.format(
+                key, result['rps'], expected['rps']
+            ))
+    return regressions
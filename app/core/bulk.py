@@ -0,0 +1,139 @@
+import io
+
+from django.db import connections, router, transaction
+
+
+def bulk_insert(model, objects, using=None):
+    """Insert the objects as fast as the database allows and set their ids
+
+    On Postgres the ids are taken from the sequence up front and the rows are
+    written with COPY, the fastest way to load rows into Postgres.
+    On the other databases we fall back to bulk_create, or to saving one by one
+    when the database can't return the ids of a bulk insert (SQLite).
+    """
+    db = using or router.db_for_write(model)
+    connection = connections[db]
+    if not objects:
+        return objects
+
+    if connection.vendor == 'postgresql':
+        pk = model._meta.pk
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                [model._meta.db_table, pk.column, len(objects)]
+            )
+            for obj, (pk_value,) in zip(objects, cursor.fetchall()):
+                setattr(obj, pk.attname, pk_value)
+
+        fields = model._meta.concrete_fields
+        rows = (
+            [field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields]
+            for obj in objects
+        )
+        copy_rows(model._meta.db_table, [field.column for field in fields], rows, using=db)
+        for obj in objects:
+            obj._state.adding = False
+            obj._state.db = db
+        return objects
+
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.using(db).bulk_create(objects)
+
+    with transaction.atomic(using=db):
+        for obj in objects:
+            obj.save(using=db, force_insert=True)
+    return objects
+
+
+def bulk_insert_rows(model, fields, rows, using=None):
+    """Insert rows of raw values for the given fields, when no ids are needed
+
+    Made for the through tables of many to many relations, so we can add
+    millions of (recipe_id, tag_id) rows without creating model instances.
+    """
+    db = using or router.db_for_write(model)
+    connection = connections[db]
+
+    if connection.vendor == 'postgresql':
+        columns = [model._meta.get_field(field).column for field in fields]
+        copy_rows(model._meta.db_table, columns, rows, using=db)
+        return
+
+    # Note: Only the model instances are created here, not the related objects
+    attnames = [model._meta.get_field(field).attname for field in fields]
+    model.objects.using(db).bulk_create(
+        (model(**dict(zip(attnames, row))) for row in rows),
+        batch_size=500
+    )
+
+
+def delete_rows(model, ids, using=None, chunk_size=500):
+    """Delete the rows with the given ids with plain DELETE ... WHERE id IN (...)
+
+    Nothing is loaded and no signals are sent, unlike QuerySet.delete which
+    collects every row (and everything referring to it) in Python first.
+    The caller makes sure nothing refers to the rows anymore. Returns the
+    number of rows deleted.
+    """
+    db = using or router.db_for_write(model)
+    connection = connections[db]
+    quote = connection.ops.quote_name
+    ids = list(ids)
+
+    deleted = 0
+    with connection.cursor() as cursor:
+        # SQLite allows at most 999 parameters in a query, so delete in chunks
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+                quote(model._meta.db_table),
+                quote(model._meta.pk.column),
+                ', '.join(['%s'] * len(chunk)),
+            ), chunk)
+            deleted += cursor.rowcount
+    return deleted
+
+
+def copy_rows(table, columns, rows, using='default', chunk_size=10000):
+    """Write the rows into the table with Postgres' COPY ... FROM STDIN
+
+    The rows are sent in chunks, so a generator of rows never has to be
+    held in memory completely.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = 'COPY {} ({}) FROM STDIN'.format(
+        quote(table), ', '.join(quote(column) for column in columns)
+    )
+
+    with connection.cursor() as cursor:
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(value) for value in row))
+            buffer.write('\n')
+            count += 1
+            if count % chunk_size == 0:
+                _copy_buffer(cursor, sql, buffer)
+                buffer = io.StringIO()
+
+        if buffer.tell():
+            _copy_buffer(cursor, sql, buffer)
+
+
+# The characters that have to be escaped in COPY's text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value):
+    """Format a single value for COPY's text format, where \\N means NULL"""
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def _copy_buffer(cursor, sql, buffer):
+    """Send a single chunk of rows to the database"""
+    buffer.seek(0)
+    cursor.copy_expert(sql, buffer)
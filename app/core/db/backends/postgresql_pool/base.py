@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions, pool
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgresDatabaseCreation
+
+
+# Defaults for the 'POOL' dict in the DATABASES settings
+POOL_DEFAULTS = {
+    'MIN_SIZE': 1,          # Connections opened when the pool is created
+    'MAX_SIZE': 10,         # Most connections open at the same time, per process
+    'MAX_LIFETIME': 1800,   # Seconds after which a connection is replaced
+    'HEALTH_CHECK': True,   # Run SELECT 1 on checkout, replacing dead connections
+    'TIMEOUT': 10,          # Seconds to wait for a free connection when all are in use
+}
+
+
+class ConnectionPool:
+    """Thread safe pool of psycopg2 connections with a health check and max lifetime"""
+
+    def __init__(self, conn_params, min_size, max_size, max_lifetime, health_check, timeout):
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.timeout = timeout
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        # psycopg2's pool raises right away when exhausted, this lets callers wait
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._created = {}
+
+    def getconn(self):
+        """Check out a healthy connection, waiting up to the timeout for one"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(
+                'Connection pool exhausted, no connection within %s seconds' % self.timeout
+            )
+
+        try:
+            while True:
+                connection = self._pool.getconn()
+                with self._lock:
+                    created = self._created.setdefault(id(connection), time.monotonic())
+
+                expired = time.monotonic() - created > self.max_lifetime
+                if expired or not self._is_healthy(connection):
+                    self._discard(connection)
+                    continue
+                return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        """Return a connection to the pool, rolling back anything left open"""
+        try:
+            if connection.closed:
+                self._discard(connection)
+                return
+
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                self._discard(connection)
+                return
+
+            self._pool.putconn(connection)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Close all the connections of the pool"""
+        self._pool.closeall()
+
+    def _is_healthy(self, connection):
+        """Return if the connection is still usable, with a round trip if configured"""
+        if connection.closed:
+            return False
+        if not self.health_check:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            # Outside autocommit the check opened a transaction, don't leave it open
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        """Close the connection and drop it from the pool"""
+        with self._lock:
+            self._created.pop(id(connection), None)
+        self._pool.putconn(connection, close=True)
+
+
+# The pools of this process per (process id, alias, connection params)
+# The process id is part of the key so forked workers never share connections
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, config):
+    """Return the pool for the database, creating it on first use"""
+    key = (os.getpid(), alias, tuple(sorted((k, str(v)) for k, v in conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                conn_params,
+                min_size=config['MIN_SIZE'],
+                max_size=config['MAX_SIZE'],
+                max_lifetime=config['MAX_LIFETIME'],
+                health_check=config['HEALTH_CHECK'],
+                timeout=config['TIMEOUT'],
+            )
+        return _pools[key]
+
+
+def close_pools():
+    """Close the connections of all the pools of this process"""
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            _pools.pop(key).closeall()
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep Postgres from dropping the test database
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """The Postgres backend, with connections taken from and returned to a pool
+
+    Use it with CONN_MAX_AGE = 0, so Django returns the connection to the pool
+    at the end of every request instead of keeping it for the thread.
+    """
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        config = dict(POOL_DEFAULTS, **self.settings_dict.get('POOL', {}))
+        self.connection_pool = get_pool(self.alias, conn_params, config)
+        connection = self.connection_pool.getconn()
+
+        # Same as the Postgres backend we extend, see its get_new_connection
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+
+        return connection
+
+    def _close(self):
+        # Instead of closing, the connection goes back into the pool
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.putconn(self.connection)
@@ -0,0 +1,179 @@
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.db.sharding import is_sharded, shard_for_user, sharded_models
+
+
+# What the router knows about the request of the current thread
+_state = threading.local()
+
+# Requests with these methods only read, so they may read from a replica
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replicas():
+    """Return the aliases of the read replicas, from the DATABASE_REPLICAS setting"""
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def request_replica():
+    """Return the replica the reads of the current thread go to, None for the primary"""
+    return getattr(_state, 'replica', None)
+
+
+def reading_from_replica():
+    """Return if reads of the current thread may go to a replica"""
+    return request_replica() is not None
+
+
+class ShardRouter:
+    """Send the queries of the user owned models to the shard of their user
+
+    A query only knows its user from the instance hint Django gives for related
+    lookups and saves (recipe.tags.all(), user.recipe_set, recipe.save(), ...).
+    Other queries have to pick the shard themselves, with for_user() or using().
+    Objects on the default shard are left to the next router (the replicas).
+    """
+
+    def _shard(self, model, hints):
+        """Return the shard for a query on the model, None when unknown or default"""
+        instance = hints.get('instance')
+        if instance is None or not is_sharded() or model not in sharded_models():
+            return None
+
+        if isinstance(instance, get_user_model()):
+            shard = shard_for_user(instance)
+        elif instance._state.db is not None:
+            shard = instance._state.db
+        elif getattr(instance, 'user_id', None) is not None:
+            shard = shard_for_user(instance.user)
+        else:
+            return None
+
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        models = sharded_models()
+        if type(obj1) not in models and type(obj2) not in models:
+            return None
+
+        # An object may belong to a user on the default database, but the
+        # objects of a user only relate to each other on the same shard
+        if isinstance(obj1, get_user_model()) or isinstance(obj2, get_user_model()):
+            return True
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard gets all the tables, the unused ones just stay empty
+        return None
+
+
+class ReplicaRouter:
+    """Send the writes to the primary and the reads of safe requests to a replica
+
+    Reads only go to a replica during a GET, HEAD or OPTIONS request that
+    ReplicaRoutingMiddleware allowed to, everything else (other requests, commands,
+    tests) reads from the primary. A request that wrote pins its client to the
+    primary for a while, so they read their own writes (see the middleware).
+    """
+
+    def _elsewhere(self, hints):
+        """Return if the hinted instance is on another database (like a shard)"""
+        instance = hints.get('instance')
+        return instance is not None and instance._state.db not in (
+            None, DEFAULT_DB_ALIAS, *replicas()
+        )
+
+    def db_for_read(self, model, **hints):
+        # Related objects of an instance on another database are on that database too
+        if self._elsewhere(hints):
+            return None
+
+        replica = request_replica()
+        # Inside a transaction we have to see what the transaction wrote
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if self._elsewhere(hints):
+            return None
+
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get their tables through replication
+        if db in replicas():
+            return False
+        return None
+
+
+def pin_key(request):
+    """Return the cache key that pins the client of the request to the primary"""
+    # Clients are told apart by their token (or session), hashed so it isn't stored
+    credentials = request.META.get('HTTP_AUTHORIZATION') \
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'db-pin:' + hashlib.md5(credentials.encode()).hexdigest()
+
+
+def get_pin_cache():
+    """Return the cache the pins are stored in, from the DATABASE_PIN_CACHE_ALIAS setting"""
+    return caches[getattr(settings, 'DATABASE_PIN_CACHE_ALIAS', 'default')]
+
+
+class ReplicaRoutingMiddleware:
+    """Allow safe requests to read from a replica, unless the client just wrote
+
+    After a request that wrote to the primary, the client reads from the primary
+    for DATABASE_PIN_SECONDS, so the replication lag never shows them stale data.
+    With several processes the pins have to be in a shared cache (like memcached).
+
+    A request reads from a single replica, picked at random when it starts. The
+    replicas lag behind by different amounts, so a data version read from one
+    and the list read from another could disagree (and be cached that way).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        key = pin_key(request)
+        cache = get_pin_cache()
+        read_replica = request.method in SAFE_METHODS and not (
+            key is not None and cache.get(key)
+        )
+        _state.replica = random.choice(replicas()) if read_replica else None
+        _state.wrote = False
+
+        try:
+            return self.get_response(request)
+        finally:
+            if _state.wrote and key is not None:
+                cache.set(key, True, getattr(settings, 'DATABASE_PIN_SECONDS', 5))
+            _state.replica = None
+            _state.wrote = False
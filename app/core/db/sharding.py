@@ -0,0 +1,248 @@
+import time
+import zlib
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.bulk import bulk_insert_rows, delete_rows
+
+
+# The user owned models that live on the shard of their user, with their through
+# tables. The users themselves (and their tokens and data versions) always stay on
+# the default database, which is the directory of what user is on what shard.
+SHARDED_MODELS = ('core.Tag', 'core.Ingredient', 'core.Recipe')
+
+
+class ShardMoving(APIException):
+    """Raised on writes of a user that is being moved to another shard"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Your data is being moved, please try again shortly.')
+    default_code = 'shard_moving'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns this into the Retry-After header
+        self.wait = wait
+
+
+def shards():
+    """Return the aliases of the shards, from the DATABASE_SHARDS setting"""
+    return getattr(settings, 'DATABASE_SHARDS', None) or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded():
+    """Return if there is more than one shard"""
+    return len(shards()) > 1
+
+
+@lru_cache(maxsize=None)
+def sharded_models():
+    """Return the sharded models, including their many to many through models"""
+    models = [apps.get_model(label) for label in SHARDED_MODELS]
+    for model in list(models):
+        models.extend(field.remote_field.through for field in model._meta.many_to_many)
+    return frozenset(models)
+
+
+def choose_shard(email):
+    """Return the shard for a new user, the same email always gives the same shard"""
+    aliases = shards()
+    return aliases[zlib.crc32(email.lower().encode()) % len(aliases)]
+
+
+def shard_for_user(user):
+    """Return the shard of the user (a User or a user id)"""
+    shard = getattr(user, 'shard', None)
+    if shard is not None:
+        return shard
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+
+    # Only a user id, the users are always on the default database
+    shard = get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=user
+    ).values_list('shard', flat=True).first()
+    return shard or DEFAULT_DB_ALIAS
+
+
+def check_shard_writable(user):
+    """Refresh the user's shard from the database, raise ShardMoving while it moves
+
+    Called before the writes of a request, since the authenticated user may come
+    from a cache that doesn't know the user moved to another shard yet.
+    """
+    if not is_sharded():
+        return
+
+    shard, moving = get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=user.pk
+    ).values_list('shard', 'shard_moving').get()
+    if moving:
+        raise ShardMoving(wait=getattr(settings, 'DATABASE_SHARD_RETRY_AFTER', 5))
+    user.shard = shard
+
+
+def user_rows(user_id, using):
+    """Return the querysets of all the rows of the user on a database, in delete order
+
+    The through rows go first, then the recipes, ingredients and tags. That
+    includes the through rows from before the tags and ingredients were checked
+    to be the user's own, which can link another user's recipe to ours.
+    """
+    rows = []
+    for field in apps.get_model('core.Recipe')._meta.many_to_many:
+        through = field.remote_field.through
+        rows.append(through.objects.using(using).filter(recipe__user_id=user_id))
+        rows.append(through.objects.using(using).filter(**{
+            field.m2m_reverse_field_name() + '__user_id': user_id
+        }))
+    for label in reversed(SHARDED_MODELS):
+        rows.append(apps.get_model(label).objects.using(using).filter(user_id=user_id))
+    return rows
+
+
+def delete_user_rows(user_id, using, batch_size=1000):
+    """Delete all the rows of the user from a database in batches, return the number deleted
+
+    Plain DELETEs (see core.bulk.delete_rows), not QuerySet.delete: that loads
+    every row through the collector and bumps the data version once per row.
+    Nothing is bumped here, the caller bumps once when it's done.
+    """
+    deleted = 0
+    for rows in user_rows(user_id, using):
+        while True:
+            ids = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic(using=using):
+                deleted += delete_rows(rows.model, ids, using=using)
+    return deleted
+
+
+def reserve_id_range(using):
+    """Start the id sequences of a shard in its own range, so ids are unique on all shards
+
+    Moving a user to another shard keeps the ids of their objects (they are in
+    the API urls), which only works when no two shards hand out the same ids.
+    The shard at position n of DATABASE_SHARDS gets the ids from n * DATABASE_SHARD_ID_RANGE.
+    """
+    connection = connections[using]
+    if using not in shards() or connection.vendor != 'postgresql':
+        return
+
+    start = shards().index(using) * getattr(settings, 'DATABASE_SHARD_ID_RANGE', 100000000)
+    if not start:
+        return
+
+    with connection.cursor() as cursor:
+        for model in sharded_models():
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [
+                model._meta.db_table, model._meta.pk.column
+            ])
+            sequence = cursor.fetchone()[0]
+            # Only moves the sequence forward, so running it again changes nothing
+            cursor.execute(
+                'SELECT setval(%s, %s, false) WHERE (SELECT last_value FROM {}) < %s'.format(
+                    sequence
+                ),
+                [sequence, start, start]
+            )
+
+
+class ShardMover:
+    """Move all the tags, ingredients and recipes of a user to another shard, online
+
+    1. The rows are copied while the user keeps using the old shard
+    2. The user's writes are fenced (they get a 503 with Retry-After), and when
+       anything changed during the copy it's copied again
+    3. The user is switched to the new shard and the fence is lifted
+    4. After 'settle' seconds, when no process has the old shard cached anymore,
+       the rows are deleted from the old shard
+    """
+
+    def __init__(self, batch_size=1000, grace=2, settle=None, log=None):
+        self.batch_size = batch_size
+        # Seconds for the writes that passed the fence check just before, to finish
+        self.grace = grace
+        # The authenticated users are cached up to TOKEN_CACHE_TTL in every process
+        self.settle = settle if settle is not None else getattr(settings, 'TOKEN_CACHE_TTL', 60)
+        self.log = log or (lambda message: None)
+
+    def move(self, user, target):
+        """Move the user's data to the target shard"""
+        from core.authentication import token_cache
+        from core.models import DataVersion
+        from recipe.cache import invalidate_list_cache
+
+        source = user.shard
+        users = get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(pk=user.pk)
+
+        version = DataVersion.objects.get_for_user(user.pk)[0]
+        self.log('Copying from %s to %s' % (source, target))
+        self.copy(user.pk, source, target)
+
+        # The updates of the user send no post_save, so remove the cached user (with
+        # its shard) ourselves. The other processes pick it up within TOKEN_CACHE_TTL,
+        # which is why the source rows are kept for 'settle' seconds
+        users.update(shard_moving=True)
+        token_cache.invalidate_user(user.pk)
+        try:
+            time.sleep(self.grace)
+            if DataVersion.objects.get_for_user(user.pk)[0] != version:
+                self.log('Changed during the copy, copying again')
+                self.delete(user.pk, target)
+                self.copy(user.pk, source, target)
+
+            users.update(shard=target, shard_moving=False)
+        except BaseException:
+            users.update(shard_moving=False)
+            raise
+        finally:
+            token_cache.invalidate_user(user.pk)
+        user.shard = target
+
+        # The update sends no signals. Not in copy, a bump there would look like
+        # a change during the copy
+        invalidate_list_cache(user.pk)
+
+        self.log('Switched, removing from %s in %s seconds' % (source, self.settle))
+        time.sleep(self.settle)
+        self.delete(user.pk, source)
+        # The lists cached during the settle by the processes that still read the
+        # source shard are from before the delete, so bump once more
+        invalidate_list_cache(user.pk)
+
+    def copy(self, user_id, source, target):
+        """Copy the rows of the user from the source to the target shard, keeping the ids"""
+        with transaction.atomic(using=target):
+            for label in SHARDED_MODELS:
+                model = apps.get_model(label)
+                fields = [field.name for field in model._meta.concrete_fields]
+                rows = model.objects.using(source).filter(user_id=user_id).order_by('pk')
+                bulk_insert_rows(model, fields, self.chunked(
+                    rows.values_list(*[field.attname for field in model._meta.concrete_fields])
+                ), using=target)
+
+            recipe_model = apps.get_model('core.Recipe')
+            for field in recipe_model._meta.many_to_many:
+                through = field.remote_field.through
+                column = field.m2m_reverse_field_name()
+                rows = through.objects.using(source).filter(
+                    recipe__user_id=user_id
+                ).order_by('pk').values_list('recipe_id', column + '_id')
+                # The through rows get new ids, nothing refers to them
+                bulk_insert_rows(through, ['recipe', column], self.chunked(rows), using=target)
+
+    def delete(self, user_id, using):
+        """Delete the rows of the user from a shard, in batches"""
+        delete_user_rows(user_id, using, batch_size=self.batch_size)
+
+    def chunked(self, queryset):
+        """Iterate the rows with a server side cursor, batch_size rows at a time"""
+        return queryset.iterator(chunk_size=self.batch_size)
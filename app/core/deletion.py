@@ -0,0 +1,130 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.bulk import delete_rows
+from core.db.sharding import shard_for_user, user_rows
+from core.jobs import enqueue
+from core.models import Ingredient, Recipe, Tag, UserDeletion
+
+
+# The user owned models counted in the progress, they are deleted in the order of
+# core.db.sharding.user_rows (after the through rows)
+OWNED_MODELS = (Recipe, Tag, Ingredient)
+
+
+def schedule_user_deletion(user):
+    """Deactivate the user right away and queue a job that deletes their data
+
+    Returns the UserDeletion, scheduling the same user again returns the existing one.
+    The total to delete is counted by the job, counting here would slow down the request.
+    """
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        # Saving sends post_save, which removes the user's tokens from the token cache
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        Token.objects.filter(user=user).delete()
+
+        deletion, created = UserDeletion.objects.get_or_create(
+            user=user, defaults={'email': user.email}
+        )
+        # The job runs in the background on the deletions queue (see core.tasks)
+        if created:
+            enqueue('core.tasks.delete_user', deletion.pk)
+
+    return deletion
+
+
+class UserDeleter:
+    """Delete the data of the scheduled users in batches, resumable at any point
+
+    Every batch is a plain DELETE of at most batch_size ids in its own short
+    transaction, so no table is locked for long and no rows are loaded into
+    Python. Each batch looks up the ids that are still there, so a deletion that
+    stopped halfway (a crash or a deploy) continues where it was when run again.
+    """
+
+    def __init__(self, batch_size=1000, pause=0, log=None):
+        self.batch_size = batch_size
+        # Seconds between the batches, to leave room for the other queries
+        self.pause = pause
+        self.log = log or (lambda message: None)
+
+    def run_pending(self):
+        """Run all the unfinished deletions, oldest first, return how many ran"""
+        pending = UserDeletion.objects.using(DEFAULT_DB_ALIAS).filter(
+            finished__isnull=True
+        ).order_by('requested')
+
+        count = 0
+        for deletion in pending:
+            self.run(deletion)
+            count += 1
+        return count
+
+    def run(self, deletion):
+        """Delete the data of the user and then the user itself"""
+        user_id = deletion.user_id
+        # Without the user a previous run got to the very end already
+        if user_id is not None:
+            db = shard_for_user(user_id)
+            self.log('Deleting %s from %s' % (deletion.email, db))
+
+            # What's left plus what a previous run deleted already, so it's right on resume
+            deletion.total = deletion.deleted + sum(
+                model.objects.using(db).filter(user_id=user_id).count()
+                for model in OWNED_MODELS
+            )
+            UserDeletion.objects.using(DEFAULT_DB_ALIAS).filter(pk=deletion.pk).update(
+                total=deletion.total
+            )
+
+            for model, rows, counted in self.steps(user_id, db):
+                deletion.step = model._meta.label
+                while self.delete_batch(deletion, rows, db, counted):
+                    if self.pause:
+                        time.sleep(self.pause)
+
+            # Only the user with its token and data version are left, a tiny cascade
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                get_user_model().objects.filter(pk=user_id).delete()
+
+        deletion.user = None
+        deletion.step = ''
+        deletion.finished = timezone.now()
+        deletion.save(using=DEFAULT_DB_ALIAS)
+        self.log('Deleted %s' % deletion.email)
+
+    def steps(self, user_id, db):
+        """Return the (model, rows of the user, counted in the progress) to delete in order"""
+        # The through rows aren't counted, only the recipes, tags and ingredients
+        return [
+            (rows.model, rows, rows.model in OWNED_MODELS) for rows in user_rows(user_id, db)
+        ]
+
+    def delete_batch(self, deletion, rows, db, counted):
+        """Delete the next batch of rows and record the progress, return the number deleted"""
+        ids = list(rows.order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+        if not ids:
+            return 0
+
+        # When the shard is the default database, both are one and the same transaction
+        with transaction.atomic(using=db), transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # A plain DELETE ... WHERE id IN (...), not QuerySet.delete: that would load
+            # the rows through the collector and send a signal (with a version bump)
+            # per row. Nothing refers to the rows anymore: the through rows are
+            # deleted before the recipes, tags and ingredients, which only have those
+            deleted = delete_rows(rows.model, ids, using=db)
+
+            UserDeletion.objects.using(DEFAULT_DB_ALIAS).filter(pk=deletion.pk).update(
+                step=deletion.step,
+                deleted=F('deleted') + (deleted if counted else 0)
+            )
+
+        if counted:
+            deletion.deleted += deleted
+        return deleted
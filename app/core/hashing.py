@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool has no room, try again after 'wait' seconds
+
+    The API turns it into a 503 with Retry-After (see user.serializers), for the
+    admin and the management commands it's just an error.
+    """
+
+    def __init__(self, wait):
+        super().__init__('The password hashing pool is full, try again in %s seconds' % wait)
+        self.wait = wait
+
+
+class HashingPool:
+    """Bounded thread pool for password hashing and verification
+
+    PBKDF2 (hashlib) releases the GIL, so the hashing runs in parallel on the
+    pool threads while at most 'workers' hashes use the CPU at the same time.
+    At most 'max_queue' more wait for a thread, any more are rejected right away
+    with HashingPoolSaturated instead of piling up on the request workers.
+    """
+
+    def __init__(self, workers, max_queue, retry_after):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hashing')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._rejected = 0
+        # operation -> [count, total seconds, max seconds]
+        self._latency = {}
+
+    def run(self, operation, func, *args):
+        """Run func(*args) on the pool and wait for the result"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingPoolSaturated(wait=self.retry_after)
+
+        with self._lock:
+            self._queued += 1
+
+        try:
+            return self._executor.submit(self._call, operation, func, args).result()
+        finally:
+            self._slots.release()
+
+    def _call(self, operation, func, args):
+        """Runs on the pool thread, measures the time spent hashing"""
+        with self._lock:
+            self._queued -= 1
+
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                latency = self._latency.setdefault(operation, [0, 0.0, 0.0])
+                latency[0] += 1
+                latency[1] += elapsed
+                latency[2] = max(latency[2], elapsed)
+
+    def stats(self):
+        """Return the queue depth, rejections and latency per operation"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queued,
+                'rejected': self._rejected,
+                'latency': {
+                    operation: {'count': count, 'seconds_total': total, 'seconds_max': maximum}
+                    for operation, (count, total, maximum) in self._latency.items()
+                },
+            }
+
+
+# The one pool shared by all the request threads of this process
+hashing_pool = HashingPool(
+    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1,
+    max_queue=getattr(settings, 'PASSWORD_HASHING_QUEUE', 16),
+    retry_after=getattr(settings, 'PASSWORD_HASHING_RETRY_AFTER', 1),
+)
+
+
+def hash_password(raw_password):
+    """Return the hash of the password, made on the hashing pool"""
+    # A None password gives an unusable password without hashing anything
+    if raw_password is None:
+        return hashers.make_password(None)
+    return hashing_pool.run('hash', hashers.make_password, raw_password)
+
+
+def verify_password(raw_password, encoded, setter=None):
+    """Return if the password matches the hash, verified on the hashing pool
+
+    Like django.contrib.auth.hashers.check_password, the setter is called with
+    the password when the hash uses outdated settings. That happens on the
+    calling thread, since it saves to the database.
+    """
+    if raw_password is None or not hashers.is_password_usable(encoded):
+        return False
+
+    is_correct = hashing_pool.run('verify', hashers.check_password, raw_password, encoded)
+
+    if is_correct and setter is not None:
+        try:
+            hasher = hashers.identify_hasher(encoded)
+        except ValueError:
+            return is_correct
+
+        preferred = hashers.get_hasher('default')
+        if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+            setter(raw_password)
+
+    return is_correct
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, connection, connections, transaction
+)
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Task name -> Task, filled by the @task decorators when the modules are imported
+registry = {}
+
+
+class Task:
+    """A function that can run on the job queue, made with the @task decorator"""
+
+    def __init__(self, func, name, queue, max_attempts):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        """Queue a job that runs the task with the arguments, return the Job"""
+        return enqueue(self.name, *args, **kwargs)
+
+
+def task(name=None, queue='default', max_attempts=3):
+    """Register the decorated function as a task that can be queued
+
+    The arguments and return value have to be JSON serializable. A job may run
+    more than once (after a worker crashed), so tasks should be safe to repeat.
+    """
+    def decorator(func):
+        registered = Task(
+            func, name or '%s.%s' % (func.__module__, func.__name__), queue, max_attempts
+        )
+        registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def autodiscover():
+    """Import the tasks modules of all the installed apps, registering their tasks"""
+    autodiscover_modules('tasks')
+
+
+def enqueue(name, *args, queue=None, delay=0, max_attempts=None, **kwargs):
+    """Queue a job for the task with the given name, return the Job
+
+    Inside a transaction the job is only visible to the workers after the commit,
+    so a rolled back request never leaves a job behind.
+    """
+    registered = registry[name]
+    return Job.objects.using(DEFAULT_DB_ALIAS).create(
+        queue=queue or registered.queue,
+        task=name,
+        arguments=json.dumps({'args': args, 'kwargs': kwargs}),
+        max_attempts=max_attempts or registered.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def poll(job_id):
+    """Return the current state of a job, from the default database
+
+    The caller checks job.status, and job.result (JSON) once it's Job.DONE.
+    """
+    return Job.objects.using(DEFAULT_DB_ALIAS).get(pk=job_id)
+
+
+def retry_delay(attempts):
+    """Return the seconds before the next attempt, doubling with every attempt"""
+    base = getattr(settings, 'JOB_RETRY_DELAY', 10)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOB_RETRY_MAX_DELAY', 3600))
+    # With jitter, so jobs that failed together don't all retry at the same moment
+    return random.uniform(delay / 2, delay)
+
+
+class Worker:
+    """Claims the jobs of a queue and runs them, one at a time
+
+    Any number of workers (threads or processes, on any number of machines) can
+    work on the same queue: a job is claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+    so every worker takes another job without waiting for the others' locks.
+    """
+
+    def __init__(self, queue, name=None, lease=None):
+        self.queue = queue
+        self.name = name or '%s:%s:%s' % (socket.gethostname(), os.getpid(), queue)
+        self.lease = lease or getattr(settings, 'JOB_LEASE_SECONDS', 3600)
+
+    def claim(self):
+        """Take the next job that is due and mark it running, None when there is none"""
+        self.fail_expired()
+
+        # Another worker may be just ahead of us, then try the next job
+        while True:
+            job, claimed = self.try_claim()
+            if job is None:
+                return None
+            if claimed:
+                job.refresh_from_db(using=DEFAULT_DB_ALIAS)
+                return job
+
+    def try_claim(self):
+        """Try to claim the next job that is due, return (job or None, if we got it)"""
+        now = timezone.now()
+        jobs = Job.objects.using(DEFAULT_DB_ALIAS)
+        # Without FOR UPDATE (SQLite) the transaction adds nothing, and on SQLite it
+        # makes concurrent workers fail to upgrade their read lock to a write lock
+        locking = connections[DEFAULT_DB_ALIAS].features.has_select_for_update
+
+        with transaction.atomic(using=DEFAULT_DB_ALIAS) if locking else nullcontext():
+            # Running jobs past their lease are from a worker that crashed, they
+            # run again while they have attempts left (see fail_expired)
+            job = jobs.select_for_update(skip_locked=True).filter(
+                Q(status=Job.QUEUED, run_at__lte=now) |
+                Q(status=Job.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')),
+                queue=self.queue,
+            ).order_by('run_at', 'pk').first()
+            if job is None:
+                return None, False
+
+            # Without FOR UPDATE the workers rely on this conditional update, only
+            # one of the workers that saw the job gets to change it
+            claimed = jobs.filter(
+                pk=job.pk, status=job.status, attempts=job.attempts
+            ).update(
+                status=Job.RUNNING,
+                attempts=F('attempts') + 1,
+                worker=self.name,
+                started=now,
+                locked_until=now + timedelta(seconds=self.lease),
+            )
+        return job, bool(claimed)
+
+    def fail_expired(self):
+        """Fail the jobs past their lease without attempts left, return how many
+
+        A task that kills its worker (out of memory, a segfault) never gets to
+        record its failure, without this it would be run again forever.
+        """
+        now = timezone.now()
+        return Job.objects.using(DEFAULT_DB_ALIAS).filter(
+            queue=self.queue,
+            status=Job.RUNNING,
+            locked_until__lt=now,
+            attempts__gte=F('max_attempts'),
+        ).update(
+            status=Job.FAILED,
+            finished=now,
+            locked_until=None,
+            error='The worker stopped while running the job, no attempts left',
+        )
+
+    def run_next(self):
+        """Claim and run a single job, return the job or None when there was none"""
+        job = self.claim()
+        if job is not None:
+            self.execute(job)
+        return job
+
+    def execute(self, job):
+        """Run the task of the job and record the outcome, retrying failures later"""
+        try:
+            arguments = json.loads(job.arguments)
+            result = registry[job.task](*arguments['args'], **arguments['kwargs'])
+            result = json.dumps(result)
+        except Exception:
+            logger.exception('Job %s (%s) failed', job.pk, job.task)
+            if job.attempts < job.max_attempts:
+                retry_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+                self.finish(job, status=Job.QUEUED, run_at=retry_at, error=traceback.format_exc())
+            else:
+                self.finish(
+                    job, status=Job.FAILED, finished=timezone.now(), error=traceback.format_exc()
+                )
+            return
+
+        self.finish(job, status=Job.DONE, finished=timezone.now(), result=result)
+
+    def finish(self, job, **fields):
+        """Record the outcome, unless the lease ran out and another worker took the job"""
+        fields['locked_until'] = None
+        Job.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=job.pk, worker=self.name, attempts=job.attempts
+        ).update(**fields)
+        for field, value in fields.items():
+            setattr(job, field, value)
+
+    def work(self, stop=None, burst=False, interval=None):
+        """Run jobs until stop is set, or until the queue is empty in burst mode"""
+        stop = stop or threading.Event()
+        if interval is None:
+            interval = getattr(settings, 'JOB_POLL_INTERVAL', 1)
+
+        try:
+            while not stop.is_set():
+                # Like a request, don't keep using a connection that went bad (but
+                # never close the connection in the middle of the caller's transaction)
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                try:
+                    job = self.run_next()
+                except DatabaseError:
+                    # The database is down or busy, keep the worker alive and try again
+                    logger.exception('Worker %s could not claim a job', self.name)
+                    job = None
+                    if not connection.in_atomic_block:
+                        connection.close()
+                if job is None:
+                    if burst:
+                        break
+                    stop.wait(interval)
+        finally:
+            # Every thread has its own connection, close it when the thread ends
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
@@ -0,0 +1,109 @@
+import json
+import os
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+
+from core.benchmark import DRIVERS, SCALES, ApiBenchmark, compare_to_baseline
+
+
+# The stored results that new runs are compared to, per database vendor
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'benchmark_baseline.json'
+)
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the API endpoints and compare them to a baseline"""
+
+    help = 'Benchmark the API on seeded datasets, fail when slower than the baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='small,medium',
+            help='Comma separated datasets, of {} (default small,medium)'.format(
+                ', '.join(SCALES)
+            )
+        )
+        parser.add_argument(
+            '--drivers', default='client,wsgi',
+            help='Comma separated drivers, of client, wsgi (default both)'
+        )
+        parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests first')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='How much slower than the baseline is still fine (default 0.5 = 50%%)'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Write the results to the baseline file instead of comparing'
+        )
+
+    def handle(self, *args, **options):
+        scales = options['scales'].split(',')
+        drivers = options['drivers'].split(',')
+        unknown = [s for s in scales if s not in SCALES] + [d for d in drivers if d not in DRIVERS]
+        if unknown:
+            raise CommandError('Unknown scale or driver: %s' % ', '.join(unknown))
+
+        benchmark = ApiBenchmark(
+            drivers=drivers, requests=options['requests'], warmup=options['warmup']
+        )
+
+        # Run on a throwaway test database, like the tests do, never on the real data
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=False)
+        try:
+            for scale in scales:
+                call_command('flush', interactive=False, verbosity=0)
+                self.stdout.write('Benchmarking the %s dataset...' % scale)
+                benchmark.run_scale(scale, SCALES[scale])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write('{:<32} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+            'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'
+        ))
+        for key, result in sorted(benchmark.results.items()):
+            queries = '-' if result['queries'] is None else result['queries']
+            self.stdout.write(
+                '{:<32} {rps:>9.1f} {p50_ms:>9.3f} {p95_ms:>9.3f} {p99_ms:>9.3f} {:>8}'.format(
+                    key, queries, **result
+                )
+            )
+
+        # SQLite and Postgres perform very differently, so they have their own baseline
+        baselines = self.read_baselines(options['baseline'])
+        baseline = baselines.setdefault(connection.vendor, {})
+
+        if options['update_baseline']:
+            baseline.update(benchmark.results)
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+                baseline_file.write('\n')
+            self.stdout.write(self.style.SUCCESS('Baseline written to %s' % options['baseline']))
+            return
+
+        if not baseline:
+            raise CommandError(
+                'There is no {} baseline in {} yet, run with --update-baseline'.format(
+                    connection.vendor, options['baseline']
+                )
+            )
+        regressions = compare_to_baseline(benchmark.results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def read_baselines(self, path):
+        """Return the stored results per vendor, empty when there's no baseline yet"""
+        if not os.path.exists(path):
+            return {}
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    """Django command to compare the per request database latency with and without pooling"""
+
+    help = 'Measure connect + query + close per simulated request, with and without pooling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per mode')
+        parser.add_argument('--database', default='default', help='Database alias to use')
+
+    def handle(self, *args, **options):
+        settings_dict = dict(connections[options['database']].settings_dict)
+        if connections[options['database']].vendor != 'postgresql':
+            raise CommandError('The connection pool benchmark needs a Postgres database')
+
+        # Imported here, since these need psycopg2 and a Postgres database
+        from django.db.backends.postgresql.base import DatabaseWrapper as DirectWrapper
+        from core.db.backends.postgresql_pool.base import DatabaseWrapper as PooledWrapper
+
+        for mode, wrapper_class in (('direct', DirectWrapper), ('pooled', PooledWrapper)):
+            wrapper = wrapper_class(dict(settings_dict), alias='benchmark_' + mode)
+            timings = self.run_requests(wrapper, options['requests'])
+            self.stdout.write(self.format_timings(mode, timings))
+
+    def run_requests(self, wrapper, count):
+        """Do what a request does with its connection, count times, and time it"""
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            # Django closes the connection at the end of every request (CONN_MAX_AGE = 0)
+            wrapper.close()
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)
+
+    def format_timings(self, mode, timings):
+        """Return a line with the mean and percentiles in milliseconds"""
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p / 100))] * 1000
+
+        return '{:<7} mean {:7.3f} ms  p50 {:7.3f} ms  p95 {:7.3f} ms  p99 {:7.3f} ms'.format(
+            mode, sum(timings) / len(timings) * 1000,
+            percentile(50), percentile(95), percentile(99)
+        )
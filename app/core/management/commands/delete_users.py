@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.deletion import UserDeleter
+
+
+class Command(BaseCommand):
+    """Django command to delete the data of the users scheduled for deletion"""
+
+    help = 'Delete the scheduled users and their data in batches, continuing unfinished ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows deleted at once (default 1000)'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds between the batches (default 0)'
+        )
+        parser.add_argument(
+            '--loop', type=float, default=None, metavar='SECONDS',
+            help='Keep running, looking for new deletions every SECONDS'
+        )
+
+    def handle(self, *args, **options):
+        deleter = UserDeleter(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            log=self.stdout.write,
+        )
+
+        while True:
+            count = deleter.run_pending()
+            if count:
+                self.stdout.write(self.style.SUCCESS('Deleted %s users' % count))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
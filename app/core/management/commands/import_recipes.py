@@ -0,0 +1,48 @@
+import json
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.importer import RecipeImporter
+
+
+class Command(BaseCommand):
+    """Django command to import recipes for a user from an NDJSON file"""
+
+    help = 'Import recipes from newline delimited JSON, one recipe per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to import the recipes for')
+        parser.add_argument('path', help='The NDJSON file to import, or - for stdin')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Amount of recipes to write at once (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options['email'])
+
+        importer = RecipeImporter(user=user, batch_size=options['batch_size'])
+
+        # Reading the file line by line keeps memory flat, whatever the size
+        if options['path'] == '-':
+            importer.run(sys.stdin.buffer)
+        else:
+            with open(options['path'], 'rb') as lines:
+                importer.run(lines)
+
+        for error in importer.errors:
+            self.stderr.write('Line {}: {}'.format(error['line'], json.dumps(error['errors'])))
+        if importer.error_count > len(importer.errors):
+            self.stderr.write('{} more invalid lines'.format(
+                importer.error_count - len(importer.errors)
+            ))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} recipes, skipped {} invalid lines'.format(
+                importer.created, importer.error_count
+            )
+        ))
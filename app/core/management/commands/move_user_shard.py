@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db.sharding import ShardMover, shards
+
+
+class Command(BaseCommand):
+    """Django command to move the recipes, tags and ingredients of a user to another shard"""
+
+    help = 'Move the data of a user to another shard, while the user keeps using the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to move')
+        parser.add_argument('shard', help='Alias of the shard to move to')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows copied and deleted at once (default 1000)'
+        )
+        parser.add_argument(
+            '--grace', type=float, default=2,
+            help='Seconds for running writes to finish after they are fenced (default 2)'
+        )
+        parser.add_argument(
+            '--settle', type=float, default=None,
+            help='Seconds before deleting from the old shard (default TOKEN_CACHE_TTL)'
+        )
+
+    def handle(self, *args, **options):
+        if options['shard'] not in shards():
+            raise CommandError('Unknown shard "%s", the shards are: %s' % (
+                options['shard'], ', '.join(shards())
+            ))
+
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options['email'])
+
+        if user.shard == options['shard']:
+            raise CommandError('User "%s" is on %s already' % (user.email, user.shard))
+        if user.shard_moving:
+            raise CommandError('User "%s" is being moved already' % user.email)
+
+        mover = ShardMover(
+            batch_size=options['batch_size'],
+            grace=options['grace'],
+            settle=options['settle'],
+            log=self.stdout.write,
+        )
+        mover.move(user, options['shard'])
+
+        self.stdout.write(self.style.SUCCESS('Moved %s to %s' % (user.email, user.shard)))
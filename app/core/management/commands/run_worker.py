@@ -0,0 +1,75 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import Worker
+
+
+class Command(BaseCommand):
+    """Django command to run the jobs of the database backed job queue"""
+
+    help = 'Run the queued jobs, with a number of worker threads per queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue', action='append', dest='queues', metavar='QUEUE',
+            help='Only run this queue, can be given more than once (default all of JOB_QUEUES)'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='Jobs of every queue run at the same time (default from JOB_QUEUES)'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Stop when the queues are empty, instead of waiting for new jobs'
+        )
+
+    def handle(self, *args, **options):
+        configured = getattr(settings, 'JOB_QUEUES', {'default': 1})
+        queues = options['queues'] or list(configured)
+        unknown = [queue for queue in queues if queue not in configured]
+        if unknown:
+            raise CommandError('Unknown queue "%s", the queues are: %s' % (
+                unknown[0], ', '.join(configured)
+            ))
+
+        workers = []
+        for queue in queues:
+            for number in range(options['concurrency'] or configured[queue]):
+                workers.append(Worker(queue, name='%s:%s:%s:%s' % (
+                    socket.gethostname(), os.getpid(), queue, number
+                )))
+
+        # Stop after the running jobs on Ctrl+C or when the container stops
+        stop = threading.Event()
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, lambda signum, frame: stop.set())
+
+        self.stdout.write('Running %s workers for %s' % (len(workers), ', '.join(queues)))
+        try:
+            if len(workers) == 1:
+                workers[0].work(stop, burst=options['burst'])
+            else:
+                # Every thread gets its own database connection
+                threads = [
+                    threading.Thread(
+                        target=worker.work, args=(stop,), kwargs={'burst': options['burst']},
+                        name=worker.name
+                    )
+                    for worker in workers
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
@@ -0,0 +1,73 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.seed import DatasetGenerator
+
+
+class Command(BaseCommand):
+    """Django command to generate a synthetic dataset for load testing"""
+
+    help = 'Generate a deterministic dataset of users with recipes, tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Users to create')
+        parser.add_argument(
+            '--recipes-per-user', type=float, default=20,
+            help='Mean amount of recipes per user, exponentially distributed (default 20)'
+        )
+        parser.add_argument('--tags-per-user', type=int, default=10)
+        parser.add_argument('--ingredients-per-user', type=int, default=30)
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=6)
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Zipf exponent of the tag and ingredient reuse, 0 is uniform (default 1.0)'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='Emails are <prefix><number>@example.com (default seed)'
+        )
+        parser.add_argument('--password', default='password', help='Password of all users')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Users written per transaction (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['recipes_per_user'] <= 0:
+            raise CommandError('--recipes-per-user must be more than 0')
+
+        generator = DatasetGenerator(
+            users=options['users'],
+            recipes_per_user=options['recipes_per_user'],
+            tags_per_user=options['tags_per_user'],
+            ingredients_per_user=options['ingredients_per_user'],
+            tags_per_recipe=options['tags_per_recipe'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            skew=options['skew'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+        )
+
+        # The emails are unique, so a second run needs another prefix
+        if get_user_model().objects.filter(email=generator.email(0)).exists():
+            raise CommandError(
+                'Users with prefix "%s" already exist, use another --prefix' % options['prefix']
+            )
+
+        start = time.monotonic()
+
+        def progress(counts):
+            self.stdout.write('{users} users, {recipes} recipes ({:.1f}s)'.format(
+                time.monotonic() - start, **counts
+            ))
+
+        counts = generator.run(progress=progress).counts
+        self.stdout.write(self.style.SUCCESS(
+            'Created {users} users, {recipes} recipes, {tags} tags and '
+            '{ingredients} ingredients'.format(**counts)
+        ))
@@ -1,25 +1,87 @@
+import random
 import time
-from django.db import connections
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+
+class MigrationsPending(Exception):
+    """Raised when the database is up but not all migrations are applied yet"""
 
 
 class Command(BaseCommand):
     """Django command to pause execution until database is available"""
 
+    help = 'Wait until the database answers queries, with exponential backoff'
+
     # So we can pass custom arguments and options to the command
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias')
+        parser.add_argument(
+            '--timeout', type=float, default=60,
+            help='Give up after this many seconds (default 60)'
+        )
+        parser.add_argument(
+            '--initial-delay', type=float, default=0.1,
+            help='Seconds to wait after the first failed attempt (default 0.1)'
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=5,
+            help='The longest wait between two attempts (default 5)'
+        )
+        parser.add_argument(
+            '--wait-for-migrations', action='store_true',
+            help='Also wait until all migrations are applied (by another container)'
+        )
+
     def handle(self, *args, **options):
         # Outputs a message to the screen
         self.stdout.write('Waiting for database...')
 
-        # Holding the connection if available to check
-        db_conn = None
-        while not db_conn:
+        deadline = time.monotonic() + options['timeout']
+        delay = options['initial_delay']
+        while True:
             try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                time.sleep(1)
+                self.check_database(options['database'])
+                if options['wait_for_migrations']:
+                    self.check_migrations(options['database'])
+                break
+            except (OperationalError, MigrationsPending) as error:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError('Database unavailable after {} seconds: {}'.format(
+                        options['timeout'], error
+                    ))
+
+                # Exponential backoff with jitter, so many containers starting at the
+                # same time don't all hit the database at the same moments
+                wait = min(random.uniform(delay / 2, delay), remaining)
+                self.stdout.write('Database unavailable ({}), waiting {:.2f} seconds...'.format(
+                    error, wait
+                ))
+                time.sleep(wait)
+                delay = min(delay * 2, options['max_delay'])
 
         # The self.style.SUCCESS prints a message in green
         self.stdout.write(self.style.SUCCESS('Database available'))
+
+    def check_database(self, alias):
+        """Do a real round trip to the database, raises OperationalError when it's down"""
+        # Just getting connections[alias] doesn't connect, running a query does
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except OperationalError:
+            # Don't keep a broken connection around for the next attempt
+            connection.close()
+            raise
+
+    def check_migrations(self, alias):
+        """Raise MigrationsPending when there are unapplied migrations"""
+        executor = MigrationExecutor(connections[alias])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if plan:
+            raise MigrationsPending('{} migrations not applied'.format(len(plan)))
@@ -0,0 +1,403 @@
+import fcntl
+import functools
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from core.authentication import token_cache
+from core.hashing import hashing_pool
+
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Positions in the list of values kept for every (view, method)
+COUNT, LATENCY_SUM, QUERIES, DB_SECONDS, RESPONSE_BYTES, BUCKETS = range(6)
+
+# The file in METRICS_DIR with the added up metrics of the processes that are gone
+ARCHIVE_NAME = 'archive.json'
+
+
+class MetricsRegistry:
+    """Per process request metrics per (view, method), shared by all threads
+
+    When settings.METRICS_DIR is set, every process writes a snapshot of its
+    metrics to <METRICS_DIR>/<pid>-<start time>.json (at most every
+    METRICS_FLUSH_INTERVAL seconds), and the metrics view adds up the snapshots
+    of all the processes. The snapshots of processes that are gone are added to
+    the archive, so the totals never go down when a worker is recycled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._last_flush = 0.0
+
+    def observe(self, view, method, seconds, queries, db_seconds, response_bytes):
+        """Record a single request"""
+        with self._lock:
+            values = self._values.get((view, method))
+            if values is None:
+                values = self._values[(view, method)] = [0, 0.0, 0, 0.0, 0] + [
+                    [0] * (len(LATENCY_BUCKETS) + 1)
+                ]
+            values[COUNT] += 1
+            values[LATENCY_SUM] += seconds
+            values[QUERIES] += queries
+            values[DB_SECONDS] += db_seconds
+            values[RESPONSE_BYTES] += response_bytes
+            # Buckets are stored per bucket here and made cumulative when exported
+            values[BUCKETS][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+        self.maybe_flush()
+
+    def snapshot(self):
+        """Return the metrics of this process as a JSON serializable dict"""
+        with self._lock:
+            views = [
+                [view, method, values[:BUCKETS] + [list(values[BUCKETS])]]
+                for (view, method), values in self._values.items()
+            ]
+
+        hashing = hashing_pool.stats()
+        cache = token_cache.stats()
+        return {
+            'views': views,
+            'counters': {
+                'token_cache_hits_total': cache['hits'],
+                'token_cache_misses_total': cache['misses'],
+                'password_hashing_rejected_total': hashing['rejected'],
+            },
+            'gauges': {
+                'password_hashing_queue_depth': hashing['queue_depth'],
+            },
+            # Name -> label value -> [count, sum, max]
+            'summaries': {
+                'password_hashing_duration_seconds': {
+                    operation: [latency['count'], latency['seconds_total'], latency['seconds_max']]
+                    for operation, latency in hashing['latency'].items()
+                },
+            },
+        }
+
+    def maybe_flush(self, force=False):
+        """Write the snapshot of this process to METRICS_DIR, if it's time to"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+            return
+        self._last_flush = now
+
+        os.makedirs(directory, exist_ok=True)
+        _write_snapshot(directory, os.path.join(directory, snapshot_name()), self.snapshot())
+
+    def collect(self):
+        """Return the snapshots of all the processes (or just this one)"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return [self.snapshot()]
+
+        self.maybe_flush(force=True)
+        # One scrape at a time, another one could archive a snapshot in between our
+        # reading the archive and the snapshot, and we'd miss it
+        with open(os.path.join(directory, 'archive.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.archive_dead(directory)
+
+            # The archive is one of the files, the processes that are gone are in there
+            snapshots = []
+            for path in glob.glob(os.path.join(directory, '*.json')):
+                snapshot = _read_snapshot(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return snapshots
+
+    def archive_dead(self, directory):
+        """Add the snapshots of the processes that are gone to the archive
+
+        Called with the lock of the directory held (see collect).
+        """
+        archive_path = os.path.join(directory, ARCHIVE_NAME)
+        dead = [
+            path for path in glob.glob(os.path.join(directory, '*.json'))
+            if path != archive_path and not _process_alive(path)
+        ]
+        if not dead:
+            return
+
+        snapshots = [_read_snapshot(archive_path) or empty_snapshot()]
+        archived = []
+        for path in dead:
+            snapshot = _read_snapshot(path)
+            if snapshot is None:
+                continue
+            # A gauge is the current value of a running process, it doesn't add up
+            snapshot['gauges'] = {}
+            snapshots.append(snapshot)
+            archived.append(path)
+
+        _write_snapshot(directory, archive_path, merge_snapshots(snapshots))
+        # Only now, a crash before this counts them twice instead of losing them
+        for path in archived:
+            os.remove(path)
+
+    def reset(self):
+        """Forget all the metrics of this process"""
+        with self._lock:
+            self._values.clear()
+
+
+# The one registry of this process
+registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """Database execute wrapper that counts the queries and the time they take"""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Record the latency, query count, DB time and response size of every request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+
+        seconds = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+
+        registry.observe(view, request.method, seconds, timer.count, timer.seconds, size)
+        return response
+
+
+def metrics(request):
+    """Serve the metrics of all processes in the Prometheus text format"""
+    # The metrics show what the API is used for and how busy it is, not for everyone
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def metrics_allowed(request):
+    """Return if the client may read the metrics, by its address or bearer token"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(header.encode(), ('Bearer ' + token).encode()):
+            return True
+
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(allowed, strict=False)
+        for allowed in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    )
+
+
+def empty_snapshot():
+    """Return a snapshot without any metrics"""
+    return {'views': [], 'counters': {}, 'gauges': {}, 'summaries': {}}
+
+
+def merge_snapshots(snapshots):
+    """Add up the snapshots into a single one"""
+    views = {}
+    counters = {}
+    gauges = {}
+    summaries = {}
+    for snapshot in snapshots:
+        for view, method, values in snapshot['views']:
+            total = views.setdefault((view, method), [0, 0.0, 0, 0.0, 0, None])
+            for index in range(BUCKETS):
+                total[index] += values[index]
+            buckets = values[BUCKETS]
+            total[BUCKETS] = buckets if total[BUCKETS] is None else [
+                a + b for a, b in zip(total[BUCKETS], buckets)
+            ]
+        for name, value in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, value in snapshot['gauges'].items():
+            gauges[name] = gauges.get(name, 0) + value
+        # The count and sum add up, the max is the largest of all the processes
+        for name, values in snapshot.get('summaries', {}).items():
+            for label, (count, total, maximum) in values.items():
+                summary = summaries.setdefault(name, {}).setdefault(label, [0, 0.0, 0.0])
+                summary[0] += count
+                summary[1] += total
+                summary[2] = max(summary[2], maximum)
+
+    return {
+        'views': [[view, method, values] for (view, method), values in views.items()],
+        'counters': counters,
+        'gauges': gauges,
+        'summaries': summaries,
+    }
+
+
+def render_prometheus(snapshots):
+    """Add up the snapshots and render them in the Prometheus text format"""
+    merged = merge_snapshots(snapshots)
+    views = {(view, method): values for view, method, values in merged['views']}
+    counters = merged['counters']
+    gauges = merged['gauges']
+    summaries = merged['summaries']
+
+    lines = [
+        '# HELP http_request_duration_seconds Request latency per view and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (view, method), values in sorted(views.items()):
+        labels = 'view="{}",method="{}"'.format(_escape(view), _escape(method))
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values[BUCKETS]):
+            cumulative += count
+            lines.append('http_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                labels, bound, cumulative
+            ))
+        lines.append('http_request_duration_seconds_sum{{{}}} {}'.format(
+            labels, values[LATENCY_SUM]
+        ))
+        lines.append('http_request_duration_seconds_count{{{}}} {}'.format(
+            labels, values[COUNT]
+        ))
+
+    for name, index, help_text in (
+        ('http_request_db_queries_total', QUERIES, 'Database queries per view and method.'),
+        ('http_request_db_seconds_total', DB_SECONDS, 'Time spent in the database.'),
+        ('http_response_size_bytes_total', RESPONSE_BYTES, 'Bytes of (non streaming) responses.'),
+    ):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+        for (view, method), values in sorted(views.items()):
+            lines.append('{}{{view="{}",method="{}"}} {}'.format(
+                name, _escape(view), _escape(method), values[index]
+            ))
+
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        for name, value in sorted(values.items()):
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{} {}'.format(name, value))
+
+    # Summaries without quantiles, the max is a gauge of its own next to them
+    for name, values in sorted(summaries.items()):
+        lines.append('# TYPE {} summary'.format(name))
+        for label, (count, total, maximum) in sorted(values.items()):
+            lines.append('{}_count{{operation="{}"}} {}'.format(name, _escape(label), count))
+            lines.append('{}_sum{{operation="{}"}} {}'.format(name, _escape(label), total))
+        lines.append('# TYPE {}_max gauge'.format(name))
+        for label, (count, total, maximum) in sorted(values.items()):
+            lines.append('{}_max{{operation="{}"}} {}'.format(name, _escape(label), maximum))
+
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot_name():
+    """Return the name of the snapshot file of this process"""
+    # With the start time a new process that got the pid of an old one doesn't
+    # overwrite its file, and the old file is seen as a process that is gone
+    pid = os.getpid()
+    return '%d-%s.json' % (pid, _process_start(pid) or _process_token(pid))
+
+
+@functools.lru_cache()
+def _process_token(pid):
+    """Return a random token for the process, where there are no start times"""
+    return uuid.uuid4().hex
+
+
+def _process_start(pid):
+    """Return the start time of the process from /proc (Linux), None without it"""
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # Field 22, counted after the command name (which may contain spaces) at field 2
+    return stat.rsplit(')', 1)[1].split()[19]
+
+
+def _process_alive(path):
+    """Return if the process that wrote the snapshot file is still running"""
+    pid, _, start = os.path.splitext(os.path.basename(path))[0].partition('-')
+    try:
+        pid = int(pid)
+    except ValueError:
+        return True
+    try:
+        # Signal 0 only checks that the process exists
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, it just belongs to another user
+        pass
+
+    # Another process may have been given the same pid since
+    current = _process_start(pid)
+    return not (start and current and current != start)
+
+
+def _read_snapshot(path):
+    """Return the snapshot in the file, None when it's gone"""
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(directory, path, snapshot):
+    """Write the snapshot to the file, through a temporary file"""
+    # Readers never see half a file
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temporary, path)
+
+
+def _escape(value):
+    """Escape a Prometheus label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
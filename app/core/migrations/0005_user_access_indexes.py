@@ -0,0 +1,63 @@
+from django.db import migrations, models
+
+
+# The indexes to add as (model name, index), these match the Meta.indexes on the models
+INDEXES = [
+    ('recipe', models.Index(fields=['user', 'id'], name='core_recipe_user_pk_idx')),
+    ('ingredient', models.Index(fields=['user', 'name'], name='core_ingredient_user_name_idx')),
+    ('tag', models.Index(fields=['user', 'name'], name='core_tag_user_name_idx')),
+]
+
+
+def create_indexes(apps, schema_editor):
+    """Create the indexes, without blocking writes on Postgres"""
+    for model_name, index in INDEXES:
+        model = apps.get_model('core', model_name)
+
+        # A regular CREATE INDEX locks the table against writes until it's done,
+        # CONCURRENTLY doesn't but can't run inside a transaction (see atomic)
+        if schema_editor.connection.vendor == 'postgresql':
+            quote = schema_editor.quote_name
+            columns = [model._meta.get_field(field).column for field in index.fields]
+            schema_editor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})'.format(
+                quote(index.name),
+                quote(model._meta.db_table),
+                ', '.join(quote(column) for column in columns),
+            ))
+        else:
+            schema_editor.add_index(model, index)
+
+
+def drop_indexes(apps, schema_editor):
+    """Drop the indexes again, without blocking writes on Postgres"""
+    for model_name, index in INDEXES:
+        model = apps.get_model('core', model_name)
+
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(
+                schema_editor.quote_name(index.name)
+            ))
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    # Needed for CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('core', '0004_recipe'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index)
+                for model_name, index in INDEXES
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.1.15 on 2026-10-18 04:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_data_versions(apps, schema_editor):
+    """Create the data version rows for the users that already exist"""
+    User = apps.get_model('core', 'User')
+    DataVersion = apps.get_model('core', 'DataVersion')
+    DataVersion.objects.bulk_create(
+        (DataVersion(user_id=user_id) for user_id in User.objects.values_list('id', flat=True)),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_user_access_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_data_versions, migrations.RunPython.noop),
+    ]
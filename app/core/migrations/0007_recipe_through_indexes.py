@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+# The indexes to add on the auto created through tables as (model, field, name),
+# keyed on the tag/ingredient first, for filtering recipes by tags and ingredients
+INDEXES = [
+    ('recipe', 'tags', 'core_recipe_tags_tag_rcp_idx'),
+    ('recipe', 'ingredients', 'core_recipe_ingr_ingr_rcp_idx'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    """Create the (related id, recipe id) indexes, without blocking writes on Postgres"""
+    quote = schema_editor.quote_name
+    for model_name, field_name, index_name in INDEXES:
+        field = apps.get_model('core', model_name)._meta.get_field(field_name)
+        through = field.remote_field.through._meta
+        columns = [
+            through.get_field(field.m2m_reverse_field_name()).column,
+            through.get_field(field.m2m_field_name()).column,
+        ]
+
+        # CONCURRENTLY doesn't lock the table but can't run in a transaction (see atomic)
+        concurrently = 'CONCURRENTLY IF NOT EXISTS ' if schema_editor.connection.vendor == 'postgresql' else ''
+        schema_editor.execute('CREATE INDEX {}{} ON {} ({})'.format(
+            concurrently,
+            quote(index_name),
+            quote(through.db_table),
+            ', '.join(quote(column) for column in columns),
+        ))
+
+
+def drop_indexes(apps, schema_editor):
+    """Drop the indexes again"""
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    for model_name, field_name, index_name in INDEXES:
+        schema_editor.execute('DROP INDEX {}IF EXISTS {}'.format(
+            concurrently, schema_editor.quote_name(index_name)
+        ))
+
+
+class Migration(migrations.Migration):
+
+    # Needed for CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('core', '0006_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
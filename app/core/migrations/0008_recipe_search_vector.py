@@ -0,0 +1,66 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The text search configuration used for the titles, also used by recipe.search
+SEARCH_CONFIG = 'pg_catalog.english'
+BACKFILL_BATCH_SIZE = 10000
+
+
+def create_search_vector(apps, schema_editor):
+    """Add the trigger, fill the existing rows and add the GIN index (Postgres only)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    # The built in trigger function fills the vector on every INSERT and UPDATE,
+    # so it's also maintained for bulk inserts and COPY
+    schema_editor.execute(
+        'CREATE TRIGGER core_recipe_search_vector_update '
+        'BEFORE INSERT OR UPDATE ON core_recipe FOR EACH ROW '
+        "EXECUTE PROCEDURE tsvector_update_trigger(search_vector, '{}', title)".format(SEARCH_CONFIG)
+    )
+
+    # Fill the existing recipes in batches, so we don't lock the whole table at once
+    # Every statement is committed on its own since this migration isn't atomic
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                'UPDATE core_recipe SET search_vector = to_tsvector(%s, title) '
+                'WHERE id IN (SELECT id FROM core_recipe WHERE search_vector IS NULL LIMIT %s)',
+                [SEARCH_CONFIG, BACKFILL_BATCH_SIZE]
+            )
+            if cursor.rowcount == 0:
+                break
+
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS core_recipe_search_vector_gin '
+        'ON core_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    """Drop the GIN index and the trigger again"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS core_recipe_search_vector_gin')
+    schema_editor.execute('DROP TRIGGER IF EXISTS core_recipe_search_vector_update ON core_recipe')
+
+
+class Migration(migrations.Migration):
+
+    # Needed for CREATE INDEX CONCURRENTLY and committing the backfill in batches
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_recipe_through_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+# Case folded prefix indexes for the autocomplete of tags and ingredients as (table, index)
+# Django's name__istartswith becomes UPPER("name"::text) LIKE UPPER('prefix%') on Postgres
+INDEXES = [
+    ('core_tag', 'core_tag_user_name_prefix_idx'),
+    ('core_ingredient', 'core_ingr_user_name_prefix_idx'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    """Create the indexes on Postgres, SQLite's LIKE is case insensitive already"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    # text_pattern_ops makes the index usable for LIKE 'prefix%' in any collation
+    for table, index in INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} '
+            '(user_id, UPPER(name::text) text_pattern_ops)'.format(index, table)
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    """Drop the indexes again"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table, index in INDEXES:
+        schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(index))
+
+
+class Migration(migrations.Migration):
+
+    # Needed for CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('core', '0008_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-18 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image',
+            field=models.FileField(blank=True, editable=False, max_length=255, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,6 +1,29 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import DEFAULT_DB_ALIAS, models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
+
+from core.db.sharding import choose_shard, shard_for_user
+from core.hashing import hash_password, verify_password
+
+
+class UserOwnedQuerySet(models.QuerySet):
+
+    def for_user(self, user):
+        """Return the objects of the user, from the shard the user is on"""
+        db = shard_for_user(user)
+        # On the default database the routers pick the database (maybe a replica)
+        queryset = self if db == DEFAULT_DB_ALIAS else self.using(db)
+        return queryset.filter(user=user)
+
+    def create(self, **kwargs):
+        """Create the object on the shard of its user"""
+        # Without this the object would be saved on the database of the queryset
+        user = kwargs.get('user')
+        if self._db is None and user is not None:
+            return super(UserOwnedQuerySet, self.using(shard_for_user(user))).create(**kwargs)
+        return super().create(**kwargs)
 
 
 class Recipe(models.Model):
@@ -8,9 +31,12 @@ class Recipe(models.Model):
 
     # We use the settings to retieve our auth user model, since we created a custom one
     # Cascade makes sure this tag is also removed when user is gone
+    # The users are on the default database, the object may be on another shard,
+    # so there can't be a foreign key constraint in the database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_constraint=False
     )
 
     # Other required fields
@@ -27,6 +53,24 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
 
+    # Full text search vector of the title, on Postgres a trigger keeps it up to date
+    # and it has a GIN index (see migration 0008). It stays empty on other databases
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Optional photo, stored under the SHA-256 of its content so identical uploads
+    # share one file (see recipe.images). The thumbnails are made by a background
+    # job, thumbnails_ready is set once they are all there
+    image = models.FileField(max_length=255, blank=True, editable=False)
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
+
+    objects = UserOwnedQuerySet.as_manager()
+
+    class Meta:
+        # Every recipe query filters on the user and pages by id
+        indexes = [
+            models.Index(fields=['user', 'id'], name='core_recipe_user_pk_idx'),
+        ]
+
     # Representation when you call str(tag)
     def __str__(self):
         return self.title
@@ -38,11 +82,22 @@ class Ingredient(models.Model):
 
     # We use the settings to retieve our auth user model, since we created a custom one
     # Cascade makes sure this tag is also removed when user is gone
+    # The users are on the default database, the object may be on another shard,
+    # so there can't be a foreign key constraint in the database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_constraint=False
     )
 
+    objects = UserOwnedQuerySet.as_manager()
+
+    class Meta:
+        # Every ingredient query filters on the user and sorts by name
+        indexes = [
+            models.Index(fields=['user', 'name'], name='core_ingredient_user_name_idx'),
+        ]
+
     # Representation when you call str(tag)
     def __str__(self):
         return self.name
@@ -54,11 +109,22 @@ class Tag(models.Model):
 
     # We use the settings to retieve our auth user model, since we created a custom one
     # Cascade makes sure this tag is also removed when user is gone
+    # The users are on the default database, the object may be on another shard,
+    # so there can't be a foreign key constraint in the database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_constraint=False
     )
 
+    objects = UserOwnedQuerySet.as_manager()
+
+    class Meta:
+        # Every tag query filters on the user and sorts by name
+        indexes = [
+            models.Index(fields=['user', 'name'], name='core_tag_user_name_idx'),
+        ]
+
     # Representation when you call str(tag)
     def __str__(self):
         return self.name
@@ -77,7 +143,11 @@ class UserManager(BaseUserManager):
         # You access the User model with "self.model"
         # Here you add the email and all other extra fields, so it's dynamic
         # The "normalize_email" also is a Django build in method
-        user = self.model(email=self.normalize_email(email), **extra_fields)
+        email = self.normalize_email(email)
+
+        # The user's recipes, tags and ingredients are stored on this shard
+        extra_fields.setdefault('shard', choose_shard(email))
+        user = self.model(email=email, **extra_fields)
 
         # You'll want to use build in method this since it encrypts the password
         user.set_password(password)
@@ -108,8 +178,149 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # The database with the user's recipes, tags and ingredients (see core.db.sharding)
+    # While the data moves to another shard, the writes of the user are refused
+    shard = models.CharField(max_length=64, default=DEFAULT_DB_ALIAS)
+    shard_moving = models.BooleanField(default=False)
+
     # Add the UserManager for our objects
     objects = UserManager()
 
     # Define which field will be used as "username" to login
     USERNAME_FIELD = 'email'
+
+    # The password hashing runs on the bounded hashing pool, so a burst of logins
+    # or signups can't take all the request workers (see core.hashing)
+    def set_password(self, raw_password):
+        """Hash and set the password, on the hashing pool"""
+        self.password = hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Return if the password is correct, verified on the hashing pool"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=['password'])
+        return verify_password(raw_password, self.password, setter)
+
+
+class DataVersionManager(models.Manager):
+
+    def get_for_user(self, user_id):
+        """Return the (version, modified) of the user's data, (0, None) if never changed"""
+        row = self.filter(user_id=user_id).values_list('version', 'modified').first()
+        return row or (0, None)
+
+    def bump(self, user_id):
+        """Increase the version of the user's data, call this on every change"""
+        # A single UPDATE with version + 1 is atomic in the database, so concurrent
+        # writes of the same user never lose a bump.
+        # The row is created together with the user, so it's never missing here,
+        # except while the user itself is being deleted, then we do nothing
+        self.filter(user_id=user_id).update(
+            version=models.F('version') + 1, modified=timezone.now()
+        )
+
+    def bump_many(self, user_ids):
+        """Increase the versions of many users at once, for bulk writes"""
+        user_ids = list(user_ids)
+        now = timezone.now()
+        # SQLite allows at most 999 parameters in a query, so update in chunks
+        for start in range(0, len(user_ids), 500):
+            self.filter(user_id__in=user_ids[start:start + 500]).update(
+                version=models.F('version') + 1, modified=now
+            )
+
+
+class DataVersion(models.Model):
+    """Version of a user's recipes, tags and ingredients, bumped on every change
+
+    Used to answer conditional requests (ETag) without
+    running the list queries when nothing has changed.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    objects = DataVersionManager()
+
+    def __str__(self):
+        return '%s v%s' % (self.user_id, self.version)
+
+
+class UserDeletion(models.Model):
+    """A user whose data is deleted in the background, in batches
+
+    Deleting a user with a lot of data in one go loads all the rows through
+    Django's collector and deletes them in one long transaction, so instead the
+    user is deactivated right away and a background job removes the data
+    later (see core.deletion). The row stays as a record when it's done.
+    """
+    # Set to null when the user itself is finally deleted
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True
+    )
+    email = models.EmailField(max_length=255)
+    requested = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    # Progress: the model being deleted now, and the recipes, tags and
+    # ingredients deleted so far out of the total there were when the job started
+    step = models.CharField(max_length=64, blank=True)
+    deleted = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '%s %s/%s' % (self.email, self.deleted, self.total)
+
+
+class Job(models.Model):
+    """A job of the database backed job queue, see core.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    queue = models.CharField(max_length=64, default='default')
+    # The registered name of the task, with its arguments as JSON
+    task = models.CharField(max_length=255)
+    arguments = models.TextField(default='{}')
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # Not started before this time, which moves forward on every retry
+    run_at = models.DateTimeField(default=timezone.now)
+    # The worker that runs the job and until when, after that it's run again
+    worker = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # The return value of the task as JSON, or the traceback of the last failure
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        # The workers look for the next job of their queue by status and run_at
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_at'], name='core_job_queue_status_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.task, self.pk, self.status)
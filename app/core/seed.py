@@ -0,0 +1,184 @@
+import random
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.utils import timezone
+
+from core.bulk import bulk_insert, bulk_insert_rows
+from core.db.sharding import choose_shard, shards
+from core.hashing import hash_password
+from core.models import DataVersion, Tag, Ingredient, Recipe
+from recipe.cache import invalidate_list_caches
+
+
+# Words the generated names are made of, the first words are the most used ones
+TAG_WORDS = (
+    'Vegan', 'Dessert', 'Dinner', 'Breakfast', 'Quick', 'Healthy', 'Lunch', 'Vegetarian',
+    'Spicy', 'Comfort food', 'Gluten free', 'Snack', 'Baking', 'Italian', 'Asian', 'Mexican',
+)
+INGREDIENT_WORDS = (
+    'Salt', 'Pepper', 'Olive oil', 'Garlic', 'Onion', 'Butter', 'Flour', 'Sugar', 'Egg',
+    'Milk', 'Tomato', 'Lemon', 'Rice', 'Chicken', 'Cheese', 'Carrot', 'Potato', 'Basil',
+)
+TITLE_WORDS = (
+    ('Quick', 'Creamy', 'Spicy', 'Grandma\'s', 'Roasted', 'Simple', 'Crispy', 'Slow cooked'),
+    ('tomato', 'chicken', 'lentil', 'mushroom', 'salmon', 'pumpkin', 'chocolate', 'beef'),
+    ('soup', 'curry', 'pie', 'salad', 'stew', 'pasta', 'cake', 'risotto'),
+)
+
+
+def numbered_name(words, index):
+    """Return the name for the index, 'Vegan', ..., 'Vegan 2', ... when we run out"""
+    name = words[index % len(words)]
+    if index >= len(words):
+        name += ' %d' % (index // len(words) + 1)
+    return name
+
+
+def zipf_weights(count, skew):
+    """Return cumulative weights where rank k is picked proportional to 1 / (k + 1) ** skew"""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+
+
+class DatasetGenerator:
+    """Generate a deterministic dataset of users with recipes, tags and ingredients
+
+    The same seed and sizes always give the same data. The amount of recipes per
+    user is exponentially distributed around the mean, and the tags and ingredients
+    of a recipe are picked with a Zipf distribution, so a few names are used by
+    most recipes like in real data ('skew' 0 picks them uniformly).
+
+    Everything is written per batch of users with core.bulk (COPY on Postgres),
+    the data of every user on the shard the user is on. The many to many rows
+    are written straight into the through tables, and all users share a single
+    password hash, made once.
+    """
+
+    def __init__(self, users=100, recipes_per_user=20, tags_per_user=10,
+                 ingredients_per_user=30, tags_per_recipe=3, ingredients_per_recipe=6,
+                 skew=1.0, seed=0, prefix='seed', password='password', batch_size=1000):
+        self.users = users
+        self.recipes_per_user = recipes_per_user
+        self.tags_per_user = tags_per_user
+        self.ingredients_per_user = ingredients_per_user
+        self.tags_per_recipe = tags_per_recipe
+        self.ingredients_per_recipe = ingredients_per_recipe
+        self.seed = seed
+        self.prefix = prefix
+        self.password = password
+        self.batch_size = batch_size
+        self.tag_weights = zipf_weights(tags_per_user, skew)
+        self.ingredient_weights = zipf_weights(ingredients_per_user, skew)
+        self.counts = {'users': 0, 'recipes': 0, 'tags': 0, 'ingredients': 0}
+
+    def email(self, number):
+        """Return the email of the generated user with this number"""
+        return '{}{}@example.com'.format(self.prefix, number)
+
+    def run(self, progress=None):
+        """Generate all the users, calls progress(counts) after every batch"""
+        password = hash_password(self.password)
+        rng = random.Random(self.seed)
+
+        for start in range(0, self.users, self.batch_size):
+            numbers = range(start, min(start + self.batch_size, self.users))
+            self.write_batch(rng, numbers, password)
+            if progress is not None:
+                progress(self.counts)
+
+        return self
+
+    def write_batch(self, rng, numbers, password):
+        """Write a batch of users, then their data on the shards they are on"""
+        user_model = get_user_model()
+        db = router.db_for_write(user_model)
+
+        with transaction.atomic(using=db):
+            users = bulk_insert(user_model, [
+                user_model(email=self.email(number), name='Seed user %d' % number,
+                           password=password, shard=choose_shard(self.email(number)))
+                for number in numbers
+            ], using=db)
+            self.add_data_versions(users, db)
+        self.counts['users'] += len(users)
+
+        for shard in shards():
+            shard_users = [user for user in users if user.shard == shard]
+            if shard_users:
+                self.write_user_data(rng, shard_users, shard)
+
+    def write_user_data(self, rng, users, db):
+        """Write the tags, ingredients and recipes of users on the same shard"""
+        with transaction.atomic(using=db):
+            tags = bulk_insert(Tag, [
+                Tag(user=user, name=numbered_name(TAG_WORDS, index))
+                for user in users for index in range(self.tags_per_user)
+            ], using=db)
+            ingredients = bulk_insert(Ingredient, [
+                Ingredient(user=user, name=numbered_name(INGREDIENT_WORDS, index))
+                for user in users for index in range(self.ingredients_per_user)
+            ], using=db)
+
+            recipes = []
+            for user in users:
+                for _ in range(int(rng.expovariate(1 / self.recipes_per_user))):
+                    recipes.append(Recipe(
+                        user=user,
+                        title=' '.join(rng.choice(words) for words in TITLE_WORDS),
+                        time_minutes=rng.randint(5, 180),
+                        price=Decimal(rng.randint(100, 99999)) / 100,
+                    ))
+            recipes = bulk_insert(Recipe, recipes, using=db)
+
+            # The tags and ingredients of a user are consecutive in the lists above
+            tag_rows = self.related_rows(
+                rng, users, recipes, tags, self.tags_per_user,
+                self.tag_weights, self.tags_per_recipe
+            )
+            bulk_insert_rows(Recipe.tags.through, ['recipe', 'tag'], tag_rows, using=db)
+            ingredient_rows = self.related_rows(
+                rng, users, recipes, ingredients, self.ingredients_per_user,
+                self.ingredient_weights, self.ingredients_per_recipe
+            )
+            bulk_insert_rows(
+                Recipe.ingredients.through, ['recipe', 'ingredient'], ingredient_rows, using=db
+            )
+
+        # The bulk inserts don't send signals, so invalidate the cached lists (and the
+        # ETags) ourselves, in case they were read before the data was committed
+        invalidate_list_caches([user.pk for user in users])
+
+        self.counts['recipes'] += len(recipes)
+        self.counts['tags'] += len(tags)
+        self.counts['ingredients'] += len(ingredients)
+
+    def related_rows(self, rng, users, recipes, related, per_user, weights, per_recipe):
+        """Yield (recipe_id, related_id) rows, picking the related objects by weight"""
+        if not per_user or not per_recipe:
+            return
+
+        offsets = {user.pk: index * per_user for index, user in enumerate(users)}
+        choices = range(per_user)
+        for recipe in recipes:
+            offset = offsets[recipe.user_id]
+            # Picking by weight can give the same one twice, the set drops those
+            picked = set(rng.choices(choices, cum_weights=weights, k=per_recipe))
+            for index in sorted(picked):
+                yield recipe.pk, related[offset + index].pk
+
+    def add_data_versions(self, users, db):
+        """Create the DataVersion rows, that the post_save signal makes for a normal signup"""
+        # When bulk_insert falls back to saving one by one, the signal already made them
+        ids = [user.pk for user in users]
+        existing = set()
+        for start in range(0, len(ids), 500):
+            existing.update(DataVersion.objects.using(db).filter(
+                user_id__in=ids[start:start + 500]
+            ).values_list('user_id', flat=True))
+
+        now = timezone.now()
+        bulk_insert_rows(DataVersion, ['user', 'version', 'modified'], (
+            (user_id, 0, now) for user_id in ids if user_id not in existing
+        ), using=db)
@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.db.sharding import delete_user_rows, reserve_id_range
+from core.models import DataVersion, Ingredient, Recipe, Tag
+
+
+@receiver(post_save, sender=get_user_model())
+def create_data_version(sender, instance, created, **kwargs):
+    """Every user gets a data version row, so bumping it is a single UPDATE"""
+    if created:
+        DataVersion.objects.create(user=instance)
+
+
+# IMPORTANT: Bulk inserts and QuerySet.update() don't send these signals, so code
+# that writes that way has to call DataVersion.objects.bump() itself
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def bump_data_version(sender, instance, **kwargs):
+    """Bump the data version of the user owning the changed object"""
+    DataVersion.objects.bump(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_data_version_m2m(sender, instance, action, **kwargs):
+    """Bump the data version when tags or ingredients of a recipe change"""
+    # The instance is the recipe, or the tag/ingredient when changed from that side
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        DataVersion.objects.bump(instance.user_id)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def delete_sharded_data(sender, instance, **kwargs):
+    """Delete the data of a user on another shard, the cascade only sees the default one"""
+    # No version bump, the data version of the user is deleted along with it
+    if instance.shard != DEFAULT_DB_ALIAS:
+        delete_user_rows(instance.pk, instance.shard)
+
+
+@receiver(post_migrate)
+def reserve_shard_id_range(sender, using, **kwargs):
+    """Give a freshly migrated shard its own range of ids"""
+    if sender.name == 'core':
+        reserve_id_range(using)
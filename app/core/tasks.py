@@ -0,0 +1,14 @@
+from core.deletion import UserDeleter
+from core.jobs import task
+from core.models import UserDeletion
+
+
+# Deletions run on their own queue, so a big one doesn't hold up the other jobs
+@task(queue='deletions', max_attempts=5)
+def delete_user(deletion_id):
+    """Delete a user scheduled for deletion and all their data, in batches"""
+    deletion = UserDeletion.objects.get(pk=deletion_id)
+    # A retry or a second job after a crash continues where the last one stopped
+    if deletion.finished is None:
+        UserDeleter().run(deletion)
+    return deletion.deleted
@@ -2,6 +2,8 @@ from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.models import UserDeletion
+
 
 class AdminSiteTests(TestCase):
 
@@ -62,3 +64,18 @@ class AdminSiteTests(TestCase):
 
         # Check if the page exists
         self.assertEqual(response.status_code, 200)
+
+    def test_delete_user_scheduled(self):
+        """Test that deleting a user in the admin only schedules the deletion"""
+        url = reverse('admin:core_user_delete', args=[self.user.id])
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'post': 'yes'})
+
+        self.user.refresh_from_db()
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(UserDeletion.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            self.client.get(reverse('admin:core_userdeletion_changelist')).status_code, 200
+        )
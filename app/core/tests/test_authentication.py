@@ -0,0 +1,106 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import TokenCache, token_cache
+
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test authenticating with the cached token authentication"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@vazkir.com',
+            password='PasswordTest123',
+            name='Test'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+        # Use a real token instead of force_authenticate, so the cache is used
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_token_lookup_cached(self):
+        """Test that the second request doesn't query the token and user"""
+        response = self.client.get(ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+        self.assertEqual(token_cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_deleted_token_invalidated(self):
+        """Test that a deleted (or regenerated) token stops working right away"""
+        self.client.get(ME_URL)
+        self.token.delete()
+
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_invalidated(self):
+        """Test that a deactivated user can't use a cached token"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changed_user_invalidated(self):
+        """Test that changes to the user are visible on the next request"""
+        self.client.get(ME_URL)
+        self.user.name = 'New name'
+        self.user.save()
+
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.data['name'], 'New name')
+
+
+class TokenCacheTests(TestCase):
+    """Test the LRU and TTL behavior of the token cache"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@vazkir.com', 'test123')
+
+    def test_least_recently_used_evicted(self):
+        """Test that the least recently used token is evicted when full"""
+        cache = TokenCache(maxsize=2, ttl=60)
+        tokens = [Token(key=str(i), user=self.user) for i in range(3)]
+        cache.set('0', tokens[0])
+        cache.set('1', tokens[1])
+
+        # Using '0' makes '1' the least recently used one
+        cache.get('0')
+        cache.set('2', tokens[2])
+
+        self.assertIsNone(cache.get('1'))
+        self.assertIs(cache.get('0'), tokens[0])
+        self.assertIs(cache.get('2'), tokens[2])
+
+    @patch('core.authentication.time.monotonic')
+    def test_expired_token_removed(self, monotonic):
+        """Test that a token is no longer returned after the TTL"""
+        cache = TokenCache(maxsize=10, ttl=60)
+        monotonic.return_value = 100
+        cache.set('key', Token(key='key', user=self.user))
+
+        monotonic.return_value = 159
+        self.assertIsNotNone(cache.get('key'))
+
+        monotonic.return_value = 160
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.stats()['size'], 0)
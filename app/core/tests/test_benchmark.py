@@ -0,0 +1,45 @@
+from django.test import TestCase
+
+from core.benchmark import ApiBenchmark, compare_to_baseline
+
+
+def result(rps=100.0, p95_ms=10.0, queries=3):
+    """Return the measurements of an endpoint"""
+    return {
+        'rps': rps, 'p50_ms': p95_ms / 2, 'p95_ms': p95_ms, 'p99_ms': p95_ms, 'queries': queries
+    }
+
+
+class BenchmarkTests(TestCase):
+    """Test the API benchmark suite"""
+
+    def test_run_scale_measures_all_endpoints(self):
+        """Test that every endpoint is measured with timings and query counts"""
+        benchmark = ApiBenchmark(drivers=('client',), requests=2, warmup=0)
+
+        results = benchmark.run_scale('tiny', {'users': 2, 'recipes_per_user': 2})
+
+        self.assertEqual(set(results), {
+            'tiny.client.recipes', 'tiny.client.tags', 'tiny.client.ingredients',
+            'tiny.client.token', 'tiny.client.me',
+        })
+        self.assertEqual(results['tiny.client.tags']['queries'], 1)
+        for measurements in results.values():
+            self.assertGreater(measurements['rps'], 0)
+            self.assertLessEqual(measurements['p50_ms'], measurements['p99_ms'])
+
+    def test_compare_to_baseline(self):
+        """Test that more queries or much worse timings are regressions"""
+        baseline = {'a': result(), 'b': result(), 'c': result(), 'd': result()}
+        results = {
+            'a': result(queries=4),
+            'b': result(p95_ms=16.0),
+            'c': result(rps=60.0),
+            # Within the tolerance, or not in the baseline at all
+            'd': result(rps=80.0, p95_ms=14.0, queries=None),
+            'e': result(queries=100),
+        }
+
+        regressions = compare_to_baseline(results, baseline, tolerance=0.5)
+
+        self.assertEqual([regression.split(':')[0] for regression in regressions], ['a', 'b', 'c'])
@@ -1,27 +1,32 @@
 # Patch: Allows us to mock the behavior of the django_get_database function
 # We can simulate the db being available or not available when running TestCommand methods
+import tempfile
+from io import StringIO
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.migrations.executor import MigrationExecutor
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.management.commands.wait_for_db import Command as WaitForDbCommand
+from core.models import DataVersion
+
 
 class CommandTests(TestCase):
 
     def test_wait_for_db_ready(self):
         """What happens when we can our command and db is avaialble"""
 
-        # Mock the connection to the db, by tring to retrieve the default db connection;
-        # the "ConnectionHandler" with the __getitem__ retrieving the db
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            # Override is by returning True, aka the mock object
-            gi.return_value = True
-
+        # The command does a real SELECT 1 on the (test) database here
+        with patch.object(WaitForDbCommand, 'check_database', autospec=True,
+                          wraps=WaitForDbCommand.check_database) as check:
             # Our custom command
-            call_command('wait_for_db')
+            call_command('wait_for_db', stdout=StringIO())
 
             # Makes sure it's only called once
-            self.assertEqual(gi.call_count, 1)
+            self.assertEqual(check.call_count, 1)
 
     # So we're mocking the time.sleep function, so the function needs to an extra parameter
     # It just replaces the time.sleep function and replaces with with a funtion returning True
@@ -29,13 +34,96 @@ class CommandTests(TestCase):
     @patch('time.sleep', return_value=True)
     def test_wait_for_db(self, ts):
         """Test waiting for db"""
-        # Checks if the OperationalError is gone each second for 5 seconds, aka db is ready
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
+        # Checks if the OperationalError is gone after the retries, aka db is ready
+        with patch.object(WaitForDbCommand, 'check_database') as check:
             # We'r going to add a side effect to trigger the OperationalError the first 5 times
-            gi.side_effect = [OperationalError] * 5 + [True]  # Create s side_effect list
+            check.side_effect = [OperationalError] * 5 + [None]  # Create s side_effect list
 
             # Call the command
-            call_command('wait_for_db')
+            call_command('wait_for_db', initial_delay=1, max_delay=4, stdout=StringIO())
 
             # Makes sure it's called 6 times since this would not yield the OperationalError
-            self.assertEqual(gi.call_count, 6)
+            self.assertEqual(check.call_count, 6)
+
+        # The waits double up to the max delay, with jitter between half and the full delay
+        waits = [call[0][0] for call in ts.call_args_list]
+        for wait, delay in zip(waits, [1, 2, 4, 4, 4]):
+            self.assertTrue(delay / 2 <= wait <= delay)
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_timeout(self, ts):
+        """Test that the command gives up after the timeout"""
+        with patch.object(WaitForDbCommand, 'check_database') as check:
+            check.side_effect = OperationalError('connection refused')
+
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', timeout=0, stdout=StringIO())
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_migrations(self, ts):
+        """Test waiting until the migrations are applied"""
+        with patch.object(MigrationExecutor, 'migration_plan') as plan:
+            plan.side_effect = [['0001_initial'], ['0001_initial'], []]
+
+            call_command('wait_for_db', wait_for_migrations=True, stdout=StringIO())
+
+            self.assertEqual(plan.call_count, 3)
+
+    def test_import_recipes(self):
+        """Test importing recipes from an NDJSON file in small batches"""
+        user = get_user_model().objects.create_user('test@vazkir.com', 'test123')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as ndjson:
+            for i in range(5):
+                ndjson.write(
+                    '{"title": "Recipe %d", "time_minutes": 5, "price": "1.00", '
+                    '"ingredients": ["Salt", "Pepper"]}\n' % i
+                )
+            ndjson.write('{"title": "Broken"}\n')
+            ndjson.flush()
+            stderr = StringIO()
+            call_command(
+                'import_recipes', user.email, ndjson.name,
+                batch_size=2, stdout=StringIO(), stderr=stderr
+            )
+
+        # The invalid line is reported but doesn't stop the import
+        self.assertIn('Line 6:', stderr.getvalue())
+
+        self.assertEqual(user.recipe_set.count(), 5)
+        self.assertEqual(user.ingredient_set.count(), 2)
+        for recipe in user.recipe_set.all():
+            self.assertEqual(recipe.ingredients.count(), 2)
+
+    def test_seed_data(self):
+        """Test generating a small deterministic dataset"""
+        options = dict(
+            users=3, recipes_per_user=4, tags_per_user=2, ingredients_per_user=5,
+            seed=7, batch_size=2, stdout=StringIO()
+        )
+        call_command('seed_data', prefix='a', **options)
+        call_command('seed_data', prefix='b', **options)
+
+        first = get_user_model().objects.filter(email__startswith='a').order_by('id')
+        second = get_user_model().objects.filter(email__startswith='b').order_by('id')
+        self.assertEqual(first.count(), 3)
+
+        # The same seed gives the same recipes, and everyone can log in with one hash
+        for user, other in zip(first, second):
+            self.assertEqual(
+                list(user.recipe_set.order_by('id').values_list('title', 'price')),
+                list(other.recipe_set.order_by('id').values_list('title', 'price')),
+            )
+            self.assertEqual(user.tag_set.count(), 2)
+            self.assertTrue(user.check_password('password'))
+            self.assertTrue(DataVersion.objects.filter(user=user).exists())
+            for recipe in user.recipe_set.all():
+                self.assertTrue(1 <= recipe.ingredients.count() <= 5)
+                self.assertFalse(recipe.tags.exclude(user=user).exists())
+
+    def test_seed_data_existing_prefix(self):
+        """Test that seeding with a prefix that was used before fails"""
+        call_command('seed_data', users=1, stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', users=1, stdout=StringIO())
@@ -0,0 +1,69 @@
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Connection pooling needs Postgres')
+class ConnectionPoolTests(TestCase):
+    """Test the pooled Postgres database backend"""
+
+    def setUp(self):
+        # Imported here, since it needs psycopg2
+        from core.db.backends.postgresql_pool import base
+        self.base = base
+        self.settings_dict = dict(connection.settings_dict)
+        self.settings_dict['POOL'] = {'MIN_SIZE': 1, 'MAX_SIZE': 2, 'TIMEOUT': 0.1}
+        self.addCleanup(base.close_pools)
+
+    def backend_pid(self, wrapper):
+        """Return the process id of the Postgres backend serving the connection"""
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connection_reused(self):
+        """Test that closing returns the connection to the pool for the next request"""
+        wrapper = self.base.DatabaseWrapper(dict(self.settings_dict), alias='pool_test')
+        first = self.backend_pid(wrapper)
+        wrapper.close()
+
+        self.assertEqual(self.backend_pid(wrapper), first)
+        wrapper.close()
+
+    def test_expired_connection_replaced(self):
+        """Test that a connection past its max lifetime is replaced on checkout"""
+        self.settings_dict['POOL']['MAX_LIFETIME'] = 0
+        wrapper = self.base.DatabaseWrapper(dict(self.settings_dict), alias='pool_test')
+        first = self.backend_pid(wrapper)
+        wrapper.close()
+
+        self.assertNotEqual(self.backend_pid(wrapper), first)
+        wrapper.close()
+
+    def test_dead_connection_replaced(self):
+        """Test that the health check replaces a connection that was closed"""
+        wrapper = self.base.DatabaseWrapper(dict(self.settings_dict), alias='pool_test')
+        self.backend_pid(wrapper)
+        raw = wrapper.connection
+        wrapper.close()
+        raw.close()
+
+        self.backend_pid(wrapper)
+        self.assertIsNot(wrapper.connection, raw)
+        wrapper.close()
+
+    def test_exhausted_pool_times_out(self):
+        """Test that checking out more than MAX_SIZE connections fails after the timeout"""
+        from django.db.utils import OperationalError
+        wrappers = [
+            self.base.DatabaseWrapper(dict(self.settings_dict), alias='pool_test')
+            for _ in range(3)
+        ]
+        self.backend_pid(wrappers[0])
+        self.backend_pid(wrappers[1])
+
+        with self.assertRaises(OperationalError):
+            self.backend_pid(wrappers[2])
+
+        wrappers[0].close()
+        wrappers[1].close()
@@ -0,0 +1,110 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+
+from core.deletion import UserDeleter, schedule_user_deletion
+from core.models import Ingredient, Recipe, Tag
+
+
+def sample_data(user, recipes=3):
+    """Create some recipes with a tag and an ingredient for the user"""
+    tag = Tag.objects.create(user=user, name='Vegan')
+    ingredient = Ingredient.objects.create(user=user, name='Salt')
+    for number in range(recipes):
+        recipe = Recipe.objects.create(
+            user=user, title='Soup %d' % number, time_minutes=5, price=1
+        )
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+
+
+class UserDeletionTests(TestCase):
+    """Test deleting users and their data in the background"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@londonappdev.com', 'testpass')
+        self.other = get_user_model().objects.create_user('other@londonappdev.com', 'testpass')
+        sample_data(self.user)
+        sample_data(self.other, recipes=1)
+
+    def test_schedule_deactivates_user(self):
+        """Test that scheduling deactivates the user and keeps the data for later"""
+        Token.objects.create(user=self.user)
+
+        deletion = schedule_user_deletion(self.user)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(schedule_user_deletion(self.user), deletion)
+
+    def test_delete_in_batches(self):
+        """Test that the data is deleted in batches, with the progress recorded"""
+        deletion = schedule_user_deletion(self.user)
+
+        UserDeleter(batch_size=2).run(deletion)
+
+        deletion.refresh_from_db()
+        self.assertIsNotNone(deletion.finished)
+        self.assertIsNone(deletion.user)
+        self.assertEqual(deletion.deleted, 5)
+        self.assertEqual(deletion.total, 5)
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Recipe.tags.through.objects.filter(recipe__user=self.user).exists())
+        # The other user's data stays
+        self.assertEqual(Recipe.objects.filter(user=self.other).count(), 1)
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+
+    def test_delete_links_from_other_users(self):
+        """Test that other users' recipes linked to the user's tags don't block the delete"""
+        # Linking to another user's tags was possible before they were validated
+        recipe = Recipe.objects.get(user=self.other)
+        recipe.tags.add(Tag.objects.get(user=self.user))
+        recipe.ingredients.add(Ingredient.objects.get(user=self.user))
+        deletion = schedule_user_deletion(self.user)
+
+        UserDeleter(batch_size=2).run(deletion)
+        connection.check_constraints()
+
+        self.assertFalse(Tag.objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(list(recipe.tags.all()), [Tag.objects.get(user=self.other)])
+        self.assertEqual(
+            list(recipe.ingredients.all()), [Ingredient.objects.get(user=self.other)]
+        )
+
+    def test_resume_after_crash(self):
+        """Test that a deletion that stopped halfway continues when run again"""
+        deletion = schedule_user_deletion(self.user)
+        delete_batch = UserDeleter.delete_batch
+        batches = []
+
+        # Crash on the 6th batch, in the middle of the tag through rows
+        def crash(deleter, *args):
+            if len(batches) == 5:
+                raise RuntimeError('crash')
+            batches.append(args)
+            return delete_batch(deleter, *args)
+
+        with patch.object(UserDeleter, 'delete_batch', autospec=True, side_effect=crash):
+            with self.assertRaises(RuntimeError):
+                UserDeleter(batch_size=2).run(deletion)
+
+        deletion.refresh_from_db()
+        self.assertIsNone(deletion.finished)
+        self.assertEqual(deletion.step, 'core.Recipe_tags')
+        self.assertEqual(Recipe.tags.through.objects.filter(recipe__user=self.user).count(), 1)
+
+        call_command('delete_users', batch_size=2, stdout=StringIO())
+
+        deletion.refresh_from_db()
+        self.assertIsNotNone(deletion.finished)
+        self.assertEqual(deletion.deleted, 5)
+        self.assertEqual(deletion.total, 5)
+        self.assertFalse(Recipe.objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(Tag.objects.filter(user_id=self.user.pk).exists())
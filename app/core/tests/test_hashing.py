@@ -0,0 +1,97 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+
+from core.hashing import HashingPool, HashingPoolSaturated, hashing_pool
+
+
+CREATE_USER_URL = reverse('user:create')
+TOKEN_URL = reverse('user:token')
+ME_URL = reverse('user:me')
+
+
+class HashingPoolTests(TestCase):
+    """Test the bounded password hashing pool"""
+
+    def test_run_returns_result_and_records_latency(self):
+        """Test that the function result is returned and timed"""
+        pool = HashingPool(workers=1, max_queue=0, retry_after=1)
+
+        self.assertEqual(pool.run('hash', pow, 2, 3), 8)
+
+        stats = pool.stats()
+        self.assertEqual(stats['latency']['hash']['count'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_saturated_pool_rejects(self):
+        """Test that a full pool rejects instead of queueing"""
+        pool = HashingPool(workers=1, max_queue=0, retry_after=3)
+        pool._slots.acquire()
+
+        with self.assertRaises(HashingPoolSaturated) as context:
+            pool.run('hash', pow, 2, 3)
+
+        self.assertEqual(context.exception.wait, 3)
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_password_checked_on_pool(self):
+        """Test that setting and checking passwords runs on the pool"""
+        before = hashing_pool.stats()['latency'].get('verify', {}).get('count', 0)
+        user = get_user_model().objects.create_user('test@vazkir.com', 'test123')
+
+        self.assertTrue(user.check_password('test123'))
+        self.assertFalse(user.check_password('wrong'))
+        self.assertEqual(hashing_pool.stats()['latency']['verify']['count'], before + 2)
+
+
+class HashingBackpressureApiTests(TestCase):
+    """Test that the login and signup endpoints push back when the pool is full"""
+
+    def setUp(self):
+        self.client = APIClient()
+        get_user_model().objects.create_user('test@vazkir.com', 'test123')
+
+        # Take every slot of the pool, so it's saturated for the requests
+        capacity = hashing_pool.workers + hashing_pool.max_queue
+        for _ in range(capacity):
+            hashing_pool._slots.acquire()
+        self.addCleanup(lambda: [hashing_pool._slots.release() for _ in range(capacity)])
+
+    def test_login_saturated(self):
+        """Test that logging in returns a 503 with Retry-After"""
+        response = self.client.post(TOKEN_URL, {'email': 'test@vazkir.com', 'password': 'test123'})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], str(hashing_pool.retry_after))
+
+    def test_signup_saturated(self):
+        """Test that signing up returns a 503 and creates no user"""
+        payload = {'email': 'new@vazkir.com', 'password': 'test123', 'name': 'New'}
+        response = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(get_user_model().objects.filter(email=payload['email']).exists())
+
+    def test_model_raises_plain_exception(self):
+        """Test that outside the API a full pool is a plain error, not an HTTP one"""
+        user = get_user_model().objects.get(email='test@vazkir.com')
+
+        with self.assertRaises(HashingPoolSaturated) as context:
+            user.set_password('other123')
+
+        self.assertNotIsInstance(context.exception, APIException)
+
+    def test_update_password_saturated(self):
+        """Test that a password change returns a 503 and changes nothing"""
+        user = get_user_model().objects.get(email='test@vazkir.com')
+        self.client.force_authenticate(user)
+
+        response = self.client.patch(ME_URL, {'name': 'Other', 'password': 'other123'})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        user.refresh_from_db()
+        self.assertNotEqual(user.name, 'Other')
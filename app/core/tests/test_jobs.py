@@ -0,0 +1,147 @@
+import sys
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.deletion import schedule_user_deletion
+from core.models import Job, Recipe, UserDeletion
+
+
+@jobs.task(name='tests.add')
+def add(a, b):
+    return a + b
+
+
+@jobs.task(name='tests.fail', max_attempts=2)
+def fail():
+    raise ValueError('Broken')
+
+
+@override_settings(JOB_QUEUES={'default': 1, 'deletions': 1}, JOB_RETRY_DELAY=10)
+class JobQueueTests(TestCase):
+    """Test queueing jobs and running them with workers"""
+
+    def test_enqueue_and_run(self):
+        """Test that a queued job is run once and its result can be polled"""
+        job = add.enqueue(1, b=2)
+        self.assertEqual(jobs.poll(job.pk).status, Job.QUEUED)
+
+        jobs.Worker('default').work(burst=True)
+
+        job = jobs.poll(job.pk)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.result, '3')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.locked_until)
+
+    def test_workers_claim_different_jobs(self):
+        """Test that parallel workers never claim the same job"""
+        first, second = add.enqueue(1, 1), add.enqueue(2, 2)
+
+        claimed = [jobs.Worker('default', name=str(number)).claim() for number in range(3)]
+
+        self.assertEqual([job.pk for job in claimed[:2]], [first.pk, second.pk])
+        self.assertIsNone(claimed[2])
+        self.assertEqual(Job.objects.get(pk=second.pk).worker, '1')
+
+    def test_only_due_jobs_of_queue(self):
+        """Test that the jobs of other queues and later jobs are left alone"""
+        add.enqueue(1, 1, queue='deletions')
+        add.enqueue(1, 1, delay=60)
+
+        self.assertIsNone(jobs.Worker('default').claim())
+
+    def test_retry_with_backoff(self):
+        """Test that a failing job is retried later and then marked failed"""
+        job = fail.enqueue()
+        worker = jobs.Worker('default')
+
+        before = timezone.now()
+        with self.assertLogs('core.jobs', 'ERROR'):
+            worker.run_next()
+        job = jobs.poll(job.pk)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('Broken', job.error)
+        self.assertTrue(before + timedelta(seconds=5) <= job.run_at)
+        # Not due yet
+        self.assertIsNone(worker.run_next())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            worker.run_next()
+        job = jobs.poll(job.pk)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.finished)
+
+    def test_expired_lease_run_again(self):
+        """Test that the job of a crashed worker is run by another worker"""
+        job = add.enqueue(1, 2)
+        jobs.Worker('default', name='crashed').claim()
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        jobs.Worker('default').work(burst=True)
+
+        job = jobs.poll(job.pk)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 2)
+
+    def test_expired_lease_without_attempts_failed(self):
+        """Test that a job that keeps killing its worker is failed, not run forever"""
+        job = fail.enqueue()
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, attempts=2, worker='crashed',
+            locked_until=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertIsNone(jobs.Worker('default').claim())
+
+        job = jobs.poll(job.pk)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(job.locked_until)
+        self.assertIsNotNone(job.finished)
+
+    def test_claim_retries_without_recursion(self):
+        """Test that losing many races in a row doesn't exhaust the stack"""
+        job = add.enqueue(1, 2)
+        lost = [(job, False)] * (sys.getrecursionlimit() + 10)
+
+        with patch.object(jobs.Worker, 'try_claim', side_effect=lost + [(None, False)]):
+            self.assertIsNone(jobs.Worker('default').claim())
+
+    def test_run_worker(self):
+        """Test that the run_worker command runs the queued jobs of all queues"""
+        jobs.enqueue('tests.add', 1, 2)
+        jobs.enqueue('tests.add', 3, 4, queue='deletions')
+
+        call_command('run_worker', burst=True, concurrency=1, queues=['default'],
+                     stdout=StringIO())
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 1)
+
+        with self.assertRaises(CommandError):
+            call_command('run_worker', burst=True, queues=['unknown'], stdout=StringIO())
+
+    def test_user_deletion_job(self):
+        """Test that scheduling a user deletion queues the job that deletes the data"""
+        user = get_user_model().objects.create_user('test@londonappdev.com', 'testpass')
+        Recipe.objects.create(user=user, title='Soup', time_minutes=5, price=1)
+
+        deletion = schedule_user_deletion(user)
+        job = Job.objects.get(task='core.tasks.delete_user')
+        self.assertEqual(job.queue, 'deletions')
+
+        jobs.Worker('deletions').work(burst=True)
+
+        deletion.refresh_from_db()
+        self.assertEqual(jobs.poll(job.pk).status, Job.DONE)
+        self.assertIsNotNone(deletion.finished)
+        self.assertFalse(Recipe.objects.filter(user_id=user.pk).exists())
+        self.assertFalse(UserDeletion.objects.filter(user_id=user.pk).exists())
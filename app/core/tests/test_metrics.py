@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.hashing import hash_password
+from core.metrics import registry, snapshot_name
+
+
+METRICS_URL = reverse('metrics')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def sample_line(text, prefix):
+    """Return the value of the first metrics line starting with prefix"""
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class MetricsTests(TestCase):
+    """Test the per view request metrics"""
+
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('test@londonappdev.com', 'testpass')
+        self.client.force_authenticate(self.user)
+
+    def test_requests_recorded_per_view_and_method(self):
+        """Test that latency, query count and size are recorded per view"""
+        self.client.get(TAGS_URL)
+        response = self.client.get(TAGS_URL)
+
+        res = self.client.get(METRICS_URL)
+        text = res.content.decode()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        labels = '{view="recipe:tag-list",method="GET"'
+        self.assertEqual(sample_line(text, 'http_request_duration_seconds_count' + labels), 2)
+        self.assertEqual(
+            sample_line(text, 'http_request_duration_seconds_bucket' + labels + ',le="+Inf"}'), 2
+        )
+        self.assertGreater(sample_line(text, 'http_request_db_queries_total' + labels), 0)
+        self.assertEqual(
+            sample_line(text, 'http_response_size_bytes_total' + labels),
+            2 * len(response.content)
+        )
+
+    def test_unresolved_requests_recorded(self):
+        """Test that requests for unknown urls are grouped together"""
+        self.client.get('/does-not-exist/')
+
+        text = self.client.get(METRICS_URL).content.decode()
+
+        self.assertEqual(sample_line(
+            text, 'http_request_duration_seconds_count{view="unresolved",method="GET"}'
+        ), 1)
+
+    def test_metrics_of_processes_added_up(self):
+        """Test that the snapshots of all processes in METRICS_DIR are added up"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = {
+            'views': [['recipe:tag-list', 'GET', [3, 0.3, 6, 0.01, 300, [3] + [0] * 11]]],
+            'counters': {'token_cache_hits_total': 5},
+            'gauges': {},
+        }
+        with open(os.path.join(directory, '1.json'), 'w') as snapshot_file:
+            json.dump(other, snapshot_file)
+
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(TAGS_URL)
+            text = self.client.get(METRICS_URL).content.decode()
+
+        labels = '{view="recipe:tag-list",method="GET"'
+        self.assertEqual(sample_line(text, 'http_request_duration_seconds_count' + labels), 4)
+        self.assertGreaterEqual(sample_line(text, 'token_cache_hits_total'), 5)
+        self.assertTrue(os.path.exists(os.path.join(directory, snapshot_name())))
+
+    def test_dead_processes_archived(self):
+        """Test that the totals of a process that is gone stay, in the archive"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # The pid of a process that has exited (and was waited for)
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        path = os.path.join(directory, '%d-1.json' % process.pid)
+        with open(path, 'w') as snapshot_file:
+            json.dump({
+                'views': [['recipe:tag-list', 'GET', [3, 0.3, 6, 0.01, 300, [3] + [0] * 11]]],
+                'counters': {'token_cache_hits_total': 5},
+                'gauges': {'password_hashing_queue_depth': 7},
+            }, snapshot_file)
+
+        labels = '{view="recipe:tag-list",method="GET"'
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(TAGS_URL)
+            first = self.client.get(METRICS_URL).content.decode()
+            second = self.client.get(METRICS_URL).content.decode()
+
+        for text in (first, second):
+            self.assertEqual(sample_line(text, 'http_request_duration_seconds_count' + labels), 4)
+            self.assertGreaterEqual(sample_line(text, 'token_cache_hits_total'), 5)
+            # The gauges of a process that is gone don't count anymore
+            self.assertEqual(sample_line(text, 'password_hashing_queue_depth'), 0)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'archive.json')))
+
+    def test_reused_pid_archived(self):
+        """Test that the file of an old process with our pid is archived, not overwritten"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Written by a process that had our pid before, with another start time
+        path = os.path.join(directory, '%d-1.json' % os.getpid())
+        with open(path, 'w') as snapshot_file:
+            json.dump({
+                'views': [['recipe:tag-list', 'GET', [3, 0.3, 6, 0.01, 300, [3] + [0] * 11]]],
+                'counters': {}, 'gauges': {},
+            }, snapshot_file)
+
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(TAGS_URL)
+            text = self.client.get(METRICS_URL).content.decode()
+
+        labels = '{view="recipe:tag-list",method="GET"'
+        self.assertEqual(sample_line(text, 'http_request_duration_seconds_count' + labels), 4)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(directory, snapshot_name())))
+
+    def test_hashing_latency_exported(self):
+        """Test that the password hashing latency is exported as a summary"""
+        hash_password('testpass')
+
+        text = self.client.get(METRICS_URL).content.decode()
+
+        self.assertIn('# TYPE password_hashing_duration_seconds summary', text)
+        self.assertGreaterEqual(
+            sample_line(text, 'password_hashing_duration_seconds_count{operation="hash"}'), 1
+        )
+        self.assertGreater(
+            sample_line(text, 'password_hashing_duration_seconds_sum{operation="hash"}'), 0
+        )
+        self.assertGreater(
+            sample_line(text, 'password_hashing_duration_seconds_max{operation="hash"}'), 0
+        )
+
+    def test_metrics_forbidden_from_other_addresses(self):
+        """Test that only allowed addresses may read the metrics"""
+        res = self.client.get(METRICS_URL, REMOTE_ADDR='203.0.113.7')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        with override_settings(METRICS_ALLOWED_IPS=['203.0.113.0/24']):
+            res = self.client.get(METRICS_URL, REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=[])
+    def test_metrics_bearer_token(self):
+        """Test that the metrics can be read with the bearer token from anywhere"""
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -1,3 +1,4 @@
+from django.db import connection
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from core import models
@@ -86,3 +87,19 @@ class ModelTests(TestCase):
         )
 
         self.assertEqual(str(recipe), recipe.title)
+
+    def test_user_access_indexes(self):
+        """Test that the composite per-user indexes exist in the database"""
+        expected = [
+            (models.Recipe, 'core_recipe_user_pk_idx', ['user_id', 'id']),
+            (models.Ingredient, 'core_ingredient_user_name_idx', ['user_id', 'name']),
+            (models.Tag, 'core_tag_user_name_idx', ['user_id', 'name']),
+        ]
+
+        with connection.cursor() as cursor:
+            for model, name, columns in expected:
+                constraints = connection.introspection.get_constraints(
+                    cursor, model._meta.db_table
+                )
+                self.assertIn(name, constraints)
+                self.assertEqual(constraints[name]['columns'], columns)
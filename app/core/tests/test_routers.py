@@ -0,0 +1,82 @@
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core.db.routers import ReplicaRouter, ReplicaRoutingMiddleware
+from core.models import DataVersion, Recipe
+
+
+def read_db(request):
+    """View that returns the database a recipe query would read from"""
+    return HttpResponse(Recipe.objects.all().db)
+
+
+def read_dbs(request):
+    """View that returns the databases of a data version and a recipe query"""
+    return HttpResponse('%s %s' % (DataVersion.objects.all().db, Recipe.objects.all().db))
+
+
+def write_and_read_db(request):
+    """View that writes, then returns the database it reads from"""
+    router.db_for_write(Recipe)
+    return read_db(request)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_PIN_SECONDS=60)
+class ReplicaRouterTests(SimpleTestCase):
+    """Test routing the reads of safe requests to the replicas"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def request(self, view, method='get', token='abc'):
+        """Send a request through the middleware, return the database read from"""
+        request = getattr(self.factory, method)('/', HTTP_AUTHORIZATION='Token ' + token)
+        return ReplicaRoutingMiddleware(view)(request).content.decode()
+
+    def test_safe_request_reads_from_replica(self):
+        """Test that a GET request reads from the replica"""
+        self.assertEqual(self.request(read_db), 'replica')
+
+    def test_unsafe_request_reads_from_primary(self):
+        """Test that a POST request reads and writes on the primary"""
+        self.assertEqual(self.request(read_db, method='post'), 'default')
+        self.assertEqual(router.db_for_write(Recipe), 'default')
+
+    def test_outside_request_reads_from_primary(self):
+        """Test that commands and other code outside a request use the primary"""
+        self.request(read_db)
+
+        self.assertEqual(Recipe.objects.all().db, 'default')
+
+    def test_client_that_wrote_pinned_to_primary(self):
+        """Test that after a write the client reads its writes from the primary"""
+        self.request(write_and_read_db, method='post')
+
+        self.assertEqual(self.request(read_db), 'default')
+        # Other clients still read from the replica
+        self.assertEqual(self.request(read_db, token='other'), 'replica')
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+    def test_request_reads_from_one_replica(self):
+        """Test that all the reads of a request go to the same replica"""
+        used = set()
+        for _ in range(20):
+            version_db, recipe_db = self.request(read_dbs).split()
+            self.assertEqual(version_db, recipe_db)
+            used.add(recipe_db)
+
+        # The requests are spread over the replicas
+        self.assertEqual(used, {'replica_1', 'replica_2'})
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Test that everything goes to the primary without replicas"""
+        self.assertEqual(self.request(read_db), 'default')
+
+    def test_no_migrations_on_replica(self):
+        """Test that the replicas get their tables from the primary"""
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'core'))
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'core'))
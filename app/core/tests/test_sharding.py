@@ -0,0 +1,159 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, router
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import token_cache
+from core.db.sharding import choose_shard, delete_user_rows
+from core.models import DataVersion, Ingredient, Recipe, Tag
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+# The tests that really write to a second database need one, like:
+# DATABASE_SHARDS = ['default', 'shard_1'] with a 'shard_1' in DATABASES
+HAS_SHARDS = 'shard_1' in getattr(settings, 'DATABASE_SHARDS', ())
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class ShardRouterTests(SimpleTestCase):
+    """Test routing the user owned objects to the shard of their user"""
+
+    def setUp(self):
+        self.user = get_user_model()(id=1, email='test@londonappdev.com', shard='shard_1')
+
+    def test_queries_for_user_on_shard(self):
+        """Test that the querysets for a user go to the user's shard"""
+        self.assertEqual(Recipe.objects.for_user(self.user).db, 'shard_1')
+        self.assertEqual(Tag.objects.for_user(self.user).db, 'shard_1')
+
+    def test_related_queries_on_shard(self):
+        """Test that related lookups and new objects of the user use the shard"""
+        recipe = Recipe(id=1, user=self.user, title='Soup', time_minutes=5, price=1)
+
+        # The related managers ask the router with the instance as hint (and
+        # the connection, so they can't be built without a shard_1 database)
+        self.assertEqual(recipe._state.db, 'shard_1')
+        self.assertEqual(router.db_for_read(Recipe, instance=self.user), 'shard_1')
+        self.assertEqual(router.db_for_read(Tag, instance=recipe), 'shard_1')
+
+    def test_default_shard_left_to_default(self):
+        """Test that users on the default shard use the default database"""
+        self.user.shard = 'default'
+
+        self.assertEqual(Recipe.objects.for_user(self.user).db, 'default')
+        self.assertEqual(router.db_for_read(Ingredient, instance=self.user), 'default')
+
+    def test_choose_shard_stable(self):
+        """Test that new users are spread over the shards by email"""
+        emails = ['user%d@londonappdev.com' % number for number in range(50)]
+        chosen = [choose_shard(email) for email in emails]
+
+        self.assertEqual(set(chosen), {'default', 'shard_1'})
+        self.assertEqual(chosen, [choose_shard(email) for email in emails])
+
+
+class DeleteUserRowsTests(TestCase):
+    """Test deleting all the rows of a user from a database"""
+
+    def test_delete_user_rows(self):
+        """Test that the rows go with plain DELETEs, without a version bump per row"""
+        user = get_user_model().objects.create_user('test@londonappdev.com', 'testpass')
+        other = get_user_model().objects.create_user('other@londonappdev.com', 'testpass')
+        tag = Tag.objects.create(user=user, name='Vegan')
+        for number in range(3):
+            Recipe.objects.create(
+                user=user, title='Soup %d' % number, time_minutes=5, price=1
+            ).tags.add(tag)
+        # A link from another user's recipe, from before the tags were validated
+        kept = Recipe.objects.create(user=other, title='Stew', time_minutes=5, price=1)
+        kept.tags.add(tag)
+        version = DataVersion.objects.get_for_user(user.pk)[0]
+
+        deleted = delete_user_rows(user.pk, 'default', batch_size=2)
+
+        self.assertEqual(deleted, 8)
+        self.assertEqual(DataVersion.objects.get_for_user(user.pk)[0], version)
+        self.assertFalse(Recipe.objects.filter(user=user).exists())
+        self.assertFalse(Tag.objects.filter(user=user).exists())
+        self.assertEqual(list(Recipe.objects.filter(user=other)), [kept])
+        connection.check_constraints()
+
+
+@skipUnless(HAS_SHARDS, 'Needs a second database as shard_1')
+class ShardStorageTests(TestCase):
+    """Test storing and moving the data of users on another database"""
+
+    multi_db = True
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass', shard='shard_1'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_api_writes_and_reads_shard(self):
+        """Test that the objects created through the API are on the user's shard"""
+        tag = self.client.post(TAGS_URL, {'name': 'Vegan'}).data
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+            'tags': [tag['id']], 'ingredients': [],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Recipe.objects.using('default').exists())
+        recipe = Recipe.objects.using('shard_1').get()
+        self.assertEqual(list(recipe.tags.values_list('name', flat=True)), ['Vegan'])
+        self.assertEqual(self.client.get(RECIPES_URL).data['results'][0]['tags'], [tag['id']])
+
+    def test_writes_refused_while_moving(self):
+        """Test that writes get a 503 while the user is being moved"""
+        get_user_model().objects.filter(pk=self.user.pk).update(shard_moving=True)
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(self.client.get(TAGS_URL).status_code, status.HTTP_200_OK)
+
+    def test_move_user_shard(self):
+        """Test moving the data of a user to another shard, keeping the ids"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        # The user with its old shard is in the token cache
+        token = Token.objects.create(user=self.user)
+        token_cache.set(token.key, token)
+
+        call_command(
+            'move_user_shard', self.user.email, 'default', grace=0, settle=0, stdout=StringIO()
+        )
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, 'default')
+        self.assertFalse(Recipe.objects.using('shard_1').exists())
+        self.assertIsNone(token_cache.get(token.key))
+        moved = Recipe.objects.for_user(self.user).get()
+        self.assertEqual(moved.pk, recipe.pk)
+        self.assertEqual(list(moved.tags.all()), [tag])
+        self.assertEqual(list(moved.ingredients.all()), [ingredient])
+
+    def test_delete_user_deletes_shard_data(self):
+        """Test that deleting a user also deletes the data on the shard"""
+        Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=1)
+
+        self.user.delete()
+
+        self.assertFalse(Recipe.objects.using('shard_1').exists())
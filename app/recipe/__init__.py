@@ -0,0 +1,2 @@
+# So Django uses our RecipeConfig (and runs its ready) when we add 'recipe' to INSTALLED_APPS
+default_app_config = 'recipe.apps.RecipeConfig'
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.models import DataVersion
+
+
+# Cache keys are namespaced, so the cache can be shared with other uses
+KEY_PREFIX = 'recipe:list'
+
+
+def get_list_cache():
+    """Return the cache backend to use, from the RECIPE_LIST_CACHE_ALIAS setting"""
+    return caches[getattr(settings, 'RECIPE_LIST_CACHE_ALIAS', 'default')]
+
+
+def list_cache_enabled():
+    """Return if the list cache is turned on"""
+    return getattr(settings, 'RECIPE_LIST_CACHE_ENABLED', True)
+
+
+def list_cache_key(model, user_id, version, url):
+    """Return the key of a cached list response of the user for the url
+
+    Every key contains the user's DataVersion, which is bumped on every change of
+    the user's data. So a change invalidates the cached lists in all the processes
+    at once. The version lives on the default database and the data may be on a
+    shard, so the two don't commit together: bulk writes bump after their commit.
+    """
+    url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
+    return '{}:{}:{}:{}:{}'.format(
+        KEY_PREFIX, model._meta.label_lower, user_id, version, url_hash
+    )
+
+
+def invalidate_list_cache(user_id):
+    """Invalidate all the cached list responses (and the ETags) of the user
+
+    The saves and deletes of the models already bump the data version through
+    their signals, this is for the writes that don't send signals (bulk inserts).
+    """
+    DataVersion.objects.bump(user_id)
+
+
+def invalidate_list_caches(user_ids):
+    """Invalidate the cached list responses of many users at once"""
+    DataVersion.objects.bump_many(user_ids)
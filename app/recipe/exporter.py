@@ -0,0 +1,87 @@
+import csv
+import json
+from collections import defaultdict
+
+from core.models import Recipe
+
+
+# The columns of an exported recipe, in the order of the CSV header
+EXPORT_FIELDS = ('id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients')
+
+
+def export_recipes(user, chunk_size=500):
+    """Yield dicts of all the recipes of the user with tag and ingredient names
+
+    The recipes are read with a server side cursor in chunks and the names are
+    fetched per chunk, so memory use only depends on the chunk size.
+    (The chunk size stays below SQLite's limit of 999 parameters in the IN query)
+    """
+    recipes = Recipe.objects.for_user(user).order_by('id').values_list(
+        'id', 'title', 'time_minutes', 'price', 'link'
+    )
+    # The names are read from the same database (shard or replica) as the recipes
+    db = recipes.db
+
+    chunk = []
+    for recipe in recipes.iterator(chunk_size=chunk_size):
+        chunk.append(recipe)
+        if len(chunk) >= chunk_size:
+            yield from _export_chunk(chunk, db)
+            chunk = []
+
+    if chunk:
+        yield from _export_chunk(chunk, db)
+
+
+def _export_chunk(chunk, db):
+    """Join the tag and ingredient names onto a chunk of recipe rows"""
+    ids = [recipe[0] for recipe in chunk]
+    tags = _names_by_recipe(Recipe.tags.through, 'tag', ids, db)
+    ingredients = _names_by_recipe(Recipe.ingredients.through, 'ingredient', ids, db)
+
+    for recipe_id, title, time_minutes, price, link in chunk:
+        yield {
+            'id': recipe_id,
+            'title': title,
+            'time_minutes': time_minutes,
+            'price': str(price),
+            'link': link,
+            'tags': tags[recipe_id],
+            'ingredients': ingredients[recipe_id],
+        }
+
+
+def _names_by_recipe(through, field, recipe_ids, db):
+    """Return a dict of recipe id -> sorted names of the related objects"""
+    names = defaultdict(list)
+    rows = through.objects.using(db).filter(recipe_id__in=recipe_ids).values_list(
+        'recipe_id', field + '__name'
+    ).order_by('recipe_id', field + '__name')
+
+    for recipe_id, name in rows:
+        names[recipe_id].append(name)
+    return names
+
+
+def to_ndjson(recipes):
+    """Yield every recipe as a line of JSON"""
+    for recipe in recipes:
+        yield json.dumps(recipe) + '\n'
+
+
+class _Echo:
+    """File like object that just returns what is written, for the csv writer"""
+
+    def write(self, value):
+        return value
+
+
+def to_csv(recipes, separator='|'):
+    """Yield a CSV header and a line per recipe, names are joined by separator"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+
+    for recipe in recipes:
+        recipe['tags'] = separator.join(recipe['tags'])
+        recipe['ingredients'] = separator.join(recipe['ingredients'])
+        yield writer.writerow([recipe[field] for field in EXPORT_FIELDS])
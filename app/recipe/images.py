@@ -0,0 +1,192 @@
+import hashlib
+import io
+import mimetypes
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+
+# The directory in the storage with the images and their thumbnails
+IMAGE_DIR = 'recipes'
+
+# The first bytes of the image formats we accept -> the extension we store them with
+# We look at the content, the name and content type of an upload are up to the client
+SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+)
+
+# The names are content hashes, the file behind a name never changes
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def max_image_size():
+    """Return the largest image accepted, in bytes"""
+    return getattr(settings, 'RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024)
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Stream the uploaded files to a temporary file, hashing them on the way
+
+    The upload never sits in memory as a whole: every chunk is written to disk
+    and added to the SHA-256. Once a file passes max_size the upload is stopped
+    and the connection reset, so the rest of the body is never even read, and
+    too_large is set on the handler for the view to report it.
+    """
+
+    def __init__(self, *args, max_size=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_size = max_size or max_image_size()
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.too_large = True
+            # Django drops the partial file, and doesn't read the rest of the request
+            raise StopUpload(connection_reset=True)
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+def sniff_extension(uploaded):
+    """Return the extension for the image type of the file, None when it's no image"""
+    uploaded.seek(0)
+    head = uploaded.read(16)
+    uploaded.seek(0)
+
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def hash_file(uploaded):
+    """Return the SHA-256 of a file, reading it in chunks"""
+    sha256 = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        sha256.update(chunk)
+    uploaded.seek(0)
+    return sha256.hexdigest()
+
+
+def store_image(uploaded, extension):
+    """Store the uploaded image under its content hash and return the name
+
+    Uploading the same image again (by any user) finds the file already there,
+    so it's stored once. For the same reason the files are never deleted along
+    with a recipe, another recipe may use them.
+    """
+    name = posixpath.join(IMAGE_DIR, uploaded.sha256 + extension)
+    if not default_storage.exists(name):
+        # The file system storage moves the temporary file into place, other
+        # storages copy it over in chunks
+        save_once(name, uploaded)
+    return name
+
+
+def save_once(name, content):
+    """Save the content under exactly this name, unless it's there already
+
+    Between exists() and save() a concurrent upload of the same image can save
+    it first, then the storage picks another name for ours. The content is the
+    same (the name is its hash), so drop our copy and keep the name.
+    """
+    saved = default_storage.save(name, content)
+    if saved != name:
+        default_storage.delete(saved)
+    return name
+
+
+def thumbnail_name(name, size):
+    """Return the name of the thumbnail of an image with the longest side size"""
+    root, extension = posixpath.splitext(name)
+    return '%s_%s.jpg' % (root, size)
+
+
+def thumbnail_names(name):
+    """Return the names of all the thumbnails of an image"""
+    return [
+        thumbnail_name(name, size) for size in getattr(settings, 'RECIPE_THUMBNAIL_SIZES', ())
+    ]
+
+
+def thumbnail_urls(name):
+    """Return the urls of the thumbnails of an image by their size"""
+    return {
+        str(size): default_storage.url(thumbnail_name(name, size))
+        for size in getattr(settings, 'RECIPE_THUMBNAIL_SIZES', ())
+    }
+
+
+def make_thumbnails(name):
+    """Make the missing thumbnails of the stored image, return the names made
+
+    Needs Pillow, which is only imported here so the rest of the app works
+    without it. This runs in the background (see recipe.tasks), never on the
+    request thread.
+    """
+    from PIL import Image
+
+    made = []
+    for size in getattr(settings, 'RECIPE_THUMBNAIL_SIZES', ()):
+        thumbnail = thumbnail_name(name, size)
+        # The same image uploaded before already has its thumbnails
+        if default_storage.exists(thumbnail):
+            continue
+
+        with default_storage.open(name) as source:
+            image = Image.open(source)
+            # Lets the JPEG decoder scale down while decoding, much faster for photos
+            image.draft('RGB', (size, size))
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85, optimize=True)
+
+        made.append(save_once(thumbnail, ContentFile(buffer.getvalue())))
+    return made
+
+
+# Only for when Django serves the media itself, normally the web server in front
+# of it serves the MEDIA_ROOT with the same cache headers
+@require_safe
+def serve_image(request, path):
+    """Serve a stored image or thumbnail, cached by clients for a year"""
+    path = posixpath.normpath(path).lstrip('/')
+    if not path.startswith(IMAGE_DIR + '/') or not default_storage.exists(path):
+        raise Http404('Image not found')
+
+    # The name is the hash of the content, so it's a perfect ETag
+    etag = quote_etag(posixpath.splitext(posixpath.basename(path))[0])
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response = FileResponse(default_storage.open(path), content_type=content_type)
+        response['Content-Length'] = default_storage.size(path)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
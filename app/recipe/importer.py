@@ -0,0 +1,139 @@
+import json
+
+from django.db import transaction
+
+from core.bulk import bulk_insert, bulk_insert_rows
+from core.db.sharding import shard_for_user
+from core.models import Tag, Ingredient, Recipe
+from recipe.cache import invalidate_list_cache
+from recipe.serializers import RecipeImportSerializer
+
+
+# SQLite allows at most 999 parameters in a query, so look names up in chunks
+NAME_LOOKUP_CHUNK = 500
+
+# The errors kept for the response, the rest is only counted
+MAX_ERRORS = 100
+
+
+class RecipeImporter:
+    """Import recipes for a user from newline delimited JSON (NDJSON)
+
+    Every line is a single recipe with its tags and ingredients as names:
+      {"title": "Soup", "time_minutes": 10, "price": "5.00", "tags": ["Vegan"]}
+
+    The lines are read one by one and written in batches, so memory use only
+    depends on the batch size and not the size of the import. Invalid lines are
+    skipped instead of aborting the whole import, the first max_errors of them are
+    collected in 'errors' and all of them counted in 'error_count'.
+    """
+
+    def __init__(self, user, batch_size=1000, max_errors=MAX_ERRORS):
+        self.user = user
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+
+    def run(self, lines):
+        """Import all the lines, an iterable of str or bytes"""
+        batch = []
+        for number, line in enumerate(lines, 1):
+            data = self.parse_line(number, line)
+            if data is None:
+                continue
+
+            batch.append(data)
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+
+        if batch:
+            self.write_batch(batch)
+
+        return self
+
+    def parse_line(self, number, line):
+        """Return the validated data of a line, or None when it's empty or invalid"""
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                return None
+            data = json.loads(line)
+        except ValueError as error:
+            self.add_error(number, [str(error)])
+            return None
+
+        serializer = RecipeImportSerializer(data=data)
+        if not serializer.is_valid():
+            self.add_error(number, serializer.errors)
+            return None
+
+        return serializer.validated_data
+
+    def add_error(self, number, errors):
+        """Record an invalid line, an import of only bad lines must not grow memory"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': number, 'errors': errors})
+
+    def write_batch(self, batch):
+        """Write a batch of recipes with their tags and ingredients"""
+        # Everything of the user is written to the shard the user is on
+        db = shard_for_user(self.user)
+
+        with transaction.atomic(using=db):
+            tag_ids = self.resolve_names(Tag, {n for data in batch for n in data['tags']}, db)
+            ingredient_ids = self.resolve_names(
+                Ingredient, {n for data in batch for n in data['ingredients']}, db
+            )
+
+            recipes = bulk_insert(Recipe, [
+                Recipe(
+                    user=self.user,
+                    title=data['title'],
+                    time_minutes=data['time_minutes'],
+                    price=data['price'],
+                    link=data.get('link', ''),
+                ) for data in batch
+            ], using=db)
+
+            # Write the many to many rows straight into the through tables,
+            # a set per recipe drops names that were given twice
+            bulk_insert_rows(Recipe.tags.through, ['recipe', 'tag'], (
+                (recipe.id, tag_id)
+                for recipe, data in zip(recipes, batch)
+                for tag_id in {tag_ids[name] for name in data['tags']}
+            ), using=db)
+            bulk_insert_rows(Recipe.ingredients.through, ['recipe', 'ingredient'], (
+                (recipe.id, ingredient_id)
+                for recipe, data in zip(recipes, batch)
+                for ingredient_id in {ingredient_ids[name] for name in data['ingredients']}
+            ), using=db)
+
+        # The bulk inserts don't send signals, so invalidate the cached lists and the
+        # ETags ourselves. After the commit, so nobody caches the old rows under the
+        # new version (the version is on the default database, not the shard)
+        invalidate_list_cache(self.user.pk)
+
+        self.created += len(recipes)
+
+    def resolve_names(self, model, names, db):
+        """Return a dict of name -> id for the user, creating the missing names"""
+        ids = {}
+        names = sorted(names)
+        for start in range(0, len(names), NAME_LOOKUP_CHUNK):
+            # Names aren't unique, so when there are duplicates use the oldest one
+            existing = model.objects.using(db).filter(
+                user=self.user, name__in=names[start:start + NAME_LOOKUP_CHUNK]
+            ).order_by('-id').values_list('name', 'id')
+            ids.update(existing)
+
+        missing = [model(user=self.user, name=name) for name in names if name not in ids]
+        for obj in bulk_insert(model, missing, using=db):
+            ids[obj.name] = obj.id
+
+        return ids
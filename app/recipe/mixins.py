@@ -0,0 +1,86 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.conf import settings
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from core.db.routers import SAFE_METHODS
+from core.db.sharding import check_shard_writable
+from core.models import DataVersion
+from recipe.cache import get_list_cache, list_cache_enabled, list_cache_key
+
+
+class ConditionalListMixin:
+    """Answer list requests with 304 Not Modified when the user's data is unchanged
+
+    The ETag comes from the user's DataVersion, which is bumped on every change,
+    so a matching If-None-Match is answered without running the list query or
+    the serializer. There is no Last-Modified: with its one second resolution a
+    second write in the same second would still be answered with a 304.
+    """
+
+    def list(self, request, *args, **kwargs):
+        version = DataVersion.objects.get_for_user(request.user.pk)[0]
+        # The CachedListMixin keys the cached lists on the same version
+        self.data_version = version
+
+        # Every url (filters, search, cursor, page size) and format is another body
+        variant = hashlib.md5('{} {}'.format(
+            request.get_full_path(), request.accepted_renderer.format
+        ).encode('utf-8')).hexdigest()[:16]
+        etag = quote_etag('%s.%s.%s' % (request.user.pk, version, variant))
+
+        # Returns the 304 response when the If-None-Match matches
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+
+        response['ETag'] = etag
+
+        # The same url returns different data for every user, and every format
+        patch_vary_headers(response, ('Authorization', 'Accept'))
+        return response
+
+
+class CachedListMixin:
+    """Cache the list responses per user and url in Django's cache framework
+
+    The key contains the user's data version (see recipe.cache), so a cached
+    list is only ever served for the exact data it was made of. Put it after
+    ConditionalListMixin, which reads that version already.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not list_cache_enabled():
+            return super().list(request, *args, **kwargs)
+
+        version = getattr(self, 'data_version', None)
+        if version is None:
+            version = DataVersion.objects.get_for_user(request.user.pk)[0]
+
+        cache = get_list_cache()
+        key = list_cache_key(
+            self.queryset.model, request.user.pk, version, request.build_absolute_uri()
+        )
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'RECIPE_LIST_CACHE_TTL', 300))
+        return response
+
+
+class ShardWriteMixin:
+    """Check the shard of the user before a write, refusing it while the user moves
+
+    The authenticated user comes from the token cache, which may not know yet
+    that the user moved to another shard, so writes look the shard up again.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            check_shard_writable(request.user)
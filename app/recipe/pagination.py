@@ -0,0 +1,178 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Opaque cursor pagination over a unique, composite ordering key"""
+
+    # Default amount of objects per page, the client can ask for a different,
+    # page size with "?page_size=" but never more than the max_page_size
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    # Used when the view doesn't define its own 'ordering' attribute.
+    # IMPORTANT: The ordering MUST be unique, so always end with the primary key
+    ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return a single page of objects that come after the cursor"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+
+        # The cursor is a tuple of (position, reverse) or None for the first page
+        cursor = self.decode_cursor(request)
+        position, reverse = cursor if cursor else (None, False)
+        if position is not None:
+            position = self.coerce_position(queryset, position)
+
+        # When paging backwards we walk the index the other way around and,
+        # flip the results afterwards so the client always sees the same order
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+
+        # Fetch one extra row so we know if there is another page or not,
+        # this keeps us from having to run an expensive COUNT(*) query
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        """Wrap the serialized page with the links to the next/previous page"""
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        """Return the page size requested by the client, capped at the max"""
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        """Return the url to the next page or None on the last page"""
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        """Return the url to the previous page or None on the first page"""
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._get_position(self.page[0]), reverse=True)
+
+    def get_keyset_filter(self, ordering, position):
+        """Build the filter that selects the rows after position in ordering"""
+        # For ordering (a, b, c) this builds the expanded tuple comparison:
+        #   a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        # Django has no row value comparison so we have to spell it out
+        keyset = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset |= equal & Q(**{'{}__{}'.format(name, lookup): value})
+            equal &= Q(**{name: value})
+
+        # The redundant bound on the first column lets the database start the,
+        # index scan at the cursor, instead of filtering from the start of the index
+        first = ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{'{}__{}'.format(first.lstrip('-'), bound): position[0]}) & keyset
+
+    def coerce_position(self, queryset, position):
+        """Convert the cursor values to the types of the ordering fields, 404 when invalid
+
+        The cursor comes from the client, so a value of the wrong type must not
+        reach the query (and turn into a 500 there).
+        """
+        values = []
+        for field_name, value in zip(self.ordering, position):
+            # Only plain JSON scalars are ever written into a cursor (bool is an int)
+            if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                values.append(_ordering_field(queryset, field_name).to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def decode_cursor(self, request):
+        """Decode the cursor from the query params, raises a 404 when invalid"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            # Add the padding back that was stripped when encoding
+            padded = encoded + '=' * (-len(encoded) % 4)
+            data = json.loads(urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            position, reverse = data['p'], bool(data.get('r', False))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        """Return the url of the current request with the given cursor"""
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(data, separators=(',', ':')).encode('utf-8')
+        ).decode('ascii').rstrip('=')
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def _get_position(self, instance):
+        """Return the values of the ordering fields for the given instance"""
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+
+def _ordering_field(queryset, field_name):
+    """Return the model field or annotation (like the search rank) for an ordering"""
+    name = field_name.lstrip('-')
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    try:
+        return queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        raise ValueError('Unknown ordering field %s' % name)
+
+
+def _reverse_ordering(ordering):
+    """Flip the direction of every field in the ordering tuple"""
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
@@ -0,0 +1,47 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (
+    BigIntegerField, Case, ExpressionWrapper, F, FloatField, IntegerField, Q, Value, When
+)
+from django.db.models.functions import Cast
+
+
+# Must be the same configuration as the trigger in core migration 0008
+SEARCH_CONFIG = 'english'
+
+# The rank is returned as an integer, so the keyset pagination can compare it exactly
+RANK_SCALE = 1000000
+
+
+def search_recipes(queryset, query):
+    """Filter the recipes on the words in query and annotate them with a 'rank'
+
+    On Postgres this uses the maintained search vector and its GIN index. On
+    other databases (SQLite in development) every word has to be in the title
+    and recipes where a word starts the title rank higher.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        rank = ExpressionWrapper(
+            SearchRank(F('search_vector'), search_query) * Value(RANK_SCALE),
+            output_field=FloatField()
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=Cast(rank, BigIntegerField())
+        )
+
+    words = query.split()
+    if not words:
+        return queryset.none()
+
+    matches = Q()
+    rank = Value(0, output_field=IntegerField())
+    for word in words:
+        matches &= Q(title__icontains=word)
+        rank = rank + Case(
+            When(title__istartswith=word, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField()
+        )
+
+    return queryset.filter(matches).annotate(rank=rank)
@@ -1,5 +1,116 @@
+import re
+from django.core.files.storage import default_storage
+from django.db import connections, router, transaction
+from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+from rest_framework.relations import MANY_RELATION_KWARGS
+from core.models import DataVersion, Tag, Ingredient, Recipe
+from recipe.images import (
+    hash_file, max_image_size, sniff_extension, store_image, thumbnail_names, thumbnail_urls
+)
+
+# The largest value of an integer column (Recipe.time_minutes) on Postgres
+MAX_INTEGER = 2147483647
+
+# A pk sent as a string, like the values of a form
+PK_STRING = re.compile(r'\A[0-9]+\Z')
+
+
+class UserOwnedManyRelatedField(serializers.ManyRelatedField):
+    """Many related field that validates ALL the given pks with one IN query"""
+
+    default_error_messages = {
+        'does_not_exist': _('Invalid pks {pk_values} - objects do not exist.'),
+    }
+
+    def to_internal_value(self, data):
+        """Return the objects for the pks in the given order, without duplicates"""
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        for item in data:
+            # Only whole numbers: int() would truncate 1.9 to pk 1. Booleans are
+            # ints in Python, but True is not a valid pk
+            if isinstance(item, int) and not isinstance(item, bool):
+                pks.append(item)
+            elif isinstance(item, str) and PK_STRING.match(item):
+                pks.append(int(item))
+            else:
+                self.child_relation.fail('incorrect_type', data_type=type(item).__name__)
+
+        # A single query for all the pks, instead of one query for each pk
+        objects = self.child_relation.get_queryset().in_bulk(set(pks))
+
+        # Report all the missing (or other user's) pks at once
+        missing = [pk for pk in dict.fromkeys(pks) if pk not in objects]
+        if missing:
+            self.fail('does_not_exist', pk_values=missing)
+
+        return [objects[pk] for pk in dict.fromkeys(pks)]
+
+
+class UserOwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key related field limited to the objects of the request's user"""
+
+    def get_queryset(self):
+        """Only the objects owned by the user from the request in the context"""
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset.none()
+        return queryset.for_user(request.user)
+
+    # Called instead of __init__ with many=True, see RelatedField.many_init
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return UserOwnedManyRelatedField(**list_kwargs)
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """List serializer that creates all the objects with one multi-row INSERT"""
+
+    # Upper limit of objects in a single request, to keep the INSERT bounded
+    max_length = 1000
+
+    def to_internal_value(self, data):
+        """Validate all the items in one pass, rejecting too large lists"""
+        if isinstance(data, list) and len(data) > self.max_length:
+            msg = _('Ensure this list has no more than {max_length} items.')
+            raise serializers.ValidationError(
+                msg.format(max_length=self.max_length), code='max_length'
+            )
+
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        """Insert all the objects at once and return them in input order"""
+        model = self.child.Meta.model
+        objects = [model(**attrs) for attrs in validated_data]
+
+        # Only some databases (Postgres) give us the new ids back from a bulk insert,
+        # on the others we have to save one by one to know the ids
+        # (With the objects as hint, the router picks the shard of their user)
+        db = router.db_for_write(model, instance=objects[0]) if objects \
+            else router.db_for_write(model)
+        if connections[db].features.can_return_ids_from_bulk_insert:
+            objects = model.objects.using(db).bulk_create(objects)
+
+            # A bulk insert doesn't send the post_save signals that bump the version
+            for user_id in {obj.user_id for obj in objects}:
+                DataVersion.objects.bump(user_id)
+            return objects
+
+        with transaction.atomic(using=db):
+            for obj in objects:
+                obj.save(using=db)
+        return objects
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -8,25 +119,161 @@ class RecipeSerializer(serializers.ModelSerializer):
     # PrimaryKeyRelatedFiled may be used to represent the target of the relationship
     # using its pk. So this basically makes sure that only the related ingredient
     # objects, will return only the ids. Which we can use later on
-    ingredients = serializers.PrimaryKeyRelatedField(
+    # The user owned version only accepts the user's own objects and looks all,
+    # the pks up in a single query
+    ingredients = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
 
+    # Set with the upload-image action (RecipeImageSerializer)
+    image = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = (
             'id', 'title', 'ingredients', 'tags',
-            'time_minutes', 'price', 'link',
+            'time_minutes', 'price', 'link', 'image', 'thumbnails',
         )
 
         # Prevent use from updating id
         read_only_fields = ('id',)
 
+    def get_image(self, recipe):
+        return image_url(recipe)
+
+    def get_thumbnails(self, recipe):
+        return image_thumbnails(recipe)
+
+    # PUT or PATCH request, the default update calls .set() for the relations
+    def update(self, instance, validated_data):
+        """Update a recipe, only writing the changed tags and ingredients"""
+        relations = {
+            field: validated_data.pop(field)
+            for field in ('tags', 'ingredients') if field in validated_data
+        }
+
+        recipe = super().update(instance, validated_data)
+
+        changed = False
+        for field, objects in relations.items():
+            changed |= self._write_relation_delta(recipe, field, objects)
+
+        # The through table writes don't send m2m_changed signals
+        if changed:
+            DataVersion.objects.bump(recipe.user_id)
+
+        return recipe
+
+    def _write_relation_delta(self, recipe, field, objects):
+        """Make the relation match objects with one read, one insert and one delete
+
+        Returns if anything changed, when nothing did no writes are done at all
+        """
+        through = getattr(Recipe, field).through
+        column = Recipe._meta.get_field(field).m2m_reverse_field_name() + '_id'
+        # The through rows are on the shard of the recipe
+        db = recipe._state.db
+        rows = through.objects.using(db).filter(recipe_id=recipe.id)
+
+        current = set(rows.values_list(column, flat=True))
+        wanted = {obj.pk for obj in objects}
+        added = wanted - current
+        removed = current - wanted
+
+        if added:
+            through.objects.using(db).bulk_create(
+                [through(recipe_id=recipe.id, **{column: pk}) for pk in added]
+            )
+        if removed:
+            rows.filter(**{column + '__in': removed}).delete()
+
+        return bool(added or removed)
+
+
+def image_url(recipe):
+    """Return the url of the image of the recipe, None without an image"""
+    return recipe.image.url if recipe.image else None
+
+
+def image_thumbnails(recipe):
+    """Return the thumbnail urls by size, empty until the background job made them"""
+    return thumbnail_urls(recipe.image.name) if recipe.image and recipe.thumbnails_ready else {}
+
+
+def image_too_large_message():
+    """Return the error for an image larger than RECIPE_IMAGE_MAX_SIZE"""
+    return _('Ensure the image is at most {size} bytes.').format(size=max_image_size())
+
+
+class RecipeImageSerializer(serializers.Serializer):
+    """Serializer for uploading the image of a recipe"""
+    image = serializers.FileField(allow_empty_file=False, write_only=True)
+
+    def validate_image(self, value):
+        """Only accept images (by their content) up to RECIPE_IMAGE_MAX_SIZE"""
+        # The HashingUploadHandler stops too large uploads and sets the sha256 while
+        # the file is streamed in, files that came in another way are checked here
+        if value.size > max_image_size():
+            raise serializers.ValidationError(image_too_large_message())
+        if not hasattr(value, 'sha256'):
+            value.sha256 = hash_file(value)
+
+        value.extension = sniff_extension(value)
+        if value.extension is None:
+            raise serializers.ValidationError(_('Upload a JPEG, PNG, GIF or WebP image.'))
+        return value
+
+    def update(self, instance, validated_data):
+        """Store the image under its content hash and set it on the recipe"""
+        uploaded = validated_data['image']
+        name = store_image(uploaded, uploaded.extension)
+
+        if instance.image.name != name:
+            instance.image.name = name
+            # The same image was uploaded before when its thumbnails are there already
+            instance.thumbnails_ready = all(
+                default_storage.exists(thumbnail) for thumbnail in thumbnail_names(name)
+            )
+            instance.save(update_fields=['image', 'thumbnails_ready'])
+        return instance
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'image': image_url(instance),
+            'thumbnails': image_thumbnails(instance),
+        }
+
+
+class RecipeImportSerializer(serializers.ModelSerializer):
+    """Serializer for a single line of a recipe import"""
+
+    # In an import the tags and ingredients are referenced by name, since the
+    # ids of the system the recipes come from mean nothing to us
+    ingredients = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        default=list
+    )
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        default=list
+    )
+    # The rows are bulk inserted, so an out of range value would fail the whole
+    # batch in the database instead of just this line
+    time_minutes = serializers.IntegerField(min_value=0, max_value=MAX_INTEGER)
+
+    class Meta:
+        model = Recipe
+        fields = ('title', 'ingredients', 'tags', 'time_minutes', 'price', 'link')
+
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Serializer for the ingredient objects"""
@@ -36,6 +283,9 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
         read_only_fields = ('id',)
 
+        # Used when the serializer is created with many=True
+        list_serializer_class = BulkCreateListSerializer
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Serializer for the tag objects"""
@@ -44,3 +294,6 @@ class TagSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ('id', 'name')
         read_only_fields = ('id',)
+
+        # Used when the serializer is created with many=True
+        list_serializer_class = BulkCreateListSerializer
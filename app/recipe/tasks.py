@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from core.jobs import task
+from core.models import DataVersion, Recipe
+from recipe.images import make_thumbnails
+from recipe.importer import RecipeImporter
+
+
+# On their own queue, a burst of uploads shouldn't hold up the other jobs
+@task(queue='images')
+def make_recipe_thumbnails(user_id, recipe_id):
+    """Make the thumbnails of the image of a recipe"""
+    recipe = Recipe.objects.for_user(user_id).filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return []
+
+    made = make_thumbnails(recipe.image.name)
+
+    # Only when the recipe still has the same image, it may have been replaced since
+    if Recipe.objects.using(recipe._state.db).filter(
+        pk=recipe_id, image=recipe.image.name
+    ).update(thumbnails_ready=True):
+        DataVersion.objects.bump(user_id)
+    return made
+
+
+# The imports too large to run in the request (see RecipeViewSet.import_recipes)
+# Never retried, the batches written before a failure would be imported twice
+@task(max_attempts=1)
+def import_recipe_file(user_id, name):
+    """Import the NDJSON recipes stored under the name for a user, then delete them"""
+    try:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+
+        importer = RecipeImporter(user=user)
+        with default_storage.open(name) as lines:
+            importer.run(lines)
+    finally:
+        default_storage.delete(name)
+
+    return {
+        'created': importer.created,
+        'errors': importer.errors,
+        'error_count': importer.error_count,
+    }
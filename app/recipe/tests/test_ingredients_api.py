@@ -1,16 +1,18 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Ingredient
+from recipe.cache import get_list_cache
+from core.models import DataVersion, Ingredient
 from recipe.serializers import IngredientSerializer
 
 # We're using a viewset for the tag api endpoint, which means
 # that we can specify which viewset we want with the "-"
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
+AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
 
 
 class PublicIngredientsApiTest(TestCase):
@@ -31,6 +33,8 @@ class PrivateIngredientsApiTest(TestCase):
 
     def setUp(self):
         """Setup the api client and authenticated user to list ingredients"""
+        # Ids are reused between tests, so don't let cached lists leak between them
+        get_list_cache().clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             email='test@vazkir.com',
@@ -57,7 +61,7 @@ class PrivateIngredientsApiTest(TestCase):
 
         # Make sure the lists from the serializer and we added are the same,
         # so same items and same reversed ordering
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
     def test_ingredients_limited_to_user(self):
         """Test that tags returned are for current authenticated user"""
@@ -77,8 +81,23 @@ class PrivateIngredientsApiTest(TestCase):
         response = self.client.get(INGREDIENTS_URL)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], new_ingredient.name)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], new_ingredient.name)
+
+    def test_ingredients_paginated_with_duplicate_names(self):
+        """Test that ingredients with the same name are not skipped between pages"""
+        for name in ['Salt', 'Salt', 'Salt', 'Pepper']:
+            Ingredient.objects.create(user=self.user, name=name)
+
+        first = self.client.get(INGREDIENTS_URL, {'page_size': 2})
+        second = self.client.get(first.data['next'])
+
+        # All ingredients are listed exactly once and the last page has no next page
+        names = [i['name'] for i in first.data['results'] + second.data['results']]
+        ids = [i['id'] for i in first.data['results'] + second.data['results']]
+        self.assertEqual(names, ['Salt', 'Salt', 'Salt', 'Pepper'])
+        self.assertEqual(len(set(ids)), 4)
+        self.assertIsNone(second.data['next'])
 
     def test_create_ingredient_successful(self):
         """Test creating a new ingredient"""
@@ -100,3 +119,108 @@ class PrivateIngredientsApiTest(TestCase):
 
         # Make sure this isn't actually added
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_ingredients(self):
+        """Test creating a list of ingredients in one request"""
+        payload = [{'name': 'Salt'}, {'name': 'Pepper'}, {'name': 'Basil'}]
+        response = self.client.post(INGREDIENTS_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([i['name'] for i in response.data], ['Salt', 'Pepper', 'Basil'])
+
+        # The ids are returned in the same order as the input
+        for item in response.data:
+            ingredient = Ingredient.objects.get(id=item['id'])
+            self.assertEqual(ingredient.name, item['name'])
+            self.assertEqual(ingredient.user, self.user)
+
+    def test_bulk_create_ingredients_invalid(self):
+        """Test that nothing is created when one of the items is invalid"""
+        payload = [{'name': 'Salt'}, {'name': ''}]
+        response = self.client.post(INGREDIENTS_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('name', response.data[1])
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_ingredients_etag_changes_on_bulk_create(self):
+        """Test that a bulk create (which sends no signals) changes the ETag"""
+        etag = self.client.get(INGREDIENTS_URL)['ETag']
+        self.client.post(INGREDIENTS_URL, [{'name': 'Salt'}], format='json')
+
+        response = self.client.get(INGREDIENTS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_ingredients_list_cached(self):
+        """Test that a repeated list is served from the cache"""
+        Ingredient.objects.create(user=self.user, name='Salt')
+        first = self.client.get(INGREDIENTS_URL)
+
+        # Only the data version query of the conditional GET is left
+        with self.assertNumQueries(1):
+            second = self.client.get(INGREDIENTS_URL)
+
+        self.assertEqual(second.data, first.data)
+
+    def test_ingredients_cache_invalidated(self):
+        """Test that creating, renaming and deleting invalidate the cached list"""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.client.get(INGREDIENTS_URL)
+
+        self.client.post(INGREDIENTS_URL, {'name': 'Pepper'})
+        names = [i['name'] for i in self.client.get(INGREDIENTS_URL).data['results']]
+        self.assertEqual(names, ['Salt', 'Pepper'])
+
+        salt.name = 'Sugar'
+        salt.save()
+        names = [i['name'] for i in self.client.get(INGREDIENTS_URL).data['results']]
+        self.assertEqual(names, ['Sugar', 'Pepper'])
+
+        salt.delete()
+        names = [i['name'] for i in self.client.get(INGREDIENTS_URL).data['results']]
+        self.assertEqual(names, ['Pepper'])
+
+    def test_ingredients_cache_follows_data_version(self):
+        """Test that a version bump without signals (other process) invalidates the list"""
+        Ingredient.objects.create(user=self.user, name='Salt')
+        self.client.get(INGREDIENTS_URL)
+
+        # Like a bulk insert of another process, which only bumps the version
+        Ingredient.objects.bulk_create([Ingredient(user=self.user, name='Pepper')])
+        DataVersion.objects.bump(self.user.pk)
+
+        names = [i['name'] for i in self.client.get(INGREDIENTS_URL).data['results']]
+        self.assertEqual(names, ['Salt', 'Pepper'])
+
+    @override_settings(RECIPE_LIST_CACHE_ENABLED=False)
+    def test_ingredients_cache_disabled(self):
+        """Test that the list query runs every time when the cache is off"""
+        Ingredient.objects.create(user=self.user, name='Salt')
+        self.client.get(INGREDIENTS_URL)
+
+        with self.assertNumQueries(2):
+            self.client.get(INGREDIENTS_URL)
+
+    def test_autocomplete_ingredients(self):
+        """Test the top prefix matches of the user, case insensitive"""
+        for name in ['Salt', 'salmon', 'Sage', 'Pepper', 'Sugar']:
+            Ingredient.objects.create(user=self.user, name=name)
+        other_user = get_user_model().objects.create_user('other@vazkir.com', 'test123')
+        Ingredient.objects.create(user=other_user, name='Saffron')
+
+        response = self.client.get(AUTOCOMPLETE_URL, {'q': 'SA', 'limit': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([i['name'] for i in response.data], ['Sage', 'salmon'])
+        self.assertEqual(set(response.data[0]), {'id', 'name'})
+
+    def test_autocomplete_empty_prefix(self):
+        """Test that no prefix returns no matches"""
+        Ingredient.objects.create(user=self.user, name='Salt')
+
+        response = self.client.get(AUTOCOMPLETE_URL, {'q': ''})
+
+        self.assertEqual(response.data, [])
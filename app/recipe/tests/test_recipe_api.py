@@ -1,16 +1,63 @@
+import base64
+import csv
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import call, patch
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe
+from core import jobs
+from core.models import Job, Recipe, Tag, Ingredient
+from recipe.cache import get_list_cache
+from recipe.images import HashingUploadHandler, save_once
+from recipe.importer import RecipeImporter
 from recipe.serializers import RecipeSerializer
+from recipe.tasks import make_recipe_thumbnails
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
 
 # We're using a viewset for the tag api endpoint, which means
 # that we can specify which viewset we want with the "-"
 RECIPES_URL = reverse('recipe:recipe-list')
+IMPORT_URL = reverse('recipe:recipe-import-recipes')
+EXPORT_URL = reverse('recipe:recipe-export')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    """Return the url of a single recipe"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def image_upload_url(recipe_id):
+    """Return the url to upload the image of a recipe"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+# A valid 1x1 pixel PNG image
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9aw'
+    'AAAABJRU5ErkJggg=='
+)
 
 
 # Test sample recipes we can use in our tests
@@ -77,7 +124,7 @@ class PrivateRecipesApiTest(TestCase):
 
         # Make sure the lists from the serializer and we added are the same,
         # so same items and same reversed ordering
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
     def test_recipes_limited_to_user(self):
         """Test that recipes returned are for current authenticated user"""
@@ -100,5 +147,592 @@ class PrivateRecipesApiTest(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_recipes_list_paginated(self):
+        """Test walking through the recipes with the cursor links"""
+        recipes = [sample_recipe(user=self.user, title=str(i)) for i in range(5)]
+        expected = [recipe.id for recipe in reversed(recipes)]
+
+        # Follow the next links until there are no pages left
+        seen = []
+        url = RECIPES_URL + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            last = response
+            url = response.data['next']
+
+        self.assertEqual(seen, expected)
+
+        # And the previous link of the last page brings us back a page
+        response = self.client.get(last.data['previous'])
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(ids, expected[2:4])
+        self.assertIsNone(self.client.get(RECIPES_URL).data['previous'])
+
+    def test_recipes_list_invalid_cursor(self):
+        """Test that a tampered cursor returns a 404"""
+        response = self.client.get(RECIPES_URL, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recipes_list_malformed_cursor_position(self):
+        """Test that a cursor with values of the wrong type returns a 404"""
+        sample_recipe(user=self.user)
+
+        for position in (['abc'], [{'x': 1}], [None], [[1]], [True]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({'p': position}).encode()
+            ).decode().rstrip('=')
+            response = self.client.get(RECIPES_URL, {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+        # The search ordering has an integer rank before the id
+        cursor = base64.urlsafe_b64encode(b'{"p":["high",1]}').decode().rstrip('=')
+        response = self.client.get(RECIPES_URL, {'search': 'Sample', 'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recipes_list_constant_queries(self):
+        """Test that listing recipes doesn't run queries per recipe (N+1)"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+
+        # The data version, the recipes, their ingredients and their tags:
+        # 4 queries at any size
+        for size in (1, 5, 20):
+            while Recipe.objects.filter(user=self.user).count() < size:
+                recipe = sample_recipe(user=self.user)
+                recipe.tags.add(tag)
+                recipe.ingredients.add(ingredient)
+
+            with self.assertNumQueries(4):
+                response = self.client.get(RECIPES_URL)
+            self.assertEqual(len(response.data['results']), size)
+            self.assertEqual(response.data['results'][0]['tags'], [tag.id])
+
+    def test_recipe_detail_constant_queries(self):
+        """Test that retrieving a recipe fetches its relations in constant queries"""
+        recipe = sample_recipe(user=self.user)
+        for i in range(10):
+            recipe.tags.add(Tag.objects.create(user=self.user, name='Tag %d' % i))
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=str(i)))
+
+        with self.assertNumQueries(3):
+            response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['tags']), 10)
+        self.assertEqual(len(response.data['ingredients']), 10)
+
+    def test_import_recipes(self):
+        """Test importing NDJSON recipes with tags and ingredients by name"""
+        existing = Tag.objects.create(user=self.user, name='Vegan')
+        lines = [
+            '{"title": "Soup", "time_minutes": 10, "price": "5.00", '
+            '"tags": ["Vegan", "Warm"], "ingredients": ["Salt"]}',
+            '',
+            'not json',
+            '{"title": "Salad", "time_minutes": 5, "price": "3.50", "tags": ["Vegan"]}',
+            '{"title": "", "time_minutes": 5, "price": "3.50"}',
+        ]
+        response = self.client.post(
+            IMPORT_URL, '\n'.join(lines), content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([e['line'] for e in response.data['errors']], [3, 5])
+        self.assertEqual(response.data['error_count'], 2)
+        self.assertIn('title', response.data['errors'][1]['errors'])
+
+        # The existing tag is reused and the missing names are created once
+        soup = Recipe.objects.get(user=self.user, title='Soup')
+        salad = Recipe.objects.get(user=self.user, title='Salad')
+        self.assertEqual(
+            sorted(soup.tags.values_list('name', flat=True)), ['Vegan', 'Warm']
+        )
+        self.assertEqual(list(salad.tags.all()), [existing])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(list(soup.ingredients.values_list('name', flat=True)), ['Salt'])
+
+    def test_import_recipes_large_runs_as_job(self):
+        """Test that an import over the size limit is stored and imported by a job"""
+        lines = [
+            '{"title": "Soup", "time_minutes": 10, "price": "5.00", "tags": ["Warm"]}',
+            'not json',
+        ]
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root, RECIPE_IMPORT_SYNC_MAX_SIZE=16
+        ):
+            response = self.client.post(
+                IMPORT_URL, '\n'.join(lines), content_type='application/x-ndjson'
+            )
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertFalse(Recipe.objects.exists())
+            status_url = reverse('recipe:recipe-import-status', args=[response.data['job']])
+            self.assertEqual(self.client.get(status_url).data['status'], Job.QUEUED)
+
+            jobs.Worker('default').work(burst=True)
+
+            self.assertEqual(os.listdir(os.path.join(media_root, 'imports')), [])
+
+        response = self.client.get(status_url)
+        self.assertEqual(response.data['status'], Job.DONE)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([e['line'] for e in response.data['errors']], [2])
+        self.assertTrue(Recipe.objects.filter(user=self.user, title='Soup').exists())
+
+        # Another user can't see the import
+        other = get_user_model().objects.create_user('other@vazkir.com', 'test123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_import_recipes_invalidates_cached_lists(self):
+        """Test that the tags created by an import show up in the cached tag list"""
+        get_list_cache().clear()
+        self.client.get(TAGS_URL)
+
+        RecipeImporter(user=self.user).run(
+            ['{"title": "Soup", "time_minutes": 10, "price": "5.00", "tags": ["Warm"]}']
+        )
+
+        names = [t['name'] for t in self.client.get(TAGS_URL).data['results']]
+        self.assertEqual(names, ['Warm'])
+
+    def test_import_batch_bumps_version_once(self):
+        """Test that every import batch invalidates the cached lists exactly once"""
+        with patch('recipe.importer.invalidate_list_cache') as invalidate:
+            RecipeImporter(user=self.user, batch_size=2).run([
+                '{"title": "Soup %d", "time_minutes": 10, "price": "5.00", "tags": ["Warm"]}' % n
+                for n in range(3)
+            ])
+
+        self.assertEqual(invalidate.call_args_list, [call(self.user.pk)] * 2)
+
+    def test_import_recipes_time_minutes_bounded(self):
+        """Test that an out of range time_minutes fails the line, not the batch"""
+        lines = [
+            '{"title": "Soup", "time_minutes": 10, "price": "5.00"}',
+            '{"title": "Stew", "time_minutes": 2147483648, "price": "5.00"}',
+            '{"title": "Salad", "time_minutes": -1, "price": "5.00"}',
+        ]
+        response = self.client.post(
+            IMPORT_URL, '\n'.join(lines), content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([e['line'] for e in response.data['errors']], [2, 3])
+        self.assertIn('time_minutes', response.data['errors'][0]['errors'])
+
+    def test_import_recipes_errors_capped(self):
+        """Test that only the first errors are kept and the rest is counted"""
+        importer = RecipeImporter(user=self.user, max_errors=2)
+        importer.run(['not json'] * 5 + ['{"title": "Soup", "time_minutes": 1, "price": "1"}'])
+
+        self.assertEqual([e['line'] for e in importer.errors], [1, 2])
+        self.assertEqual(importer.error_count, 5)
+        self.assertEqual(importer.created, 1)
+
+    def test_export_recipes_ndjson(self):
+        """Test exporting the recipes of the user as NDJSON"""
+        recipe = sample_recipe(user=self.user, title='Soup', link='http://soup')
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Warm'))
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+        sample_recipe(user=self.user, title='Salad')
+        sample_recipe(user=get_user_model().objects.create_user('other@vazkir.com', 'test123'))
+
+        response = self.client.get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([r['title'] for r in exported], ['Soup', 'Salad'])
+        self.assertEqual(exported[0]['tags'], ['Vegan', 'Warm'])
+        self.assertEqual(exported[0]['link'], 'http://soup')
+        self.assertEqual(exported[1]['ingredients'], [])
+
+    def test_export_recipes_csv(self):
+        """Test exporting the recipes of the user as CSV"""
+        recipe = sample_recipe(user=self.user, title='Soup, with salt')
+        recipe.ingredients.add(Ingredient.objects.create(user=self.user, name='Salt'))
+        recipe.ingredients.add(Ingredient.objects.create(user=self.user, name='Leek'))
+
+        response = self.client.get(EXPORT_URL, {'output': 'csv'})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['title'], 'Soup, with salt')
+        self.assertEqual(rows[0]['ingredients'], 'Leek|Salt')
+
+    def test_recipes_list_not_modified(self):
+        """Test that an unchanged list is answered with a 304 and no list query"""
+        sample_recipe(user=self.user)
+        response = self.client.get(RECIPES_URL)
+        etag = response['ETag']
+        # Only the ETag, Last-Modified can't tell two writes in the same second apart
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('Accept', response['Vary'])
+
+        # Only the data version is queried
+        with self.assertNumQueries(1):
+            response = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_recipes_list_etag_per_url(self):
+        """Test that the ETag of one url doesn't match another url's list"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        sample_recipe(user=self.user).tags.add(tag)
+        sample_recipe(user=self.user, title='Stew')
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        response = self.client.get(
+            RECIPES_URL, {'tags': str(tag.id)}, HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_recipes_list_etag_changes(self):
+        """Test that creating, changing relations and deleting change the ETag"""
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        etags = [self.client.get(RECIPES_URL)['ETag']]
+        for change in (lambda: recipe.tags.add(tag), lambda: recipe.delete()):
+            change()
+            response = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etags[-1])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etags.append(response['ETag'])
+
+        self.assertEqual(len(set(etags)), 3)
+
+    def test_filter_recipes_by_tags(self):
+        """Test returning recipes with any of the given tags"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        warm = Tag.objects.create(user=self.user, name='Warm')
+        soup = sample_recipe(user=self.user, title='Soup')
+        soup.tags.add(vegan, warm)
+        salad = sample_recipe(user=self.user, title='Salad')
+        salad.tags.add(vegan)
+        sample_recipe(user=self.user, title='Steak')
+
+        response = self.client.get(RECIPES_URL, {'tags': '%s,%s' % (vegan.id, warm.id)})
+
+        # Soup has both tags but is still listed only once
+        titles = [recipe['title'] for recipe in response.data['results']]
+        self.assertEqual(titles, ['Salad', 'Soup'])
+
+    def test_filter_recipes_match_all(self):
+        """Test returning recipes with all the given tags and ingredients"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        warm = Tag.objects.create(user=self.user, name='Warm')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        soup = sample_recipe(user=self.user, title='Soup')
+        soup.tags.add(vegan, warm)
+        soup.ingredients.add(salt)
+        stew = sample_recipe(user=self.user, title='Stew')
+        stew.tags.add(vegan, warm)
+        salad = sample_recipe(user=self.user, title='Salad')
+        salad.tags.add(vegan)
+        salad.ingredients.add(salt)
+
+        response = self.client.get(RECIPES_URL, {
+            'tags': '%s,%s' % (vegan.id, warm.id),
+            'ingredients': str(salt.id),
+            'match': 'all',
+        })
+
+        titles = [recipe['title'] for recipe in response.data['results']]
+        self.assertEqual(titles, ['Soup'])
+
+    def test_filter_recipes_invalid_ids(self):
+        """Test that ids that aren't numbers return a 400"""
+        response = self.client.get(RECIPES_URL, {'tags': '1,abc'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_recipes(self):
+        """Test searching recipes on their title, best matches first"""
+        sample_recipe(user=self.user, title='Tomato soup')
+        sample_recipe(user=self.user, title='Soup with tomato and basil')
+        sample_recipe(user=self.user, title='Tomato salad')
+        sample_recipe(user=get_user_model().objects.create_user(
+            'other@vazkir.com', 'test123'
+        ), title='Tomato soup')
+
+        response = self.client.get(RECIPES_URL, {'search': 'tomato soup'})
+
+        # Only recipes of the user that contain every word
+        titles = [recipe['title'] for recipe in response.data['results']]
+        self.assertEqual(sorted(titles), ['Soup with tomato and basil', 'Tomato soup'])
+
+    def test_search_recipes_paginated(self):
+        """Test that ranked search results can be paged through"""
+        for i in range(5):
+            sample_recipe(user=self.user, title='Soup %d' % i)
+        sample_recipe(user=self.user, title='Salad')
+
+        seen = []
+        url = RECIPES_URL + '?search=soup&page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen += [recipe['title'] for recipe in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(sorted(seen), ['Soup %d' % i for i in range(5)])
+
+    def test_create_recipe_with_tags_and_ingredients(self):
+        """Test creating a recipe with the user's tags and ingredients"""
+        tags = [Tag.objects.create(user=self.user, name=str(i)) for i in range(3)]
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        payload = {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [tag.id for tag in tags],
+            'ingredients': [salt.id],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(sorted(recipe.tags.values_list('id', flat=True)), payload['tags'])
+        self.assertEqual(list(recipe.ingredients.all()), [salt])
+
+    def test_create_recipe_foreign_tags_rejected(self):
+        """Test that another user's and unknown tags are all reported at once"""
+        other_user = get_user_model().objects.create_user('other@vazkir.com', 'test123')
+        own = Tag.objects.create(user=self.user, name='Vegan')
+        foreign = Tag.objects.create(user=other_user, name='Warm')
+        payload = {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [own.id, foreign.id, 9999],
+            'ingredients': [],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(foreign.id), response.data['tags'][0])
+        self.assertIn('9999', response.data['tags'][0])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_non_integer_tags_rejected(self):
+        """Test that pks which are no whole numbers are refused, not truncated"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        payload = {'title': 'Soup', 'time_minutes': 10, 'price': '5.00', 'ingredients': []}
+
+        for pks in ([tag.id + 0.5], ['1e3'], [' %d' % tag.id], [True]):
+            response = self.client.post(RECIPES_URL, dict(payload, tags=pks), format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, pks)
+            self.assertIn('Incorrect type', response.data['tags'][0])
+        self.assertFalse(Recipe.objects.exists())
+
+        response = self.client.post(RECIPES_URL, dict(payload, tags=[str(tag.id)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_recipe_relations_validated_in_one_query(self):
+        """Test that all the pks of a relation are validated with one query"""
+        tags = [Tag.objects.create(user=self.user, name=str(i)) for i in range(20)]
+        ingredients = [Ingredient.objects.create(user=self.user, name=str(i)) for i in range(20)]
+        serializer = RecipeSerializer(data={
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [tag.id for tag in tags],
+            'ingredients': [ingredient.id for ingredient in ingredients],
+        }, context={'request': SimpleNamespace(user=self.user)})
+
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid())
+
+        self.assertEqual(serializer.validated_data['tags'], tags)
+
+    def test_update_recipe_relations_delta(self):
+        """Test that an update only adds and removes the changed tags"""
+        keep = Tag.objects.create(user=self.user, name='Keep')
+        old = Tag.objects.create(user=self.user, name='Old')
+        new = Tag.objects.create(user=self.user, name='New')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(keep, old)
+        kept_row = Recipe.tags.through.objects.get(recipe=recipe, tag=keep).id
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'tags': [keep.id, new.id]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['tags']), sorted([keep.id, new.id]))
+        self.assertEqual(set(recipe.tags.all()), {keep, new})
+        # The unchanged row is left alone instead of being deleted and inserted again
+        self.assertEqual(Recipe.tags.through.objects.get(recipe=recipe, tag=keep).id, kept_row)
+        self.assertNotEqual(self.client.get(RECIPES_URL)['ETag'], etag)
+
+    def test_update_recipe_unchanged_relations_not_written(self):
+        """Test that no through table writes happen when the relations are unchanged"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(salt)
+        payload = {
+            'title': 'New title', 'time_minutes': 10, 'price': '10.00',
+            'tags': [tag.id], 'ingredients': [salt.id],
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(detail_url(recipe.id), payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'DELETE'))
+        ]
+        self.assertFalse([
+            sql for sql in writes
+            if 'core_recipe_tags' in sql or 'core_recipe_ingredients' in sql
+        ])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'New title')
+
+
+class RecipeImageUploadTests(TestCase):
+    """Test uploading the images of recipes"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('test@londonappdev.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, recipe, content, name='image.png'):
+        """Upload the content as the image of the recipe"""
+        return self.client.post(
+            image_upload_url(recipe.id),
+            {'image': SimpleUploadedFile(name, content)},
+            format='multipart'
+        )
+
+    def test_upload_image(self):
+        """Test that the image is stored under its content hash and thumbnails are queued"""
+        response = self.upload(self.recipe, PNG)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        name = 'recipes/%s.png' % hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(self.recipe.image.name, name)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertEqual(response.data['image'], '/media/' + name)
+        self.assertEqual(response.data['thumbnails'], {})
+
+        job = Job.objects.get(task=make_recipe_thumbnails.name)
+        self.assertEqual(job.queue, 'images')
+
+    def test_upload_same_image_deduplicated(self):
+        """Test that uploading the same image twice stores it only once"""
+        other = sample_recipe(user=self.user, title='Other')
+
+        self.upload(self.recipe, PNG, name='one.png')
+        self.upload(other, PNG, name='two.png')
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, other.image.name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'recipes'))), 1)
+
+    def test_save_once_after_concurrent_save(self):
+        """Test that an image saved by a concurrent upload in between is stored once"""
+        name = 'recipes/%s.png' % hashlib.sha256(PNG).hexdigest()
+        # The other upload saved it after our exists() said it wasn't there
+        default_storage.save(name, ContentFile(PNG))
+
+        self.assertEqual(save_once(name, ContentFile(PNG)), name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'recipes')), [
+            posixpath.basename(name)
+        ])
+
+    def test_upload_invalid_image(self):
+        """Test that files that are no images are refused"""
+        response = self.upload(self.recipe, b'not an image', name='image.png')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=16)
+    def test_upload_too_large(self):
+        """Test that images larger than the maximum are refused"""
+        response = self.upload(self.recipe, PNG)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('at most 16 bytes', str(response.data['image']))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'recipes')))
+
+    def test_upload_handler_stops_too_large(self):
+        """Test that the upload is stopped as soon as it passes the maximum size"""
+        handler = HashingUploadHandler(max_size=16)
+        handler.new_file('image', 'image.png', 'image/png', len(PNG))
+
+        with self.assertRaises(StopUpload) as raised:
+            handler.receive_data_chunk(PNG, 0)
+
+        self.assertTrue(raised.exception.connection_reset)
+        self.assertTrue(handler.too_large)
+
+    def test_upload_other_users_recipe(self):
+        """Test that the image of another user's recipe can't be set"""
+        other_user = get_user_model().objects.create_user('other@londonappdev.com', 'testpass')
+        recipe = sample_recipe(user=other_user)
+
+        response = self.upload(recipe, PNG)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_image_cached(self):
+        """Test that the images are served with long lived cache headers"""
+        url = self.upload(self.recipe, PNG).data['image']
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), PNG)
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Only the recipe images are served
+        self.assertEqual(self.client.get('/media/secret.txt').status_code, 404)
+
+    @skipUnless(PIL, 'Making thumbnails needs Pillow')
+    def test_make_thumbnails(self):
+        """Test that the job makes the thumbnails and lists them on the recipe"""
+        self.upload(self.recipe, PNG)
+
+        make_recipe_thumbnails(self.user.pk, self.recipe.pk)
+
+        response = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(set(response.data['thumbnails']), {'128', '512', '1024'})
+        for url in response.data['thumbnails'].values():
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, url[len('/media/'):])))
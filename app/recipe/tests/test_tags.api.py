@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from recipe.cache import get_list_cache
 from core.models import Tag
 from recipe.serializers import TagSerializer
 
@@ -16,6 +17,8 @@ class PrivateTagsApiTest(TestCase):
 
     def setUp(self):
         """Setup the api client and authenticated user to list tags"""
+        # Ids are reused between tests, so don't let cached lists leak between them
+        get_list_cache().clear()
         self.user = get_user_model().objects.create_user(
             email='test@vazkir.com',
             password='PasswordTest123'
@@ -61,7 +64,7 @@ class PrivateTagsApiTest(TestCase):
 
         # Make sure the lists from the serializer and we added are the same,
         # so same items and same reversed ordering
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
     def test_tags_limited_to_user(self):
         """Test that tags returned are for current authenticated user"""
@@ -79,8 +82,8 @@ class PrivateTagsApiTest(TestCase):
 
         response = self.client.get(TAGS_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], new_tag.name)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], new_tag.name)
 
 
 class PublicTagsApiTest(TestCase):
@@ -1,11 +1,36 @@
-from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
+import json
+import posixpath
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Count, Exists, OuterRef, Prefetch
+from django.db.models.functions import Upper
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from core import jobs
+from core.authentication import CachedTokenAuthentication
 from recipe import serializers
-from core.models import Tag, Ingredient, Recipe
+from recipe.exporter import export_recipes, to_csv, to_ndjson
+from recipe.images import HashingUploadHandler
+from recipe.importer import RecipeImporter
+from recipe.mixins import CachedListMixin, ConditionalListMixin, ShardWriteMixin
+from recipe.pagination import KeysetPagination
+from recipe.search import search_recipes
+from recipe.tasks import import_recipe_file, make_recipe_thumbnails
+from core.models import Job, Tag, Ingredient, Recipe
+
+# Where the imports run by a job are stored until the job has read them
+IMPORT_DIR = 'imports'
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ShardWriteMixin, ConditionalListMixin, viewsets.ModelViewSet):
     """Manage recipes in the database"""
 
     # Objects to use for this viewset
@@ -13,30 +38,239 @@ class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.RecipeSerializer
 
     # Our authentication methods
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
+    # Lists are paginated with a cursor on (user_id, id), newest recipes first
+    pagination_class = KeysetPagination
+    ordering = ('-id',)
+
     # IMPORTANT: Not a 'BaseRecipeAttrViewSet' because this method,
     # cannot return the objects sorted by 'name', since it does not have it
     def get_queryset(self):
         """Return recipes for the current authenticated user only"""
-        return self.queryset.filter(user=self.request.user)
+        # Prefetching fetches the ingredient and tag ids of ALL the recipes in,
+        # one query per relation, instead of 2 extra queries for every recipe
+        # The queries go to the shard the user is on
+        queryset = self.queryset.for_user(self.request.user).order_by(
+            *self.ordering
+        ).prefetch_related(
+            Prefetch('ingredients', queryset=Ingredient.objects.only('id')),
+            Prefetch('tags', queryset=Tag.objects.only('id')),
+        )
+
+        # Filter with ?tags=1,4&ingredients=7, add ?match=all to only return,
+        # the recipes that have ALL the given tags and ingredients
+        match_all = self.request.query_params.get('match') == 'all'
+        for field, through, column in (
+            ('tags', Recipe.tags.through, 'tag_id'),
+            ('ingredients', Recipe.ingredients.through, 'ingredient_id'),
+        ):
+            ids = self._params_to_ints(field)
+            if ids:
+                queryset = self._filter_related(queryset, through, column, ids, match_all)
+
+        # Search the titles with ?search=, the best matches come first
+        # The ordering is also what the pagination uses for its cursor
+        search = self.request.query_params.get('search', '').strip()
+        if search:
+            queryset = search_recipes(queryset, search)
+            self.ordering = ('-rank', '-id')
+            queryset = queryset.order_by(*self.ordering)
+
+        return queryset
+
+    # Override this to add the foreign keyed user to the recipe
+    def perform_create(self, serializer):
+        """Create a new recipe"""
+        serializer.save(user=self.request.user)
+
+    def _params_to_ints(self, field):
+        """Convert a comma separated query param like '1,4' to a set of ints"""
+        value = self.request.query_params.get(field)
+        if not value:
+            return set()
+
+        try:
+            return {int(item) for item in value.split(',')}
+        except ValueError:
+            raise ValidationError({field: _('Must be a comma separated list of ids.')})
+
+    def _filter_related(self, queryset, through, column, ids, match_all):
+        """Filter the recipes on their through table rows, without any JOIN
+
+        A JOIN on the through table gives a row per matching tag, which needs a
+        DISTINCT again. These subqueries are answered from the through table's,
+        (tag_id, recipe_id) index and never duplicate a recipe.
+        """
+        rows = through.objects.filter(**{column + '__in': ids})
+
+        if match_all:
+            # The recipes that have a through row for every single id
+            matching = rows.values('recipe_id').annotate(
+                matches=Count(column)
+            ).filter(matches=len(ids)).values('recipe_id')
+            return queryset.filter(id__in=matching)
+
+        # The recipes that have a through row for any of the ids
+        return queryset.annotate(
+            **{'has_' + column: Exists(rows.filter(recipe_id=OuterRef('pk')))}
+        ).filter(**{'has_' + column: True})
+
+    # POST /api/recipe/recipes/import/ with one JSON recipe per line (NDJSON)
+    # We read the raw request stream line by line, so the body is never parsed
+    # as a whole and the request.data isn't used here
+    # Bodies over RECIPE_IMPORT_SYNC_MAX_SIZE are stored and imported by a job, the
+    # response is a 202 with the job to poll at /api/recipe/recipes/import/<job>/
+    @action(methods=['post'], detail=False, url_path='import')
+    def import_recipes(self, request):
+        """Import recipes with their tags and ingredients by name"""
+        if self._content_length(request) > settings.RECIPE_IMPORT_SYNC_MAX_SIZE:
+            # Copied over in chunks, like the upload it's never in memory as a whole
+            name = default_storage.save(
+                posixpath.join(IMPORT_DIR, uuid.uuid4().hex + '.ndjson'), File(request.stream)
+            )
+            job = import_recipe_file.enqueue(request.user.pk, name)
+            return Response({'job': job.pk, 'status': job.status}, status=status.HTTP_202_ACCEPTED)
+
+        importer = RecipeImporter(user=request.user)
+        importer.run(request.stream or [])
+
+        return Response(
+            {
+                'created': importer.created,
+                'errors': importer.errors,
+                'error_count': importer.error_count,
+            },
+            status=status.HTTP_200_OK
+        )
+
+    # GET /api/recipe/recipes/import/<job>/ the state of an import run by a job,
+    # with the same created and errors as a direct import once it's done
+    @action(methods=['get'], detail=False, url_path=r'import/(?P<job_id>[0-9]+)')
+    def import_status(self, request, job_id=None):
+        """Return the state of an import of the user that runs as a job"""
+        try:
+            job = jobs.poll(job_id)
+        except Job.DoesNotExist:
+            raise NotFound()
+        # Only the user's own imports, the user is the first argument of the task
+        arguments = json.loads(job.arguments)
+        if job.task != import_recipe_file.name or arguments['args'][0] != request.user.pk:
+            raise NotFound()
 
+        data = {'job': job.pk, 'status': job.status}
+        if job.status == Job.DONE:
+            data.update(json.loads(job.result))
+        return Response(data, status=status.HTTP_200_OK)
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+    def _content_length(self, request):
+        """Return the size of the request body, 0 when it isn't given"""
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return 0
+
+    # POST /api/recipe/recipes/<id>/upload-image/ as multipart/form-data with an 'image'
+    # The file is streamed to a temporary file and hashed on the way, never held in
+    # memory as a whole. The thumbnails are made by a job on the images queue
+    @action(methods=['post'], detail=True, url_path='upload-image')
+    def upload_image(self, request, pk=None):
+        """Upload an image for a recipe"""
+        # Has to be set before anything reads the request body
+        handler = HashingUploadHandler(request)
+        request.upload_handlers = [handler]
+        recipe = self.get_object()
+
+        data = request.data
+        # The handler stopped the upload, so the image isn't in the data at all
+        if handler.too_large:
+            raise ValidationError({'image': [serializers.image_too_large_message()]})
+
+        serializer = serializers.RecipeImageSerializer(recipe, data=data)
+        serializer.is_valid(raise_exception=True)
+        recipe = serializer.save()
+
+        if not recipe.thumbnails_ready:
+            make_recipe_thumbnails.enqueue(request.user.pk, recipe.pk)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    # GET /api/recipe/recipes/export/?output=csv (the default is NDJSON)
+    # IMPORTANT: Not named 'format', since DRF uses that to pick the renderer
+    @action(methods=['get'], detail=False)
+    def export(self, request):
+        """Stream all the recipes of the user as NDJSON or CSV"""
+        recipes = export_recipes(request.user)
+
+        if request.query_params.get('output') == 'csv':
+            response = StreamingHttpResponse(to_csv(recipes), content_type='text/csv')
+            filename = 'recipes.csv'
+        else:
+            response = StreamingHttpResponse(
+                to_ndjson(recipes), content_type='application/x-ndjson'
+            )
+            filename = 'recipes.ndjson'
+
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
+class BaseRecipeAttrViewSet(ShardWriteMixin,
+                            ConditionalListMixin,
+                            CachedListMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base viewset for user owned recipe attributes"""
     # Our authentication methods
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
+    # Lists are paginated with a cursor on (user_id, name, id), the id is added,
+    # to break ties between objects with the same name so the order is stable
+    pagination_class = KeysetPagination
+    ordering = ('-name', '-id')
+
+    # The most matches the autocomplete action returns
+    autocomplete_max_limit = 50
+
     # This overridden method will be called when the viewset wants the model instances,
     # for this viewset. So we want to filter for only the current authenticated user
     # And this also orders the instance in reverse aplhabetical order
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
-        return self.queryset.filter(user=self.request.user).order_by('-name')
+        return self.queryset.for_user(self.request.user).order_by(*self.ordering)
+
+    # GET /api/recipe/tags/autocomplete/?q=veg&limit=10
+    # Returns the first names (alphabetically) of the user that start with 'q',
+    # the prefix match is answered from the (user_id, UPPER(name)) index
+    @action(methods=['get'], detail=False)
+    def autocomplete(self, request):
+        """Return the top matches for a name prefix, for autocompletion"""
+        prefix = request.query_params.get('q', '').strip()
+        if not prefix:
+            return Response([])
+
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.autocomplete_max_limit)
+        except ValueError:
+            raise ValidationError({'limit': _('Must be a number.')})
+
+        # Values instead of model instances and serializers, to keep this as fast as possible
+        matches = self.queryset.for_user(request.user).filter(
+            name__istartswith=prefix
+        ).order_by(Upper('name'), 'id').values('id', 'name')[:max(limit, 0)]
+
+        return Response(list(matches))
+
+    # A list of objects can be POSTed to create them all at once
+    def get_serializer(self, *args, **kwargs):
+        """Return a list serializer when a list of objects is given"""
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+
+        return super().get_serializer(*args, **kwargs)
 
     # Override this to add the foreign keyed user to the tag
     def perform_create(self, serializer):
@@ -1,9 +1,35 @@
+from contextlib import contextmanager
+
 from django.contrib.auth import get_user_model, authenticate
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 
 # The translation system
 from django.utils.translation import ugettext_lazy as _
 
+from core.hashing import HashingPoolSaturated
+
+
+class PasswordHashingBusy(APIException):
+    """The hashing pool is full, returned as a 503 with Retry-After"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many login or signup requests, please try again shortly.')
+    default_code = 'hashing_pool_saturated'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns this into the Retry-After header
+        self.wait = wait
+
+
+@contextmanager
+def hashing_backpressure():
+    """Turn a full hashing pool into a 503 for the client, inside the block"""
+    try:
+        yield
+    except HashingPoolSaturated as error:
+        raise PasswordHashingBusy(wait=error.wait)
+
 
 class AuthTokenSerializer(serializers.Serializer):
     """Serializer for the user authentication object"""
@@ -21,11 +47,12 @@ class AuthTokenSerializer(serializers.Serializer):
 
         # Tries to authenticate with django's build in authenticate function
         # The viewsets passes the request object via context to the Serializer
-        user = authenticate(
-            request=self.context.get('request'),
-            username=email,
-            password=password
-        )
+        with hashing_backpressure():
+            user = authenticate(
+                request=self.context.get('request'),
+                username=email,
+                password=password
+            )
 
         # Check if auth has failed
         if not user:
@@ -60,7 +87,8 @@ class UserSerializer(serializers.ModelSerializer):
 
         # This creates our user by using the get_user_model and
         # passing in our serialized data the the create_user function
-        return get_user_model().objects.create_user(**validated_data)
+        with hashing_backpressure():
+            return get_user_model().objects.create_user(**validated_data)
 
     # PUT or PATCH request, PUT updates whole object, PATCH only specified fields
     def update(self, instance, validated_data):
@@ -69,12 +97,13 @@ class UserSerializer(serializers.ModelSerializer):
         # You only do need to specify a default value for if it isn't set
         password = validated_data.pop('password', None)
 
-        # Pass it back to the super withouth the pasword
-        user = super().update(instance, validated_data)
-
-        # Is password is given than update it with the .set_password methods
+        # Is password is given than hash it with the .set_password methods, before
+        # anything is saved, so a full hashing pool leaves the user unchanged
         if password:
-            user.set_password(password)
-            user.save()
+            with hashing_backpressure():
+                instance.set_password(password)
+
+        # Pass it back to the super withouth the pasword, saving the new hash too
+        user = super().update(instance, validated_data)
 
         return user
@@ -1,4 +1,5 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
+from core.authentication import CachedTokenAuthentication
 from user.serializers import UserSerializer, AuthTokenSerializer
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
@@ -11,7 +12,7 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
 
     # Means by which the authentication happens,
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     # Level of access that the user has, so he/she most only be logged in
     # No special classes for now